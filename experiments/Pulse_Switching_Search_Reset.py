@@ -78,6 +78,8 @@ class ResetSearchExperiment(Experiment):
         self.arb.set_output(False, channel=2)
         self.arb.sample_freq = 12.0e9
         self.arb.waveform_output_mode = "WSPEED"
+        self.arb.abort()
+        self.arb.delete_all_waveforms()
         self.setup_AWG()
 
         self.analog_input = Task()
@@ -96,7 +98,6 @@ class ResetSearchExperiment(Experiment):
 
     def setup_AWG(self, *args):
         self.arb.abort()
-        self.arb.delete_all_waveforms()
         self.arb.reset_sequence_table()
 
         self.arb.set_output_route("DC", channel=1)
@@ -123,14 +124,12 @@ class ResetSearchExperiment(Experiment):
         for amp in self.amplitudes:
             waveform   = arb_pulse(np.sign(amp)*arb_voltage(abs(amp)))
             wf_data    = KeysightM8190A.create_binary_wf_data(waveform)
-            segment_id = self.arb.define_waveform(len(wf_data))
-            segment_ids.append(segment_id)
-            self.arb.upload_waveform(wf_data, segment_id)
+            # Pulses seen at earlier points are still on the AWG
+            segment_ids.append(self.arb.cached_waveform(wf_data))
 
         # NIDAQ trigger waveform
         nidaq_trig_wf = KeysightM8190A.create_binary_wf_data(np.zeros(3200), sync_mkr=1)
-        nidaq_trig_segment_id = self.arb.define_waveform(len(nidaq_trig_wf))
-        self.arb.upload_waveform(nidaq_trig_wf, nidaq_trig_segment_id)
+        nidaq_trig_segment_id = self.arb.cached_waveform(nidaq_trig_wf)
 
         settle_pts = int(640*np.ceil(self.settle_delay * 12e9 / 640))
         start_idxs = [0]
@@ -95,6 +95,8 @@ class ResetSearchLockinExperiment(Experiment):
         self.arb.set_output(False, channel=2)
         self.arb.sample_freq = 12.0e9
         self.arb.waveform_output_mode = "WSPEED"
+        self.arb.abort()
+        self.arb.delete_all_waveforms()
         self.setup_AWG()
 
         self.analog_input = Task()
@@ -113,7 +115,6 @@ class ResetSearchLockinExperiment(Experiment):
 
     def setup_AWG(self, *args):
         self.arb.abort()
-        self.arb.delete_all_waveforms()
         self.arb.reset_sequence_table()
 
         self.arb.set_output_route("DC", channel=1)
@@ -142,14 +143,12 @@ class ResetSearchLockinExperiment(Experiment):
         for amp in scaled_amps:
             waveform   = arb_pulse(np.sign(amp)*arb_voltage(abs(amp)))
             wf_data    = KeysightM8190A.create_binary_wf_data(waveform)
-            segment_id = self.arb.define_waveform(len(wf_data))
-            segment_ids.append(segment_id)
-            self.arb.upload_waveform(wf_data, segment_id)
+            # Pulses seen at earlier points are still on the AWG
+            segment_ids.append(self.arb.cached_waveform(wf_data))
 
         # NIDAQ trigger waveform
         nidaq_trig_wf = KeysightM8190A.create_binary_wf_data(np.zeros(3200), sync_mkr=1)
-        nidaq_trig_segment_id = self.arb.define_waveform(len(nidaq_trig_wf))
-        self.arb.upload_waveform(nidaq_trig_wf, nidaq_trig_segment_id)
+        nidaq_trig_segment_id = self.arb.cached_waveform(nidaq_trig_wf)
 
         settle_pts = int(640*np.ceil(self.lock.measure_delay() * 12e9 / 640))
         start_idxs = [0]
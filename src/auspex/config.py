@@ -10,6 +10,7 @@
 
 import os, os.path
 import sys
+import copy
 from shutil import move
 from io import StringIO
 try:
@@ -39,6 +40,10 @@ ConfigurationFile = None
 KernelDir         = None
 LogDir            = None
 
+# Where to cache the filter and instrument
+# registries between runs (None to disable)
+RegistryCacheDir  = None
+
 # ----- No Holzworth warning Start...
 # Added the followiing 25 Oct 2018 to test Instrument metaclass load introspection
 # minimization (during import) which, with holzworth.py module deltas in-turn,
@@ -94,6 +99,7 @@ class Loader(yaml.RoundTripLoader):
             self._root = os.path.split(stream.name)[0]
         except AttributeError:
             self._root = os.path.curdir
+        self.included = []
         super().__init__(stream)
 
     def include(self, node):
@@ -101,6 +107,7 @@ class Loader(yaml.RoundTripLoader):
         filename = os.path.abspath(os.path.join(
             self._root, shortname
         ))
+        self.included.append(filename)
         return Include(filename)
 
 class Dumper(yaml.RoundTripDumper):
@@ -112,6 +119,48 @@ class FlatDumper(yaml.RoundTripDumper):
     def include(self, data):
         return self.represent_mapping('tag:yaml.org,2002:map', data.data)
 
+# Parsed measurement files, keyed on their absolute paths
+meas_file_cache = {}
+
+def file_stamp(filenames):
+    """Modification times and sizes of the given files, which tell whether a cached parse is stale."""
+    stamp = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamp.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+def parse_meas_file(filename):
+    """Parse a measurement file and the files it includes, reusing the previous parse if none
+    of them has changed since. The result is shared, so it must not be modified."""
+    filename = os.path.abspath(filename)
+    cached = meas_file_cache.get(filename)
+    if cached is not None:
+        try:
+            if file_stamp(f for f, _, _ in cached['stamp']) == cached['stamp']:
+                return cached
+        except OSError:
+            pass
+
+    stamp = file_stamp([filename])
+    with open(filename, 'r') as fid:
+        Loader.add_constructor('!include', Loader.include)
+        load = Loader(fid)
+        code = load.get_single_data()
+        load.dispose()
+
+    cached = {'stamp': stamp + file_stamp(load.included), 'data': code, 'snapshot': None}
+    meas_file_cache[filename] = cached
+    return cached
+
+def meas_file_snapshot(filename=None):
+    """The measurement file flattened into a single YAML document, as saved with the data. This
+    is only serialized again once the files change, so all writers share the same text."""
+    cached = parse_meas_file(filename or meas_file or find_meas_file())
+    if cached['snapshot'] is None:
+        cached['snapshot'] = dump_meas_file(cached['data'], flatten=True)
+    return cached['snapshot']
+
 def load_meas_file(filename=None):
     global LogDir, KernelDir, AWGDir, meas_file
 
@@ -120,11 +169,8 @@ def load_meas_file(filename=None):
     else:
         meas_file = find_meas_file()
 
-    with open(meas_file, 'r') as fid:
-        Loader.add_constructor('!include', Loader.include)
-        load = Loader(fid)
-        code = load.get_single_data()
-        load.dispose()
+    # Callers are free to modify their settings, so hand out a copy of the cached parse
+    code = copy.deepcopy(parse_meas_file(meas_file)['data'])
 
     # Get the config values out of the measure_file.
     if not 'config' in code.keys():
@@ -162,6 +208,8 @@ def dump_meas_file(data, filename = "", flatten=False):
             yaml.dump(data, fid, Dumper=d)
         # Upon success
         move(filename+".tmp", filename)
+        # Don't rely on mtimes alone to notice files we have just rewritten
+        meas_file_cache.clear()
         with open(filename, 'r') as fid:
             contents = fid.read()
         return contents
@@ -9,9 +9,6 @@
 import json
 import sys
 import os
-import importlib
-import pkgutil
-import inspect
 import re
 import asyncio
 import base64
@@ -33,9 +30,6 @@ from auspex.filters.plot import Plotter, ManualPlotter
 from auspex.instruments.instrument import Instrument, SCPIInstrument, CLibInstrument, DigitizerChannel
 from auspex.stream import OutputConnector, DataStreamDescriptor, DataAxis
 from auspex.experiment import FloatParameter, IntParameter
-from auspex.instruments.X6 import X6Channel
-from auspex.instruments.alazar import AlazarChannel
-from auspex.instruments.dummydig import DummydigChannel
 from auspex.mixer_calibration import MixerCalibrationExperiment, find_null_offset
 
 def correct_resource_name(resource_name):
@@ -57,11 +51,22 @@ def quince(meas_file=None):
 
 class QubitExperiment(Experiment):
     """Experiment with a specialized run method for qubit experiments run via the QubitExpFactory."""
+    def instrument_dependencies(self):
+        """Instruments can list the instruments they depend on under *depends_on* in the
+        settings. The master AWG is always set up after the other AWGs."""
+        dependencies = {name: list(self.settings['instruments'][name].get('depends_on', [])) for name in self._instruments}
+        awgs = [name for name, instr in self._instruments.items() if instr.instrument_type and "AWG" in instr.instrument_type]
+        for name in awgs:
+            if self.settings['instruments'][name].get('master', False):
+                dependencies[name] += [awg for awg in awgs if awg != name]
+        return dependencies
+
     def init_instruments(self):
-        for name, instr in self._instruments.items():
-            instr_par = self.settings['instruments'][name]
-            logger.debug("Setting instr %s with params %s.", name, instr_par)
+        def configure(instr):
+            instr_par = self.settings['instruments'][instr.name]
+            logger.debug("Setting instr %s with params %s.", instr.name, instr_par)
             instr.set_all(instr_par)
+        self.setup_instruments("configure", configure)
 
         self.digitizers = [v for _, v in self._instruments.items() if "Digitizer" in v.instrument_type]
         self.awgs       = [v for _, v in self._instruments.items() if "AWG" in v.instrument_type]
@@ -124,8 +129,14 @@ class QubitExperiment(Experiment):
             socket = dig.get_socket(chan)
             self.loop.remove_reader(socket)
 
-        for name, instr in self._instruments.items():
-            instr.disconnect()
+        if not self.reusable:
+            for name, instr in self._instruments.items():
+                instr.disconnect()
+
+    def rearm(self, meta_file):
+        """Point a reusable experiment (see *QubitExpFactory.create*) at a new QGL meta file.
+        See *QubitExpFactory.rearm*."""
+        QubitExpFactory.rearm(self, meta_file)
 
     async def run(self):
         """This is run for each step in a sweep."""
@@ -171,7 +182,7 @@ class QubitExpFactory(object):
 
     @staticmethod
     def create(meta_file=None, meas_file=None, expname=None, calibration=False, save_data=True,
-               cw_mode=False, instr_filter=None, repeats=None, single_plotter=True):
+               cw_mode=False, instr_filter=None, repeats=None, single_plotter=True, reusable=False):
         """Create the experiment, but do not run the sweeps. If *cw_mode* is specified
         the AWGs will be operated in continuous waveform mode, and will not be stopped
         and started between succesive sweep points. The *calibration* argument is used
@@ -180,7 +191,10 @@ class QubitExpFactory(object):
         QGL that specifies which instruments are required and what the SegmentSweep axes
         are. The *expname* argument is simply used to set the output directory relative
         to the data directory. If *repeats* is defined this will overide the
-        number of segments gleaned from the meta_info"""
+        number of segments gleaned from the meta_info. A *reusable* experiment keeps its
+        instruments connected and its plot servers running between runs, and can be pointed
+        at a new meta file with *rearm* instead of being created again. Call *teardown* on
+        it once done."""
 
         # Figure out which config file we should use, defaulting to the supplied argument
         settings = config.load_meas_file(meas_file)
@@ -196,6 +210,9 @@ class QubitExpFactory(object):
         experiment.name            = expname
         experiment.cw_mode         = cw_mode
         experiment.repeats         = repeats
+        experiment.meas_file       = meas_file
+        experiment.instr_filter    = instr_filter
+        experiment.reusable        = reusable
 
         if meta_file:
             QubitExpFactory.load_meta_info(experiment, meta_file)
@@ -207,6 +224,51 @@ class QubitExpFactory(object):
 
         return experiment
 
+    @staticmethod
+    def rearm(experiment, meta_file):
+        """Re-arm a reusable experiment for a new QGL meta file. The instruments, filter graph
+        and plot servers are kept, and only the settings that follow from the meta file (sequence
+        files, segment counts and the segment axis) and the digitizer stream descriptors are
+        updated. The sweeps are reset to those in the settings. Raises a *ValueError* if the meta
+        file needs a different set of instruments or filters, in which case the experiment is
+        left as it was."""
+        if not experiment.reusable:
+            raise ValueError("Only experiments created with reusable=True can be re-armed.")
+
+        previous = {k: getattr(experiment, k) for k in ('settings', 'segment_axis', 'qubit_to_writer', 'writer_to_qubit') if hasattr(experiment, k)}
+        experiment.settings = config.load_meas_file(experiment.meas_file)
+        if hasattr(experiment, 'segment_axis'):
+            del experiment.segment_axis
+        QubitExpFactory.load_meta_info(experiment, meta_file)
+
+        if QubitExpFactory.enabled_nodes(experiment.settings, experiment.instr_filter) != QubitExpFactory.enabled_nodes(previous['settings'], experiment.instr_filter):
+            for k, v in previous.items():
+                setattr(experiment, k, v)
+            raise ValueError("Meta file {} needs different instruments or filters than this experiment.".format(meta_file))
+
+        # Sweeps and manual plots are added afresh for each run
+        experiment.clear_sweeps()
+        experiment.manual_plotters = []
+        experiment.manual_plotter_callbacks = []
+
+        for name, stream in experiment.stream_selectors.items():
+            _, descrip = QubitExpFactory.stream_descriptor(experiment, stream, experiment.settings['filters'][name])
+            experiment.output_connectors[name].set_descriptor(descrip)
+
+        if 'sweeps' in experiment.settings:
+            QubitExpFactory.load_parameter_sweeps(experiment)
+
+    @staticmethod
+    def enabled_nodes(settings, instr_filter=None):
+        """The names of the instruments and filters enabled in *settings*."""
+        instruments = {k for k, v in settings['instruments'].items() if 'enabled' not in v or v['enabled']}
+        if isinstance(instr_filter, (list, tuple)):
+            instruments = {k for k in instruments if k in instr_filter}
+        elif instr_filter is not None:
+            instruments = {k for k in instruments if instr_filter((k, settings['instruments'][k]))}
+        filters = {k for k, v in settings['filters'].items() if 'enabled' not in v or v['enabled']}
+        return instruments, filters
+
     @staticmethod
     def calibrate_mixer(qubit, mixer="control", first_cal="phase", write_to_file=True,
     offset_range = (-0.2,0.2), amp_range = (0.6,1.4), phase_range = (-np.pi/6,np.pi/6), nsteps = 51):
@@ -250,7 +312,6 @@ class QubitExpFactory(object):
         mce = MixerCalibrationExperiment(qubit, mixer=mixer)
         mce.add_manual_plotter(plt)
         mce.add_manual_plotter(plt2)
-        mce.leave_plot_server_open = True
         QubitExpFactory.load_instruments(mce, mce.instruments_to_enable)
         edges = [(mce.amplitude, buff.sink)]
         mce.set_graph(edges)
@@ -267,7 +328,6 @@ class QubitExpFactory(object):
         logger.info("Found first pass I offset of {}.".format(I1_offset))
         mce.I_offset.value = I1_offset
 
-        mce.first_exp = False # slight misnomer to indicate that no new plot is needed
         sweep_offset("Q_offset", offset_pts)
         Q1_amps = np.array([x[1] for x in buff.get_data()])
         try:
@@ -588,6 +648,20 @@ class QubitExpFactory(object):
         experiment.qubit_to_writer = qubit_to_writer
         experiment.writer_to_qubit = writer_to_qubit
 
+    @staticmethod
+    def find_instrument(instr_type):
+        """Return the concrete instrument class named *instr_type*, or None if there isn't one."""
+        if instr_type in ("Instrument", "SCPIInstrument", "CLibInstrument"):
+            return None
+        return auspex.instruments.registry.find_class(instr_type, Instrument)
+
+    @staticmethod
+    def find_filter(filt_type):
+        """Return the filter class named *filt_type*, or None if there isn't one."""
+        if filt_type == "Filter":
+            return None
+        return auspex.filters.registry.find_class(filt_type, Filter)
+
     @staticmethod
     def load_qubits(experiment):
         """Parse the settings files and add the list of qubits to the experiment as *experiment.qubits*,
@@ -603,24 +677,10 @@ class QubitExpFactory(object):
     @staticmethod
     def load_instruments(experiment, instr_filter=None):
         """Parse the instruments settings and instantiate the corresponding Auspex instruments by name.
-        This function first traverses all vendor instrument modules and constructs a map from the instrument names
-        to the relevant module members. To select only a subset of instruments, use an instrument_filter by either
+        Instrument classes are looked up in the instrument registry, so only the vendor modules referenced
+        by the settings are imported. To select only a subset of instruments, use an instrument_filter by either
         passing a list of instruments to be loaded by name, or a callable object that takes a (key, value) pair
         and returns a boolean. Example: instr_filter = lambda x: 'Holzworth' in x[1]['type'] or 'APS' in x[0]"""
-        modules = (
-            importlib.import_module('auspex.instruments.' + name)
-            for loader, name, is_pkg in pkgutil.iter_modules(auspex.instruments.__path__)
-        )
-
-        module_map = {}
-        for mod in modules:
-            instrs = (_ for _ in inspect.getmembers(mod) if inspect.isclass(_[1]) and
-                                                            issubclass(_[1], Instrument) and
-                                                            _[1] != Instrument and _[1] != SCPIInstrument and
-                                                            _[1] != CLibInstrument)
-            module_map.update(dict(instrs))
-        logger.debug("Found instruments %s.", module_map)
-
         #only select the instruments we want. not super happy with this code so
         #if anyone has a better way to do this please fix. -GJR
         if instr_filter is not None:
@@ -641,11 +701,12 @@ class QubitExpFactory(object):
                 # This should go away as auspex and pyqlab converge on naming schemes
                 instr_type = par['type']
                 par['name'] = name
-                # Instantiate the desired instrument
-                if instr_type in module_map:
+                # Instantiate the desired instrument, importing only its own module
+                instr_class = QubitExpFactory.find_instrument(instr_type)
+                if instr_class is not None:
                     logger.debug("Found instrument class %s for '%s' at loc %s when loading experiment settings.", instr_type, name, par['address'])
                     try:
-                        inst = module_map[instr_type](correct_resource_name(str(par['address'])), name=name)
+                        inst = instr_class(correct_resource_name(str(par['address'])), name=name)
                     except Exception as e:
                         logger.error("Initialization of caused exception:", name, str(e))
                         inst = None
@@ -753,33 +814,52 @@ class QubitExpFactory(object):
                 param.instr_tree = [instr.name, prop] #TODO: extend tree to endpoint
                 experiment.add_sweep(param, points) # Create the requested sweep on this parameter
 
+    @staticmethod
+    def stream_descriptor(experiment, stream, settings):
+        """Return the channel selected by the stream selector *stream* and the descriptor of its
+        data, given the current settings of the digitizer it belongs to."""
+        source_instr_settings = experiment.settings['instruments'][settings['source']]
+        channel, descrip = stream.get_descriptor(source_instr_settings, settings)
+
+        # Add the segment axis, which should already be defined...
+        if hasattr(experiment, 'segment_axis'):
+            # This should contains the proper range and units based on the sweep descriptor
+            descrip.add_axis(experiment.segment_axis)
+        else:
+            # This is the generic axis based on the instrument parameters
+            # If there is only one segement, we should omit this axis.
+            if source_instr_settings['nbr_segments'] > 1:
+                descrip.add_axis(DataAxis("segments", range(source_instr_settings['nbr_segments'])))
+
+        # Digitizer mode preserves round_robins, averager mode collapsing along them:
+        acq_mode_instr = 'digitizer'
+        acq_mode_chan = 'digitizer'
+        if 'acquire_mode' in source_instr_settings.keys():
+            acq_mode_instr = source_instr_settings['acquire_mode']
+        if settings['channel'] in source_instr_settings['rx_channels'].keys():
+            chan_settings = source_instr_settings['rx_channels'][settings['channel']]
+            if 'acquire_mode' in chan_settings.keys():
+                acq_mode_chan = chan_settings['acquire_mode']
+
+        if acq_mode_instr == 'digitizer' and acq_mode_chan == 'digitizer':
+            if source_instr_settings['nbr_round_robins'] > 1:
+                descrip.add_axis(DataAxis("round_robins", range(source_instr_settings['nbr_round_robins'])))
+        elif acq_mode_instr == 'averager' or acq_mode_chan == 'averager':
+            descrip.add_axis(DataAxis("round_robins", range(1)))
+            logger.warning("'%s' HW averaging enabled, added singleton axis", stream.name)
+
+        return channel, descrip
+
     @staticmethod
     def load_filters(experiment):
-        """This function first traverses all filter modules and constructs a map from the filter names
-        to the relevant module members. Then it parses the settings and instantiates Auspex filters for
-        each filter found therein. Finally, all of the relevant connections are established between filters
+        """This function parses the settings and instantiates Auspex filters for each filter found therein,
+        looking up the filter classes in the filter registry. Finally, all of the relevant connections are established between filters
         and back to the experiment class instance, to which *OutputConnectors* are added as needed."""
 
         # These store any filters we create as well as their connections
         filters = {}
         graph   = []
 
-        # ============================================
-        # Find all of the filter modules by inspection
-        # ============================================
-
-        modules = (
-            importlib.import_module('auspex.filters.' + name)
-            for loader, name, is_pkg in pkgutil.iter_modules(auspex.filters.__path__)
-        )
-
-        module_map = {}
-        for mod in modules:
-            filts = (_ for _ in inspect.getmembers(mod) if inspect.isclass(_[1]) and
-                                                            issubclass(_[1], Filter) and
-                                                            _[1] != Filter)
-            module_map.update(dict(filts))
-
         # ==================================================
         # Find out which output connectors we need to create
         # ==================================================
@@ -799,6 +879,7 @@ class QubitExpFactory(object):
         # and from Channel -> Digitizer for future lookup
         chan_to_oc  = {}
         chan_to_dig = {}
+        stream_selectors = {}
 
         for name, settings in dig_settings.items():
 
@@ -809,45 +890,20 @@ class QubitExpFactory(object):
             experiment.output_connectors[name] = oc
             setattr(experiment, name, oc)
 
-            # Find the digitizer instrument and settings
-            source_instr          = experiment._instruments[settings['source']]
-            source_instr_settings = next(v for k,v in experiment.settings['instruments'].items() if k == settings['source'])
+            # Find the digitizer instrument
+            source_instr = experiment._instruments[settings['source']]
 
             # Construct the descriptor from the stream
             stream_type = settings['type']
-            stream = module_map[stream_type](name=name)
-            channel, descrip = stream.get_descriptor(source_instr_settings, settings)
+            stream_class = QubitExpFactory.find_filter(stream_type)
+            if stream_class is None:
+                raise ValueError("Could not find stream selector class {} for '{}'".format(stream_type, name))
+            stream = stream_class(name=name)
+            stream_selectors[name] = stream
+            channel, descrip = QubitExpFactory.stream_descriptor(experiment, stream, settings)
 
             # Add the channel to the instrument
             source_instr.add_channel(channel)
-
-            # Add the segment axis, which should already be defined...
-            if hasattr(experiment, 'segment_axis'):
-                # This should contains the proper range and units based on the sweep descriptor
-                descrip.add_axis(experiment.segment_axis)
-            else:
-                # This is the generic axis based on the instrument parameters
-                # If there is only one segement, we should omit this axis.
-                if source_instr_settings['nbr_segments'] > 1:
-                    descrip.add_axis(DataAxis("segments", range(source_instr_settings['nbr_segments'])))
-
-            # Digitizer mode preserves round_robins, averager mode collapsing along them:
-            acq_mode_instr = 'digitizer'
-            acq_mode_chan = 'digitizer'
-            if 'acquire_mode' in source_instr_settings.keys():
-                acq_mode_instr = source_instr_settings['acquire_mode']
-            if settings['channel'] in source_instr_settings['rx_channels'].keys():
-                chan_settings = source_instr_settings['rx_channels'][settings['channel']]
-                if 'acquire_mode' in chan_settings.keys():
-                    acq_mode_chan = chan_settings['acquire_mode']
-
-            if acq_mode_instr == 'digitizer' and acq_mode_chan == 'digitizer':
-                if source_instr_settings['nbr_round_robins'] > 1:
-                    descrip.add_axis(DataAxis("round_robins", range(source_instr_settings['nbr_round_robins'])))
-            elif acq_mode_instr == 'averager' or acq_mode_chan == 'averager':
-                descrip.add_axis(DataAxis("round_robins", range(1)))
-                logger.warning("'%s' HW averaging enabled, added singleton axis", name)
-
             oc.set_descriptor(descrip)
 
             # Add to our mappings
@@ -861,8 +917,9 @@ class QubitExpFactory(object):
         for name, settings in enabled_meas.items():
             filt_type = settings['type']
 
-            if filt_type in module_map:
-                filt = module_map[filt_type](**settings)
+            filt_class = QubitExpFactory.find_filter(filt_type)
+            if filt_class is not None:
+                filt = filt_class(**settings)
                 filt.name = name
                 filters[name] = filt
                 logger.debug("Found filter class %s for '%s' when loading experiment settings.", filt_type, name)
@@ -900,6 +957,7 @@ class QubitExpFactory(object):
 
         experiment.chan_to_oc  = chan_to_oc
         experiment.chan_to_dig = chan_to_dig
+        experiment.stream_selectors = stream_selectors
         experiment.set_graph(graph)
 
         # For convenient lookup
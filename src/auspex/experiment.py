@@ -17,12 +17,11 @@ import sys
 import numbers
 import os
 import subprocess
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import numpy as np
-import scipy as sp
-import networkx as nx
-import h5py
-from tqdm import tqdm, tqdm_notebook
 
 from auspex.instruments.instrument import Instrument
 from auspex.parameter import ParameterGroup, FloatParameter, IntParameter, Parameter
@@ -66,6 +65,7 @@ class ExpProgressBar(object):
         self.chunk_sizes = [max(1,self.stream.descriptor.num_points_through_axis(axis+1)) for axis in range(self.num)]
         logger.debug("Reset the progress bars to initial states.")
         self.bars   = []
+        from tqdm import tqdm, tqdm_notebook
         for i in range(self.num):
             if self.notebook:
                 self.bars.append(tqdm_notebook(total=self.totals[i]/self.chunk_sizes[i]))
@@ -89,6 +89,7 @@ class ExpProgressBar(object):
         else:
             num_data = self.stream.points_taken
         logger.debug("Update the progress bars.")
+        from tqdm import tqdm, tqdm_notebook
         for i in range(self.num):
             if num_data == 0:
                 # Reset the progress bar with a new one
@@ -103,6 +104,36 @@ class ExpProgressBar(object):
                 self.bars[i].update(pos - self.bars[i].n)
             num_data = num_data % self.chunk_sizes[i]
 
+def setup_instruments(instruments, task, dependencies=None, max_workers=8):
+    """Run *task(instrument)* for each instrument in the name -> instrument dictionary
+    *instruments* on a thread pool. An instrument is only started once the instruments
+    named in *dependencies[name]* are done, and instruments with the same *setup_group*
+    take turns. Returns the time taken by each instrument. The first exception raised by
+    a task is re-raised once the running tasks have finished."""
+    dependencies = dependencies or {}
+    group_locks  = collections.defaultdict(threading.Lock)
+    timings      = {}
+
+    def timed_task(instrument):
+        with group_locks[instrument.setup_group()]:
+            start = time.perf_counter()
+            task(instrument)
+            return time.perf_counter() - start
+
+    pending = dict(instruments)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as pool:
+        while pending or running:
+            ready = [name for name in pending if all(dep in timings or dep not in instruments for dep in dependencies.get(name, []))]
+            for name in ready:
+                running[pool.submit(timed_task, pending.pop(name))] = name
+            if not running:
+                raise ValueError("Circular dependencies between instruments {}".format(sorted(pending)))
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                timings[running.pop(future)] = future.result()
+    return timings
+
 class ExperimentGraph(object):
     def __init__(self, edges, loop):
         self.dag = None
@@ -117,6 +148,7 @@ class ExperimentGraph(object):
         input_nodes = [n for n in self.dag.nodes() if self.dag.in_degree(n) == 0]
         logger.debug("Input nodes for DFS are '%s'", input_nodes)
 
+        import networkx as nx
         dfs_edge_iters  = [nx.edge_dfs(self.dag, input_node) for input_node in input_nodes]
         processed_edges = [] # Keep track of what we've initialized
 
@@ -127,6 +159,7 @@ class ExperimentGraph(object):
                     yield edge
 
     def create_graph(self, edges):
+        import networkx as nx
         dag = nx.DiGraph()
         self.edges = []
         for edge in edges:
@@ -153,8 +186,8 @@ class MetaExperiment(type):
         # Beware, passing objects won't work at parse time
         self._output_connectors = {}
 
-        # Parse ourself
-        self._exp_src = inspect.getsource(self)
+        # Parse ourself, but only once a writer asks for the source
+        self._exp_src = None
 
         for k,v in dct.items():
             if isinstance(v, Instrument):
@@ -172,6 +205,12 @@ class MetaExperiment(type):
                 self._constants[k] = v
                 # Keep track of numerical parameters
 
+    def experiment_source(self):
+        """Source code of the experiment class, looked up on first use."""
+        if self._exp_src is None:
+            self._exp_src = inspect.getsource(self)
+        return self._exp_src
+
 class Experiment(metaclass=MetaExperiment):
     """The measurement loop to be run for each set of sweep parameters."""
     def __init__(self):
@@ -188,12 +227,14 @@ class Experiment(metaclass=MetaExperiment):
         # This holds a reference to a matplotlib server instance
         # for plotting, if there is one.
         self.matplot_server_thread = None
-        # If this is True, don't close the plot server thread so that
-        # we might push additional plots after run_sweeps is complete.
-        self.leave_plot_server_open = False
 
         self.keep_instruments_connected = False
 
+        # If this is True the experiment is re-armed and run again rather than
+        # rebuilt (see QubitExpFactory.create), so keep the plot servers and
+        # instruments up between runs until teardown is called.
+        self.reusable = False
+
         # Also keep references to all of the plot filters
         self.plotters = [] # Standard pipeline plotters using streams
         self.extra_plotters = [] # Plotters using streams, but not the pipeline
@@ -214,8 +255,10 @@ class Experiment(metaclass=MetaExperiment):
         # indicates whether the instruments are already connected
         self.instrs_connected = False
 
-        # indicates whether this is the first (or only) experiment in a series (e.g. for pulse calibrations)
-        self.first_exp = True
+        # Instruments are connected and configured concurrently on this many threads,
+        # and the time taken by each is kept here, e.g. instrument_timings['connect']
+        self.instrument_workers = 8
+        self.instrument_timings = {}
 
         # Things we can't metaclass
         self.output_connectors = {}
@@ -312,7 +355,7 @@ class Experiment(metaclass=MetaExperiment):
     def update_descriptors(self):
         logger.debug("Starting descriptor update in experiment.")
         for oc in self.output_connectors.values():
-            oc.descriptor._exp_src = self._exp_src
+            oc.descriptor.exp_src = type(self).experiment_source
             for k,v in self._parameters.items():
                 oc.descriptor.add_param(k, v.value)
                 if v.unit is not None:
@@ -339,7 +382,7 @@ class Experiment(metaclass=MetaExperiment):
         # Set any static parameters
         static_params = [p for p in self._parameters.values() if p not in self.sweeper.swept_parameters()]
         for p in static_params:
-            p.push()
+            await p.push_async()
 
         # Keep track of the previous values
         logger.debug("Waiting for filters.")
@@ -405,11 +448,23 @@ class Experiment(metaclass=MetaExperiment):
     def filters_finished(self):
         return all([n.finished_processing for n in self.nodes if isinstance(n, Filter)])
 
+    def instrument_dependencies(self):
+        """Map instrument names to the names of the instruments that have to be connected and
+        configured before them."""
+        return {}
+
+    def setup_instruments(self, step, task):
+        """Run *task* on all of the instruments concurrently, respecting their dependencies,
+        and record how long each took for this *step*."""
+        timings = setup_instruments(self._instruments, task, self.instrument_dependencies(), self.instrument_workers)
+        self.instrument_timings[step] = timings
+        if timings:
+            logger.info("Instrument %s times: %s", step, ", ".join("{} {:.3f} s".format(k, v) for k, v in sorted(timings.items(), key=lambda kv: -kv[1])))
+
     def connect_instruments(self):
         # Connect the instruments to their resources
         if not self.instrs_connected:
-            for instrument in self._instruments.values():
-                instrument.connect()
+            self.setup_instruments("connect", lambda instrument: instrument.connect())
             self.instrs_connected = True
 
     def disconnect_instruments(self):
@@ -478,7 +533,6 @@ class Experiment(metaclass=MetaExperiment):
         # Launch plot servers.
         if len(self.plotters) > 0:
             self.init_plot_servers()
-        time.sleep(1)
         #connect all instruments
         self.connect_instruments()
         #initialize instruments
@@ -523,16 +577,30 @@ class Experiment(metaclass=MetaExperiment):
             except:
                 logger.debug("File probably already closed...")
 
-        if hasattr(self, 'plot_server'):
+        if hasattr(self, 'plot_server') and not self.reusable:
             try:
-                if len(self.plotters) > 0: #and not self.leave_plot_server_open:
+                if len(self.plotters) > 0:
                     self.plot_server.stop()
             except:
                 logger.warning("Could not stop plot server gracefully...")
 
         self.shutdown_instruments()
 
-        if not self.keep_instruments_connected:
+        if not self.keep_instruments_connected and not self.reusable:
+            self.disconnect_instruments()
+
+    def teardown(self):
+        """Release what a reusable experiment keeps between runs: stop the plot servers
+        and disconnect the instruments."""
+        for server in ('plot_server', 'extra_plot_server'):
+            if hasattr(self, server):
+                try:
+                    if not getattr(self, server).stopped:
+                        getattr(self, server).stop()
+                except:
+                    logger.warning("Could not stop plot server gracefully...")
+                delattr(self, server)
+        if self.instrs_connected:
             self.disconnect_instruments()
 
     def add_axis(self, axis, position=0):
@@ -592,7 +660,7 @@ class Experiment(metaclass=MetaExperiment):
 
         from .plotting import MatplotServerThread
         plot_desc = {p.name: p.desc() for p in self.standard_plotters}
-        if not hasattr(self, "plot_server"):
+        if not hasattr(self, "plot_server") or self.plot_server.stopped:
             self.plot_server = MatplotServerThread(plot_desc)
         if len(self.plotters) > len(self.standard_plotters) and not hasattr(self, "extra_plot_server"):
             extra_plot_desc = {p.name: p.desc() for p in self.extra_plotters + self.manual_plotters}
@@ -601,35 +669,28 @@ class Experiment(metaclass=MetaExperiment):
             plotter.plot_server = self.plot_server
         for plotter in self.extra_plotters + self.manual_plotters:
             plotter.plot_server = self.extra_plot_server
-        time.sleep(0.5)
-        # Kill a previous plotter if desired.
-        if auspex.config.single_plotter_mode and auspex.config.last_plotter_process:
-            pros = [auspex.config.last_plotter_process]
-            if (not self.leave_plot_server_open or self.first_exp) and auspex.config.last_extra_plotter_process:
-                pros += [auspex.config.last_extra_plotter_process]
-            for pro in pros:
-                if hasattr(os, 'setsid'): # Doesn't exist on windows
-                    try:
-                        os.kill(pro.pid, 0) # Raises an error if the PID doesn't exist
-                        os.killpg(os.getpgid(pro.pid), signal.SIGTERM) # Proceed to kill process group
-                    except OSError:
-                        logger.debug("No plotter to kill.")
-                else:
-                    try:
-                        pro.kill()
-                    except:
-                        logger.debug("No plotter to kill.")
 
+        # In single plotter mode the clients stay up between experiments and connect to each new
+        # plot server by themselves, so only launch them if they aren't already running.
+        if not auspex.config.single_plotter_mode or not self.plot_client_running(auspex.config.last_plotter_process):
+            auspex.config.last_plotter_process = self.launch_plot_client(self.plot_server)
+        if hasattr(self, 'extra_plot_server') and (not auspex.config.single_plotter_mode or not self.plot_client_running(auspex.config.last_extra_plotter_process)):
+            auspex.config.last_extra_plotter_process = self.launch_plot_client(self.extra_plot_server)
+
+        # Wait for the clients to subscribe rather than for a fixed time
+        self.plot_server.wait_for_client(process=auspex.config.last_plotter_process)
+        if hasattr(self, 'extra_plot_server'):
+            self.extra_plot_server.wait_for_client(process=auspex.config.last_extra_plotter_process)
+
+    def plot_client_running(self, process):
+        return process is not None and process.poll() is None
+
+    def launch_plot_client(self, server):
         client_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),"matplotlib-client.py")
-        #if not auspex.config.last_plotter_process:
+        args = ['python', client_path, 'localhost', str(server.status_port), str(server.data_port)]
+        if auspex.config.single_plotter_mode:
+            args.append('--persistent')
         if hasattr(os, 'setsid'):
-            auspex.config.last_plotter_process = subprocess.Popen(['python', client_path, 'localhost'],
-                                                                env=os.environ.copy(), preexec_fn=os.setsid)
+            return subprocess.Popen(args, env=os.environ.copy(), preexec_fn=os.setsid)
         else:
-            auspex.config.last_plotter_process = subprocess.Popen(['python', client_path, 'localhost'],
-                                                                env=os.environ.copy())
-        if hasattr(self, 'extra_plot_server') and (not auspex.config.last_extra_plotter_process or not self.leave_plot_server_open or self.first_exp):
-            if hasattr(os, 'setsid'):
-                auspex.config.last_extra_plotter_process = subprocess.Popen(['python', client_path, 'localhost', str(self.extra_plot_server.status_port), str(self.extra_plot_server.data_port)], env=os.environ.copy(), preexec_fn=os.setsid)
-            else:
-                auspex.config.last_extra_plotter_process = subprocess.Popen(['python', client_path, 'localhost', str(self.extra_plot_server.status_port), str(self.extra_plot_server.data_port)], env=os.environ.copy())
+            return subprocess.Popen(args, env=os.environ.copy())
@@ -259,7 +259,7 @@ class Channelizer(Filter):
         decimated_descriptor.axes[-1] = deepcopy(self.sink.descriptor.axes[-1])
         decimated_descriptor.axes[-1].points = self.sink.descriptor.axes[-1].points[self.decimation_factor.value-1::self.decimation_factor.value]
         decimated_descriptor.axes[-1].original_points = decimated_descriptor.axes[-1].points
-        decimated_descriptor._exp_src = self.sink.descriptor._exp_src
+        decimated_descriptor.exp_src = self.sink.descriptor.exp_src
         decimated_descriptor.dtype = np.complex64
         self.output_descriptor = decimated_descriptor
         for os in self.source.output_streams:
@@ -8,19 +8,127 @@
 
 __all__ = ['Correlator']
 
+import itertools
 import numpy as np
 
-from auspex.stream import InputConnector, OutputConnector
+from auspex.parameter import Parameter
+from auspex.stream import DataAxis, InputConnector, OutputConnector
 from auspex.log import logger
 from .elementwise import ElementwiseFilter
 
 class Correlator(ElementwiseFilter):
-    sink        = InputConnector()
-    source      = OutputConnector()
-    filter_name = "Correlator"
+    """Multiply the input streams element-by-element. By default the product of all of the input
+    streams is produced. Alternatively `correlations` may be "pairs" or "triples" for all products
+    of two or three streams, or an explicit list of products given as tuples of stream indices or
+    names. All of the requested products are computed in one step from the aligned stream buffer,
+    reusing shared partial products, and emitted along a trailing `correlation` axis."""
+    sink         = InputConnector()
+    source       = OutputConnector()
+    correlations = Parameter(default=None)
+    filter_name  = "Correlator"
+
+    def __init__(self, correlations=None, **kwargs):
+        super(Correlator, self).__init__(**kwargs)
+        self.correlations.value = correlations
+        self.products = None
 
     def operation(self):
         return np.multiply
 
     def unit(self, base_unit):
-        return base_unit + "^{}".format(len(self.sink.input_streams))
+        """Each product carries the base unit to the power of its order, and the orders present
+        are listed when products of different orders share the correlation axis."""
+        if self.products is None:
+            orders = [len(self.sink.input_streams)]
+        else:
+            orders = sorted(set(len(p) for p in self.products))
+        return ",".join(base_unit + "^{}".format(order) for order in orders)
+
+    def stream_names(self):
+        """Name each input stream after its source connector, or the source filter for generic connectors."""
+        names = []
+        for stream in self.sink.input_streams:
+            conn = stream.start_connector
+            if conn is not None and conn.name == "source" and conn.parent is not None and conn.parent.name:
+                names.append(str(conn.parent.name))
+            elif conn is not None and conn.name:
+                names.append(str(conn.name))
+            else:
+                names.append(str(stream.name))
+        return names
+
+    def requested_products(self):
+        """Return a list of sorted stream index tuples for the requested products."""
+        num_streams = len(self.sink.input_streams)
+        names = self.stream_names()
+        requested = self.correlations.value
+        if requested == "pairs":
+            return list(itertools.combinations(range(num_streams), 2))
+        elif requested == "triples":
+            return list(itertools.combinations(range(num_streams), 3))
+        products = []
+        for product in requested:
+            indices = []
+            for s in product:
+                if isinstance(s, str):
+                    if s not in names:
+                        raise ValueError("Correlator could not find input stream {} among {}.".format(s, names))
+                    s = names.index(s)
+                indices.append(int(s))
+            products.append(tuple(sorted(indices)))
+        return products
+
+    def update_descriptors(self):
+        if self.correlations.value is None or None in [ss.descriptor for ss in self.sink.input_streams]:
+            self.products = None
+        else:
+            self.plan_products()
+        super(Correlator, self).update_descriptors()
+
+    def plan_products(self):
+        """Work out the requested products and the shared partial products that lead to them."""
+        self.products = self.requested_products()
+        names = self.stream_names()
+        if not self.products:
+            raise ValueError("Correlator correlations={!r} gives no products with {} connected input stream(s).".format(
+                             self.correlations.value, len(names)))
+
+        # Build the partial products level by level: each product of k streams is a product of
+        # k-1 streams, shared with any other product having the same prefix, times one more stream
+        self.levels = []
+        positions   = {(i,): (1, i) for i in range(len(names))}
+        prefixes    = set(p[:k] for p in self.products for k in range(2, len(p)+1))
+        for order in range(2, max(len(p) for p in self.products)+1):
+            level = sorted(p for p in prefixes if len(p) == order)
+            self.levels.append((np.array([positions[p[:-1]][1] for p in level], dtype=np.intp),
+                                np.array([p[-1] for p in level], dtype=np.intp)))
+            positions.update({p: (order, i) for i, p in enumerate(level)})
+        self.product_idx = [positions[p] for p in self.products]
+
+        logger.debug('%s "%s" computing products %s', self.filter_name, self.name, self.products)
+
+    def output_descriptor(self):
+        descriptor = self.sink.descriptor.copy()
+        descriptor.data_name = self.filter_name
+        if descriptor.unit:
+            descriptor.unit = self.unit(descriptor.unit)
+        if self.products is not None:
+            names = self.stream_names()
+            descriptor.add_axis(DataAxis("correlation", list(range(len(self.products))),
+                                metadata=["*".join(names[i] for i in p) for p in self.products]),
+                                position=len(descriptor.axes))
+        return descriptor
+
+    def reduce(self, window):
+        if self.products is None:
+            return super(Correlator, self).reduce(window)
+
+        levels = {1: window}
+        for order, (prefix_idx, stream_idx) in enumerate(self.levels, 2):
+            levels[order] = levels[order-1][prefix_idx] * window[stream_idx]
+
+        # Interleave the products so that the correlation axis is the innermost
+        result = np.empty((window.shape[1], len(self.products)), dtype=window.dtype)
+        for col, (order, idx) in enumerate(self.product_idx):
+            result[:, col] = levels[order][idx]
+        return result.ravel()
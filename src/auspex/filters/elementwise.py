@@ -54,13 +54,57 @@ class ElementwiseFilter(Filter):
             logger.debug('%s "%s" waiting for all input streams to be updated.', self.filter_name, self.name)
             return
 
-        self.descriptor = self.sink.descriptor.copy()
-        self.descriptor.data_name = self.filter_name
-        if self.descriptor.unit:
-            self.descriptor.unit = self.descriptor.unit + "^{}".format(len(self.sink.input_streams))
+        self.descriptor = self.output_descriptor()
         self.source.descriptor = self.descriptor
         self.source.update_descriptors()
 
+    def output_descriptor(self):
+        """The descriptor of the output stream, once those of all input streams are known."""
+        descriptor = self.sink.descriptor.copy()
+        descriptor.data_name = self.filter_name
+        if descriptor.unit:
+            descriptor.unit = descriptor.unit + "^{}".format(len(self.sink.input_streams))
+        return descriptor
+
+    def reset_buffer(self, num_streams, capacity=1024):
+        """Allocate the aligned buffer, which holds one row per input stream. The rows are consumed
+        in lockstep, so the aligned window of every stream is a single 2D slice."""
+        self.buffer    = np.empty((num_streams, capacity), dtype=self.sink.descriptor.dtype)
+        self.read_idx  = 0
+        self.write_idx = np.zeros(num_streams, dtype=np.int64)
+
+    def append(self, row, data):
+        """Append data to the buffer row of a stream, wrapping the unread data back to the start of
+        the buffer when we run out of room. The buffer only grows when a stream runs far ahead."""
+        if not np.can_cast(data.dtype, self.buffer.dtype):
+            # Streams may carry more precision than their descriptors claim
+            self.buffer = self.buffer.astype(np.result_type(self.buffer.dtype, data.dtype))
+        if self.write_idx[row] + data.size > self.buffer.shape[1]:
+            unread   = int(np.max(self.write_idx)) - self.read_idx
+            needed   = max(unread, int(self.write_idx[row]) - self.read_idx + data.size)
+            capacity = self.buffer.shape[1]
+            if needed > capacity // 2:
+                buffer = np.empty((self.buffer.shape[0], 2*needed), dtype=self.buffer.dtype)
+            else:
+                buffer = self.buffer
+            buffer[:, :unread] = self.buffer[:, self.read_idx:self.read_idx+unread]
+            self.buffer     = buffer
+            self.write_idx -= self.read_idx
+            self.read_idx   = 0
+        self.buffer[row, self.write_idx[row]:self.write_idx[row]+data.size] = data
+        self.write_idx[row] += data.size
+
+    def reduce(self, window):
+        """Apply the operation across the (num_streams, N) aligned window."""
+        op = self.operation()
+        if isinstance(op, np.ufunc):
+            return op.reduce(window, axis=0)
+        # A view of the buffer would be overwritten by the next compaction
+        result = window[0].copy()
+        for row in window[1:]:
+            result = op(result, row)
+        return result
+
     async def run(self):
         self.finished_processing = False
         streams = self.sink.input_streams
@@ -69,72 +113,63 @@ class ElementwiseFilter(Filter):
             if not np.all(s.descriptor.expected_tuples() == streams[0].descriptor.expected_tuples()):
                 raise ValueError("Multiple streams connected to correlator must have matching descriptors.")
 
-        # Buffers for stream data
-        stream_data = {s: np.zeros(0, dtype=self.sink.descriptor.dtype) for s in streams}
+        # Aligned buffers for stream data
+        self.reset_buffer(len(streams))
 
         # Store whether streams are done
-        stream_done = {s: False for s in streams}
-
-        while True:
-            # Wait for all of the acquisition to complete
-            # Against at least some peoples rational expectations, asyncio.wait doesn't return Futures
-            # in the order of the iterable it was passed, but perhaps just in order of completion. So,
-            # we construct a dictionary in order that that can be mapped back where we need them:
-
-            futures = {
-                asyncio.ensure_future(stream.queue.get()): stream
-                for stream in streams
-            }
-
-            # Deal with non-equal number of messages using timeout
-            responses, pending = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED, timeout=2.0)
-
-            # Construct the inverse lookup, results in {stream: result}
-            stream_results = {futures[res]: res.result() for res in list(responses)}
-
-            # Cancel the futures
-            for pend in list(pending):
-                pend.cancel()
-
-            # Add any new data to the
-            for stream, message in stream_results.items():
-                message_type = message['type']
-                message_data = message['data']
-                message_comp = message['compression']
-                message_data = pickle.loads(zlib.decompress(message_data)) if message_comp == 'zlib' else message_data
-                message_data = message_data if hasattr(message_data, 'size') else np.array([message_data])
-                if message_type == 'event':
-                    if message['event_type'] == 'done':
-                        stream_done[stream] = True
-                    elif message['event_type'] == 'refine':
-                        logger.warning("Correlator doesn't handle refinement yet!")
-
-                elif message_type == 'data':
-                    stream_data[stream] = np.concatenate((stream_data[stream], message_data.flatten()))
-
-            if False not in stream_done.values():
-                for oc in self.output_connectors.values():
-                    for os in oc.output_streams:
-                        await os.push_event("done")
-                logger.debug('%s "%s" is done', self.__class__.__name__, self.name)
-                break
-
-            # Now process the data with the elementwise operation
-            smallest_length = min([d.size for d in stream_data.values()])
-            new_data = [d[:smallest_length] for d in stream_data.values()]
-            result = new_data[0]
-            for nd in new_data[1:]:
-                result = self.operation()(result, nd)
-            if result.size > 0:
-                await self.source.push(result)
-
-            # Add data to carry_data if necessary
-            for stream in stream_data.keys():
-                if stream_data[stream].size > smallest_length:
-                    stream_data[stream] = stream_data[stream][smallest_length:]
-                else:
-                    stream_data[stream] = np.zeros(0, dtype=self.sink.descriptor.dtype)
-
-            # If we have gotten all our data and process_data has returned, then we are done!
-            if all([v.done() for v in self.input_connectors.values()]):
-                self.finished_processing = True
+        stream_done = [False]*len(streams)
+
+        # Persistent readers forward the messages of every stream, in order, to a single queue
+        messages = asyncio.Queue()
+
+        async def reader(row, stream):
+            while True:
+                message = await stream.queue.get()
+                await messages.put((row, message))
+                if message['type'] == 'event' and message['event_type'] == 'done':
+                    break
+
+        readers = [asyncio.ensure_future(reader(row, stream)) for row, stream in enumerate(streams)]
+
+        try:
+            while True:
+                # Wait for at least one message, then take whatever else has already arrived
+                new_messages = [await messages.get()]
+                while not messages.empty():
+                    new_messages.append(messages.get_nowait())
+
+                for row, message in new_messages:
+                    message_type = message['type']
+                    message_data = message['data']
+                    message_comp = message['compression']
+                    message_data = pickle.loads(zlib.decompress(message_data)) if message_comp == 'zlib' else message_data
+                    message_data = message_data if hasattr(message_data, 'size') else np.array([message_data])
+                    if message_type == 'event':
+                        if message['event_type'] == 'done':
+                            stream_done[row] = True
+                        elif message['event_type'] == 'refined':
+                            logger.warning("Correlator doesn't handle refinement yet!")
+
+                    elif message_type == 'data':
+                        self.append(row, message_data.flatten())
+
+                # Now process the aligned data with the elementwise operation
+                num_aligned = int(np.min(self.write_idx)) - self.read_idx
+                if num_aligned > 0:
+                    result = self.reduce(self.buffer[:, self.read_idx:self.read_idx+num_aligned])
+                    self.read_idx += num_aligned
+                    await self.source.push(result)
+
+                if all(stream_done):
+                    for oc in self.output_connectors.values():
+                        for os in oc.output_streams:
+                            await os.push_event("done")
+                    logger.debug('%s "%s" is done', self.__class__.__name__, self.name)
+                    break
+
+                # If we have gotten all our data and process_data has returned, then we are done!
+                if all([v.done() for v in self.input_connectors.values()]):
+                    self.finished_processing = True
+        finally:
+            for r in readers:
+                r.cancel()
@@ -13,7 +13,7 @@ import os
 
 from .filter import Filter
 from auspex.parameter import Parameter, FloatParameter, IntParameter, BoolParameter
-from auspex.stream import DataStreamDescriptor, InputConnector, OutputConnector
+from auspex.stream import DataStreamDescriptor, DataAxis, InputConnector, OutputConnector
 from auspex.log import logger
 import auspex.config as config
 
@@ -28,13 +28,23 @@ class KernelIntegrator(Filter):
     box_car_stop = FloatParameter(default=100e-9)
     frequency = FloatParameter(default=0.0)
 
-    """Integrate with a given kernel. Kernel will be padded/truncated to match record length"""
+    """Integrate with a given kernel. Kernel will be padded/truncated to match record length.
+
+    Several kernels may be applied at once by passing a list of kernels (file names, expressions
+    or arrays) or a 2D array with one kernel per row as `kernel`. Likewise, lists of `box_car_start`
+    and `box_car_stop` values produce one box-car window per entry when using a simple kernel.
+    All kernels are applied with a single matrix product and, when there is more than one, the
+    output gains a trailing `kernel` axis."""
     def __init__(self, **kwargs):
         super(KernelIntegrator, self).__init__(**kwargs)
         self.pre_int_op  = None
         self.post_int_op = None
+        self.box_car_starts = None
+        self.box_car_stops  = None
         for k, v in kwargs.items():
-            if hasattr(self, k) and isinstance(getattr(self,k), Parameter):
+            if k in ["box_car_start", "box_car_stop"] and np.ndim(v) > 0:
+                setattr(self, k+"s", np.array(v, dtype=np.float64))
+            elif hasattr(self, k) and isinstance(getattr(self,k), Parameter):
                 getattr(self, k).value = v
         if "pre_integration_operation" in kwargs:
             self.pre_int_op = kwargs["pre_integration_operation"]
@@ -52,42 +62,101 @@ class KernelIntegrator(Filter):
         if self.simple_kernel.value:
             time_pts = self.sink.descriptor.axes[-1].points
             time_step = time_pts[1] - time_pts[0]
-            kernel = np.zeros(record_length, dtype=np.complex128)
-            sample_start = int(self.box_car_start.value / time_step)
-            sample_stop = int(self.box_car_stop.value / time_step) + 1
-            kernel[sample_start:sample_stop] = 1.0
+            starts = self.box_car_starts if self.box_car_starts is not None else [self.box_car_start.value]
+            stops  = self.box_car_stops if self.box_car_stops is not None else [self.box_car_stop.value]
+            starts, stops = np.broadcast_arrays(starts, stops)
+            kernels = np.zeros((starts.size, record_length), dtype=np.complex128)
+            for kernel, start, stop in zip(kernels, starts, stops):
+                sample_start = int(start / time_step)
+                sample_stop = int(stop / time_step) + 1
+                kernel[sample_start:sample_stop] = 1.0
             # add modulation
-            kernel *= np.exp(2j * np.pi * self.frequency.value * time_step * time_pts)
-        elif os.path.exists(os.path.join(config.KernelDir, self.kernel.value+'.txt')):
-            kernel = np.loadtxt(os.path.join(config.KernelDir, self.kernel.value+'.txt'), dtype=complex, converters={0: lambda s: complex(s.decode().replace('+-', '-'))})
-        else:
-            try:
-                kernel = eval(self.kernel.value.encode('unicode_escape'))
-            except:
-                raise ValueError('Kernel invalid. Provide a file name or an expression to evaluate')
-        # pad or truncate the kernel to match the record length
-        if kernel.size < record_length:
-            self.aligned_kernel = np.append(kernel, np.zeros(record_length-kernel.size, dtype=np.complex128))
+            kernels *= np.exp(2j * np.pi * self.frequency.value * time_step * time_pts)
+        elif isinstance(self.kernel.value, (list, tuple)):
+            kernels = [self.load_kernel(k) for k in self.kernel.value]
         else:
-            self.aligned_kernel = np.resize(kernel, record_length)
+            kernels = np.atleast_2d(self.load_kernel(self.kernel.value))
+
+        # pad or truncate the kernels to match the record length
+        aligned_kernels = np.zeros((len(kernels), record_length), dtype=np.complex128)
+        for aligned, kernel in zip(aligned_kernels, kernels):
+            kernel = np.ravel(kernel)
+            if kernel.size < record_length:
+                aligned[:kernel.size] = kernel
+            else:
+                aligned[:] = np.resize(kernel, record_length)
+
+        # Keep single precision inputs (e.g. from the Channelizer) in single precision
+        self.dtype = np.result_type(self.sink.descriptor.dtype, np.complex64)
+        self.num_kernels = aligned_kernels.shape[0]
+        self.aligned_kernels = aligned_kernels.astype(self.dtype)
+        self.aligned_kernel  = self.aligned_kernels[0]
+        # Store the transposed kernels contiguously so that integration is one (records x time) @ (time x kernels) product
+        self.kernel_matrix   = np.ascontiguousarray(self.aligned_kernels.T)
 
         # Integrator reduces and removes axis on output stream
         # update output descriptors
         output_descriptor = DataStreamDescriptor()
         # TODO: handle reduction to single point
         output_descriptor.axes = self.sink.descriptor.axes[:-1]
-        output_descriptor._exp_src = self.sink.descriptor._exp_src
-        output_descriptor.dtype = np.complex128
+        if self.num_kernels > 1:
+            output_descriptor.axes = output_descriptor.axes + [DataAxis("kernel", list(range(self.num_kernels)))]
+        output_descriptor.exp_src = self.sink.descriptor.exp_src
+        output_descriptor.dtype = self.dtype
         for ost in self.source.output_streams:
             ost.set_descriptor(output_descriptor)
             ost.end_connector.update_descriptors()
 
+    def load_kernel(self, kernel):
+        """Return a kernel given as an array, the name of a file in the kernel directory or an expression."""
+        if not isinstance(kernel, str):
+            return np.asarray(kernel)
+        elif os.path.exists(os.path.join(config.KernelDir, kernel+'.txt')):
+            return np.loadtxt(os.path.join(config.KernelDir, kernel+'.txt'), dtype=complex, converters={0: lambda s: complex(s.decode().replace('+-', '-'))})
+        else:
+            try:
+                return eval(kernel.encode('unicode_escape'))
+            except:
+                raise ValueError('Kernel invalid. Provide a file name or an expression to evaluate')
+
+    def final_init(self):
+        # For storing carryover if getting uneven buffers. The carry is preallocated
+        # to hold a single record so partial records never require reallocation.
+        self.carry = np.empty(self.kernel_matrix.shape[0], dtype=self.dtype)
+        self.carry_size = 0
+
     async def process_data(self, data):
 
-        # TODO: handle variable partial records
         if self.pre_int_op:
             data = self.pre_int_op(data)
-        filtered = np.inner(np.reshape(data, (-1, len(self.aligned_kernel))), self.aligned_kernel)
+        record_length = self.kernel_matrix.shape[0]
+        idx = 0
+
+        # Complete any partial record carried from the last run
+        if self.carry_size > 0:
+            idx = min(record_length - self.carry_size, data.size)
+            self.carry[self.carry_size:self.carry_size+idx] = data[:idx]
+            self.carry_size += idx
+            if self.carry_size < record_length:
+                return
+            self.carry_size = 0
+            await self.push_integrated(self.carry[np.newaxis,:])
+
+        # This is the largest number of records we can handle
+        num_records = (data.size - idx) // record_length
+        stop = idx + num_records*record_length
+
+        # Store the remaining points until the next round
+        self.carry_size = data.size - stop
+        self.carry[:self.carry_size] = data[stop:]
+
+        if num_records > 0:
+            await self.push_integrated(np.reshape(data[idx:stop], (num_records, record_length)))
+
+    async def push_integrated(self, records):
+        filtered = np.matmul(records, self.kernel_matrix)
+        if self.num_kernels == 1:
+            filtered = filtered.ravel()
         if self.post_int_op:
             filtered = self.post_int_op(filtered)
         # push to ouptut connectors
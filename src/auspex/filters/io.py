@@ -6,18 +6,18 @@
 #
 #    http://www.apache.org/licenses/LICENSE-2.0
 
-__all__ = ['WriteToHDF5', 'DataBuffer', 'ProgressBar']
+__all__ = ['WriteToHDF5', 'DataBuffer', 'RollingBuffer', 'ProgressBar']
 
 import asyncio, concurrent
 import itertools
-import h5py
+import collections
 import pickle
 import zlib
 import numpy as np
 import os.path
 import time
 import re
-import pandas as pd
+import tempfile
 from shutil import copyfile
 
 from .filter import Filter
@@ -26,7 +26,6 @@ from auspex.stream import InputConnector, OutputConnector
 from auspex.log import logger
 import auspex.config as config
 
-from tqdm import tqdm, tqdm_notebook
 
 class WriteToHDF5(Filter):
     """Writes data to file."""
@@ -112,11 +111,13 @@ class WriteToHDF5(Filter):
             self.save_yaml()
         if self.exp_log:
             self.write_to_log()
+        import h5py
         return h5py.File(self.filename.value, 'w', libver='latest')
 
     def write_to_log(self):
         """ Record the experiment in a log file """
         if config.LogDir:
+            import pandas as pd
             logfile = os.path.join(config.LogDir, "experiment_log.tsv")
             if os.path.isfile(logfile):
                 lf = pd.read_csv(logfile, sep="\t")
@@ -133,14 +134,15 @@ class WriteToHDF5(Filter):
             fulldir = os.path.splitext(self.filename.value)[0]
             if not os.path.exists(fulldir):
                 os.makedirs(fulldir)
-                config.dump_meas_file(config.load_meas_file(config.meas_file), os.path.join(fulldir, os.path.split(config.meas_file)[1]), flatten = True)
+                with open(os.path.join(fulldir, os.path.split(config.meas_file)[1]), 'w') as f:
+                    f.write(config.meas_file_snapshot(config.meas_file))
 
     def save_yaml_h5(self):
         """ Save a copy of current experiment settings in the h5 metadata"""
         if config.meas_file:
             header = self.file.create_group("header")
-            # load them dump to get the 'include' information
-            header.attrs['settings'] = config.dump_meas_file(config.load_meas_file(config.meas_file), flatten = True)
+            # flattened to get the 'include' information, and serialized once for all writers
+            header.attrs['settings'] = config.meas_file_snapshot(config.meas_file)
 
     async def run(self):
         self.finished_processing = False
@@ -199,6 +201,7 @@ class WriteToHDF5(Filter):
                 self.data_group.attrs[k] = v
 
         # Create a table for the DataStreamDescriptor
+        import h5py
         ref_dtype = h5py.special_dtype(ref=h5py.Reference)
         self.descriptor = self.group.create_dataset("descriptor", (len(axes),), dtype=ref_dtype)
         for k,v in desc.metadata.items():
@@ -377,19 +380,57 @@ class WriteToHDF5(Filter):
                 self.finished_processing = True
 
 class DataBuffer(Filter):
-    """Writes data to IO."""
+    """Writes data to IO. All streams share a single structured array that holds the axis tuples
+    and one column per stream, so that get_data makes a single copy and get_data_view none. Buffers larger
+    than `spill_size` bytes are backed by an anonymous temporary file via np.memmap."""
 
     sink = InputConnector()
 
-    def __init__(self, store_tuples=True, **kwargs):
+    def __init__(self, store_tuples=True, spill_size=None, spill_dir=None, **kwargs):
         super(DataBuffer, self).__init__(**kwargs)
         self.quince_parameters = []
         self.sink.max_input_streams = 100
         self.store_tuples = store_tuples
+        self.spill_size   = spill_size
+        self.spill_dir    = spill_dir
+
+    def buffer_dtype(self):
+        desc = self.sink.input_streams[0].descriptor
+        dtype = desc.axis_data_type(with_metadata=True) if self.store_tuples else []
+        for stream in self.sink.input_streams:
+            dtype.append((stream.descriptor.data_name, stream.descriptor.dtype))
+        return np.dtype(dtype)
+
+    def allocate(self, capacity):
+        """Allocate storage for capacity points, in memory or spilled to a temporary file."""
+        dtype = self.buffer_dtype()
+        if self.spill_size is not None and capacity*dtype.itemsize > self.spill_size:
+            # The mapping outlives the (already unlinked) file, so it can be closed right away
+            with tempfile.TemporaryFile(dir=self.spill_dir) as spill_file:
+                data = np.memmap(spill_file, dtype=dtype, mode='w+', shape=(capacity,))
+            logger.debug('%s "%s" spilling %d bytes to disk', self.__class__.__name__, self.name, data.nbytes)
+        else:
+            data = np.empty(capacity, dtype=dtype)
+
+        if getattr(self, 'data', None) is not None:
+            data[:self.data.size] = self.data
+        self.data = data
+        self.buffers = {s: self.data[s.descriptor.data_name] for s in self.sink.input_streams}
 
     def final_init(self):
-        self.buffers = {s: np.empty(s.descriptor.expected_num_points(), dtype=s.descriptor.dtype) for s in self.sink.input_streams}
-        self.w_idxs  = {s: 0 for s in self.sink.input_streams}
+        self.data         = None
+        self.num_points   = self.sink.input_streams[0].descriptor.expected_num_points()
+        self.tuples_valid = False
+        self.allocate(self.num_points)
+        self.w_idxs = {s: 0 for s in self.sink.input_streams}
+
+    def resize(self, num_points):
+        """Grow to num_points, reallocating geometrically so repeated refinement is amortized."""
+        num_points = max(num_points, self.num_points)
+        if num_points > self.data.size:
+            self.allocate(max(num_points, 2*self.data.size))
+        self.num_points   = num_points
+        self.tuples_valid = False
 
     async def run(self):
         self.finished_processing = False
@@ -425,6 +466,7 @@ class DataBuffer(Filter):
                 pend.cancel()
 
             # Add any new data to the
+            received = set()
             for stream, message in stream_results.items():
                 message_type = message['type']
                 message_data = message['data']
@@ -435,56 +477,188 @@ class DataBuffer(Filter):
                     if message['event_type'] == 'done':
                         stream_done[stream] = True
                     elif message['event_type'] == 'refined':
-                        # Single we don't have much structure here we simply
-                        # create a new buffer and paste the old buffer into it
-                        old_buffer = self.buffers[stream]
-                        new_size   = stream.descriptor.num_points()
-                        self.buffers[stream] = np.empty(stream.descriptor.num_points(), dtype=stream.descriptor.dtype)
-                        self.buffers[stream][:old_buffer.size] = old_buffer
+                        # The axes have been extended, so make room for the new points
+                        self.resize(stream.descriptor.num_points())
 
                 elif message_type == 'data':
                     stream_data[stream] = message_data.flatten()
+                    received.add(stream)
 
             if False not in stream_done.values():
                 logger.debug('%s "%s" is done', self.__class__.__name__, self.name)
                 break
 
-            for stream in stream_results.keys():
-                data = stream_data[stream]
-
-                self.buffers[stream][self.w_idxs[stream]:self.w_idxs[stream]+data.size] = data
-                self.w_idxs[stream] += data.size
+            # Events carry no data, so only store what arrived in this round
+            for stream in received:
+                self.store(stream, stream_data[stream])
 
             # If we have gotten all our data and process_data has returned, then we are done!
             if np.all([v.done() for v in self.input_connectors.values()]):
                 self.finished_processing = True
 
-    def get_data(self):
-        streams = self.sink.input_streams
-        desc = streams[0].descriptor
-
-        # Set the dtype for the parameter columns
-        if self.store_tuples:
-            dtype = desc.axis_data_type(with_metadata=True)
-        else:
-            dtype = []
+    def store(self, stream, data):
+        self.buffers[stream][self.w_idxs[stream]:self.w_idxs[stream]+data.size] = data
+        self.w_idxs[stream] += data.size
 
-        # Extend the dtypes for each data column
-        for stream in streams:
-            dtype.append((stream.descriptor.data_name, stream.descriptor.dtype))
-        data = np.empty(self.buffers[streams[0]].size, dtype=dtype)
-
-        if self.store_tuples:
+    def get_data(self):
+        """Return a structured copy of the buffered data."""
+        return np.array(self.get_data_view())
+
+    def get_data_view(self):
+        """Return a structured view of the buffered data. The axis tuples are filled in
+        on the first call after the axes change. The view shares memory with the buffer,
+        so it is only valid until the buffer grows or the next run overwrites it."""
+        data = self.data[:self.num_points]
+        if self.store_tuples and not self.tuples_valid:
+            desc   = self.sink.input_streams[0].descriptor
             tuples = desc.tuples(as_structured_array=True)
             for a in desc.axis_names(with_metadata=True):
                 data[a] = tuples[a]
-        for stream in streams:
-            data[stream.descriptor.data_name] = self.buffers[stream]
+            self.tuples_valid = True
         return data
 
     def get_descriptor(self):
         return self.sink.input_streams[0].descriptor
 
+class RingBuffer(object):
+    """Circular buffer holding the most recent points appended to it. Positions are tracked as
+    absolute indices into everything ever appended, of which [start, count) are retained."""
+    def __init__(self, capacity, dtype):
+        self.data  = np.empty(capacity, dtype=dtype)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count - self.start
+
+    def append(self, values):
+        capacity = self.data.size
+        if values.size > capacity:
+            self.count += values.size - capacity
+            values = values[-capacity:]
+        idx   = self.count % capacity
+        first = min(values.size, capacity - idx)
+        self.data[idx:idx+first] = values[:first]
+        self.data[:values.size-first] = values[first:]
+        self.count += values.size
+        self.start  = max(self.start, self.count - capacity)
+
+    def discard(self, upto):
+        """Drop all points with absolute index below upto."""
+        self.start = max(self.start, min(upto, self.count))
+
+    def grow(self, capacity):
+        retained   = self.snapshot()
+        self.data  = np.empty(capacity, dtype=self.data.dtype)
+        self.count = self.start
+        self.append(retained)
+
+    def snapshot(self):
+        """Return a copy of the retained points, oldest first."""
+        idx = self.start % self.data.size
+        if idx + len(self) <= self.data.size:
+            return self.data[idx:idx+len(self)].copy()
+        return np.concatenate((self.data[idx:], self.data[:len(self)-(self.data.size-idx)]))
+
+class RollingBuffer(DataBuffer):
+    """Retains only the last `max_points` points and/or the last `max_time` seconds of each
+    stream, so that long-running monitors use constant memory. If `summary_points` is given,
+    the min/mean/max of every `summary_points` consecutive points are kept as well, up to
+    `max_summaries` bins per stream."""
+
+    sink = InputConnector()
+
+    def __init__(self, max_points=None, max_time=None, summary_points=None, max_summaries=10000, **kwargs):
+        super(RollingBuffer, self).__init__(**kwargs)
+        if max_points is None and max_time is None:
+            raise ValueError("RollingBuffer requires max_points and/or max_time.")
+        self.max_points     = max_points
+        self.max_time       = max_time
+        self.summary_points = summary_points
+        self.max_summaries  = max_summaries
+
+    def final_init(self):
+        self.rings     = {}
+        self.chunks    = {}
+        self.summaries = {}
+        self.partials  = {}
+        for s in self.sink.input_streams:
+            dtype = s.descriptor.dtype
+            self.rings[s]  = RingBuffer(self.max_points or 1024, [('time', np.float64), ('value', dtype)])
+            self.chunks[s] = collections.deque()
+            if self.summary_points:
+                mean_dtype = np.result_type(dtype, np.float64)
+                self.summaries[s] = RingBuffer(self.max_summaries, [('time', np.float64), ('min', dtype), ('mean', mean_dtype), ('max', dtype)])
+                self.partials[s]  = None
+
+    def resize(self, num_points):
+        # The window does not depend on the shape of the axes
+        pass
+
+    def store(self, stream, data):
+        now    = time.time()
+        ring   = self.rings[stream]
+        chunks = self.chunks[stream]
+
+        if self.max_time is not None:
+            # Arrival times are monotonic, so expire whole chunks from the front
+            while chunks and (chunks[0][0] <= ring.start or chunks[0][1] < now - self.max_time):
+                ring.discard(chunks.popleft()[0])
+            if self.max_points is None and len(ring) + data.size > ring.data.size:
+                ring.grow(max(2*ring.data.size, len(ring) + data.size))
+            chunks.append((ring.count + data.size, now))
+
+        values = np.empty(data.size, dtype=ring.data.dtype)
+        values['time']  = now
+        values['value'] = data
+        ring.append(values)
+
+        if self.summary_points:
+            self.summarize(stream, data, now)
+
+    def summarize(self, stream, data, now):
+        """Reduce data into min/mean/max bins of summary_points points, carrying partial bins."""
+        partial = self.partials[stream]
+        if partial is not None:
+            data = np.concatenate((partial, data))
+        num_full = (data.size // self.summary_points) * self.summary_points
+        if num_full > 0:
+            bins = data[:num_full].reshape(-1, self.summary_points)
+            summary = np.empty(bins.shape[0], dtype=self.summaries[stream].data.dtype)
+            summary['time'] = now
+            summary['min']  = bins.min(axis=1)
+            summary['mean'] = bins.mean(axis=1)
+            summary['max']  = bins.max(axis=1)
+            self.summaries[stream].append(summary)
+        self.partials[stream] = data[num_full:] if num_full < data.size else None
+
+    def snapshot(self, stream=None):
+        """Return the retained ('time', 'value') records of a stream, oldest first."""
+        return self.rings[stream or self.sink.input_streams[0]].snapshot()
+
+    def get_summaries(self, stream=None):
+        """Return the ('time', 'min', 'mean', 'max') records of a stream, oldest first."""
+        return self.summaries[stream or self.sink.input_streams[0]].snapshot()
+
+    def get_data(self):
+        """Return the points retained for every stream as a structured array laid out like that
+        of DataBuffer.get_data: the axis tuples (if store_tuples) and one column per stream.
+        Points are matched up across streams by position, so only those held for all are included."""
+        streams = self.sink.input_streams
+        rings   = [self.rings[s] for s in streams]
+        first   = max(r.start for r in rings)
+        last    = max(first, min(r.count for r in rings))
+        data    = np.empty(last - first, dtype=self.buffer_dtype())
+        for s, ring in zip(streams, rings):
+            data[s.descriptor.data_name] = ring.snapshot()['value'][first-ring.start:last-ring.start]
+        if self.store_tuples and data.size > 0:
+            desc   = streams[0].descriptor
+            tuples = desc.tuples(as_structured_array=True)
+            idx    = np.arange(first, last) % len(tuples)
+            for a in desc.axis_names(with_metadata=True):
+                data[a] = tuples[a][idx]
+        return data
+
 class ProgressBar(Filter):
     """ Display progress bar(s) on the terminal/notebook.
 
@@ -512,6 +686,7 @@ class ProgressBar(Filter):
         chunk_sizes = [max(1,self.stream.descriptor.num_points_through_axis(axis+1)) for axis in range(num_axes)]
         self.num = min(self.num, num_axes)
 
+        from tqdm import tqdm, tqdm_notebook
         self.bars   = []
         for i in range(self.num):
             if self.notebook:
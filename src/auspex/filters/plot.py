@@ -16,6 +16,53 @@ from auspex.parameter import Parameter, IntParameter
 from auspex.log import logger
 from auspex.stream import InputConnector, OutputConnector
 
+def decimate_trace(x, y, num_bins):
+    """Reduce a trace to the min/max envelope of num_bins bins, keeping the points in order so
+    that the envelope draws as the original trace would at that resolution. For complex data the
+    extrema of both the real and imaginary parts are kept. Returns new (x, y) arrays."""
+    if y.size <= 2*num_bins:
+        return x, y.copy()
+    bin_size = int(np.ceil(y.size/num_bins))
+    num_bins = int(np.ceil(y.size/bin_size))
+    keys     = [y.real, y.imag] if np.iscomplexobj(y) else [y]
+    offsets  = []
+    for key in keys:
+        padded = np.full(num_bins*bin_size, np.nan)
+        padded[:y.size] = key
+        padded = padded.reshape(num_bins, bin_size)
+        # Unfilled (NaN) points never win unless the whole bin is unfilled
+        offsets.append(np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1))
+        offsets.append(np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1))
+    idx = np.sort(np.stack(offsets, axis=1), axis=1) + bin_size*np.arange(num_bins)[:,None]
+    idx = np.minimum(idx.ravel(), y.size-1)
+    return x[idx], y[idx]
+
+def block_average(data, factor, axis):
+    """Average blocks of factor points along axis, ignoring unfilled (NaN) points."""
+    num_blocks = int(np.ceil(data.shape[axis]/factor))
+    pad = [(0, 0)]*data.ndim
+    pad[axis] = (0, num_blocks*factor - data.shape[axis])
+    data  = np.pad(data.astype(np.result_type(data, np.float32)), pad, mode='constant', constant_values=np.nan)
+    shape = data.shape[:axis] + (num_blocks, factor) + data.shape[axis+1:]
+    data  = data.reshape(shape)
+    valid = ~np.isnan(data)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid, data, 0).sum(axis=axis+1)/valid.sum(axis=axis+1)
+
+def decimate_image(x, y, data, shape):
+    """Block-average a flattened (len(y), len(x)) image so that it fits within shape = (width,
+    height) pixels. Returns new (x, y, data) arrays with data flattened."""
+    image = data.reshape(len(y), len(x))
+    x_factor = int(np.ceil(len(x)/shape[0]))
+    y_factor = int(np.ceil(len(y)/shape[1]))
+    if x_factor > 1:
+        x     = block_average(np.asarray(x, dtype=np.float64), x_factor, 0)
+        image = block_average(image, x_factor, 1)
+    if y_factor > 1:
+        y     = block_average(np.asarray(y, dtype=np.float64), y_factor, 0)
+        image = block_average(image, y_factor, 0)
+    return x, y, image.flatten()
+
 class Plotter(Filter):
     sink      = InputConnector()
     plot_dims = IntParameter(value_range=(0,1,2), snap=1, default=0) # 0 means auto
@@ -96,10 +143,12 @@ class Plotter(Filter):
         self.idx = 0
 
     def update(self):
+        # Never ship more points than the client canvas can show
+        width, height = self.plot_server.canvas_size
         if self.plot_dims.value == 1:
-            self.plot_server.send(self.name, self.x_values, self.plot_buffer.copy())
+            self.plot_server.send(self.name, *decimate_trace(self.x_values, self.plot_buffer, width))
         elif self.plot_dims.value == 2:
-            self.plot_server.send(self.name, self.x_values, self.y_values, self.plot_buffer.copy())
+            self.plot_server.send(self.name, *decimate_image(self.x_values, self.y_values, self.plot_buffer, (width, height)))
 
     async def process_data(self, data):
         # If we get more than enough data, pause to update the plot if necessary
@@ -124,10 +173,7 @@ class Plotter(Filter):
                 self.last_update = time.time()
 
     async def on_done(self):
-        if self.plot_dims.value == 1:
-            self.plot_server.send(self.name, self.x_values, self.plot_buffer)
-        elif self.plot_dims.value == 2:
-            self.plot_server.send(self.name, self.x_values, self.y_values, self.plot_buffer)
+        self.update()
 
     def axis_label(self, index):
         unit_str = " ({})".format(self.descriptor.axes[index].unit) if self.descriptor.axes[index].unit else ''
@@ -9,10 +9,11 @@
 __all__ = ['SingleShotMeasurement']
 
 import numpy as np
-from scipy.signal import hilbert
+from scipy.signal import hilbert, fftconvolve
 from scipy.stats import gaussian_kde, norm
 from scipy.special import betaincinv
-from sklearn.linear_model import LogisticRegressionCV
+import sklearn
+from sklearn.linear_model import LogisticRegressionCV, SGDClassifier
 from time import sleep
 
 from .filter import Filter
@@ -23,6 +24,159 @@ import auspex.config as config
 import time
 import os
 
+# The logistic loss of SGDClassifier was renamed in scikit-learn 1.1
+SGD_LOG_LOSS = "log_loss" if tuple(int(v) for v in sklearn.__version__.split(".")[:2]) >= (1, 1) else "log"
+
+def row_histograms(data, edges):
+    """Histogram each row of the (T, N)-shaped data with the corresponding row of the (T, B+1)-shaped
+    uniformly spaced bin edges, counting as np.histogram would. Returns (T, B)-shaped counts."""
+    num_rows, num_bins = edges.shape[0], edges.shape[1] - 1
+    rows = np.arange(num_rows)[:, np.newaxis]
+    widths = edges[:, -1] - edges[:, 0]
+    old_settings = np.seterr(divide='ignore', invalid='ignore')
+    idx = np.nan_to_num(np.floor((data - edges[:, :1]) * (num_bins / widths)[:, np.newaxis]))
+    np.seterr(**old_settings)
+    idx = np.clip(idx, 0, num_bins-1).astype(np.intp)
+    #correct any rounding against the actual bin edges
+    idx -= (data < edges[rows, idx]) & (idx > 0)
+    idx += (data >= edges[rows, idx+1]) & (idx < num_bins-1)
+    #np.histogram puts everything in the last bin when the edges coincide
+    idx[widths == 0] = num_bins-1
+    counts = np.bincount((rows*num_bins + idx).ravel(), minlength=num_rows*num_bins)
+    return counts.reshape(num_rows, num_bins)
+
+def kernel_density(samples, points, max_exact=10000, oversample=8):
+    """Gaussian kernel density estimate of the samples evaluated at the given points, using Scott's
+    rule for the bandwidth like scipy.stats.gaussian_kde. Large sample sets are linearly binned onto
+    a grid finer than the bandwidth and convolved with the Gaussian kernel via an FFT."""
+    samples = np.ravel(samples)
+    n = samples.size
+    bandwidth = np.std(samples, ddof=1) * n**(-1./5)
+    lo = min(np.amin(samples), np.amin(points)) - 4*bandwidth
+    hi = max(np.amax(samples), np.amax(points)) + 4*bandwidth
+    step = bandwidth / oversample
+    if n <= max_exact or not step > 0 or (hi - lo) / step > 2**16:
+        return gaussian_kde(samples)(points)
+    num_grid = int(np.ceil((hi - lo) / step)) + 2
+    #linear binning onto the grid
+    pos = (samples - lo) / step
+    idx = np.floor(pos).astype(np.intp)
+    frac = pos - idx
+    counts = np.bincount(idx, 1 - frac, minlength=num_grid) + np.bincount(idx + 1, frac, minlength=num_grid)
+    #convolve with the Gaussian kernel out to 4 bandwidths
+    offsets = step * np.arange(-4*oversample, 4*oversample + 1)
+    kernel = np.exp(-0.5*(offsets/bandwidth)**2) / (n * bandwidth * np.sqrt(2*np.pi))
+    density = fftconvolve(counts[:num_grid], kernel, mode='same')
+    return np.interp(points, lo + step*np.arange(num_grid), density)
+
+class RunningMoments(object):
+    """Running per-time-bin mean, variance and I/Q covariance of complex records,
+    updated a batch of records at a time using the pairwise update of Chan et al."""
+
+    def __init__(self, record_length):
+        self.count = 0
+        self.mean  = np.zeros(record_length, dtype=np.complex128)
+        self.m2    = np.zeros(record_length) # Sum of |x - mean|^2
+        self.c2    = np.zeros(record_length) # Sum of (I - mean_I)*(Q - mean_Q)
+
+    def update(self, records):
+        """Add a (N, T)-shaped array of records to the accumulators."""
+        n = records.shape[0]
+        if n == 0:
+            return
+        batch_mean = np.mean(records, axis=0)
+        centered   = records - batch_mean
+        delta      = batch_mean - self.mean
+        total      = self.count + n
+        weight     = self.count * n / total
+        self.m2   += np.sum(centered.real**2 + centered.imag**2, axis=0) + weight * np.abs(delta)**2
+        self.c2   += np.sum(centered.real * centered.imag, axis=0) + weight * delta.real * delta.imag
+        self.mean += delta * (n / total)
+        self.count = total
+
+    def variance(self, ddof=1):
+        return self.m2 / (self.count - ddof)
+
+    def covariance(self, ddof=1):
+        return self.c2 / (self.count - ddof)
+
+class IncrementalStateClassifier(object):
+    """Logistic regression state classifier trained by minibatch stochastic gradient descent on a
+    reduced set of features: the projection of each record onto the matched filter kernel and onto
+    a few principal components of the records. The model is kept between fits, so each fit is warm
+    started from the previous coefficients and shots can be added as they stream in.
+
+    The coefficients only mean something in the feature space they were learned in, so the basis
+    and its scaling are kept fixed until the kernel moves by more than kernel_tolerance (see
+    needs_basis), at which point both the basis and the model start over."""
+
+    kernel_tolerance = 0.01
+
+    def __init__(self, num_components=3, batch_size=1000, epochs=5):
+        self.num_components = num_components
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.kernel = None
+        self.basis = None
+        self.model = None
+
+    def needs_basis(self, kernel):
+        """Whether the basis has to be found (again) for this kernel: there is none yet, or the
+        kernel differs in length or in direction from the one it was found for."""
+        if self.basis is None or len(kernel) != len(self.kernel):
+            return True
+        overlap = np.abs(np.vdot(self.kernel, kernel)) / (np.linalg.norm(self.kernel) * np.linalg.norm(kernel))
+        return overlap < 1 - self.kernel_tolerance
+
+    def set_basis(self, kernel, records, max_records=5000):
+        """Fix the feature projection from the kernel and the principal components of (N, T)-shaped
+        records, of which at most max_records evenly strided records are used. The model is reset,
+        since the signs of the principal components and the scaling are new."""
+        records = records[::max(1, records.shape[0] // max_records)]
+        kernel = np.asarray(kernel)
+        # Real and imaginary parts of the kernel projection as linear maps of [Re(x), Im(x)]
+        columns = [np.hstack([np.real(kernel), -np.imag(kernel)]),
+                   np.hstack([np.imag(kernel), np.real(kernel)])]
+        if self.num_components > 0:
+            stacked = np.hstack([np.real(records), np.imag(records)])
+            stacked -= np.mean(stacked, axis=0)
+            columns.extend(np.linalg.svd(stacked, full_matrices=False)[2][:self.num_components])
+        self.kernel = kernel
+        self.basis = np.array(columns).T
+        self.model = None
+        self.offset = 0.0
+        self.scale = 1.0
+        features = self.features(records)
+        self.offset = np.mean(features, axis=0)
+        self.scale = np.std(features, axis=0)
+        self.scale[self.scale == 0] = 1.0
+
+    def features(self, records):
+        """Project (N, T)-shaped records onto the standardized reduced features."""
+        record_length = self.basis.shape[0] // 2
+        projected = np.real(records).dot(self.basis[:record_length]) + np.imag(records).dot(self.basis[record_length:])
+        return (projected - self.offset) / self.scale
+
+    def partial_fit_features(self, features, states):
+        if self.model is None:
+            self.model = SGDClassifier(loss=SGD_LOG_LOSS, alpha=1e-4)
+        for start in range(0, features.shape[0], self.batch_size):
+            self.model.partial_fit(features[start:start+self.batch_size], states[start:start+self.batch_size], classes=[0, 1])
+
+    def partial_fit(self, records, states):
+        """Train on a minibatch of (N, T)-shaped records, e.g. as shots stream in."""
+        self.partial_fit_features(self.features(records), states)
+
+    def fit(self, records, states):
+        """Train for several shuffled epochs over the (N, T)-shaped records."""
+        features = self.features(records)
+        for epoch in range(self.epochs):
+            order = np.random.permutation(features.shape[0])
+            self.partial_fit_features(features[order], states[order])
+
+    def predict(self, records):
+        return self.model.predict(self.features(records))
+
 class SingleShotMeasurement(Filter):
 
     save_kernel = BoolParameter(default=False)
@@ -30,6 +184,10 @@ class SingleShotMeasurement(Filter):
     set_threshold = BoolParameter(default=False)
     zero_mean = BoolParameter(default=False)
     logistic_regression = BoolParameter(default=False)
+    streaming = BoolParameter(default=False)
+    max_shots = IntParameter(default=10000)
+    classifier = Parameter(allowed_values=["Full", "Reduced", "Incremental"], default="Full")
+    num_components = IntParameter(default=3)
 
     sink = InputConnector()
     fidelity = OutputConnector()
@@ -40,17 +198,31 @@ class SingleShotMeasurement(Filter):
 
     def __init__(self, save_kernel=False, optimal_integration_time=False,
                     zero_mean=False, set_threshold=False,
-                    logistic_regression=False, **kwargs):
+                    logistic_regression=False, streaming=False, max_shots=10000,
+                    classifier="Full", num_components=3, **kwargs):
+        """In streaming mode the shots are not stored. Running per-time-bin statistics of both states
+        are accumulated instead and only a reservoir sample of at most `max_shots` shots per state
+        is kept for the histogram and KDE steps.
+
+        The logistic regression `classifier` is one of "Full" (cross-validated fit on the full records),
+        "Reduced" (cross-validated fit on the projections onto the kernel and `num_components` principal
+        components) or "Incremental" (minibatch fit on the same reduced features, warm started from the
+        previous fit and fed with shots as they stream in)."""
         super(SingleShotMeasurement, self).__init__(**kwargs)
-        if len(kwargs) > 0:
-            self.save_kernel.value = save_kernel
-            self.optimal_integration_time.value = optimal_integration_time
-            self.zero_mean.value = zero_mean
-            self.set_threshold.value = set_threshold
-            self.logistic_regression.value = logistic_regression
+        self.save_kernel.value = save_kernel
+        self.optimal_integration_time.value = optimal_integration_time
+        self.zero_mean.value = zero_mean
+        self.set_threshold.value = set_threshold
+        self.logistic_regression.value = logistic_regression
+        self.streaming.value = streaming
+        self.max_shots.value = max_shots
+        self.classifier.value = classifier
+        self.num_components.value = num_components
+        self.state_classifier = None
 
         self.quince_parameters = [self.save_kernel, self.optimal_integration_time,
-            self.zero_mean, self.set_threshold, self.logistic_regression]
+            self.zero_mean, self.set_threshold, self.logistic_regression, self.streaming, self.max_shots,
+            self.classifier, self.num_components]
 
     def update_descriptors(self):
 
@@ -63,12 +235,22 @@ class SingleShotMeasurement(Filter):
         except ValueError:
             raise ValueError("Single shot filter sink does not appear to have a time axis!")
         self.num_segments = len(self.sink.descriptor.axes[self.descriptor.axis_num("segment")].points)
-        self.ground_data = np.zeros((self.record_length, self.num_segments//2), dtype=np.complex)
-        self.excited_data = np.zeros((self.record_length, self.num_segments//2), dtype=np.complex)
+        if self.streaming.value:
+            # Records are stored contiguously, one shot per row
+            num_shots = self.num_segments//2
+            if self.max_shots.value > 0:
+                num_shots = min(num_shots, self.max_shots.value)
+            dtype = np.result_type(self.descriptor.dtype, np.complex64)
+            self.ground_reservoir = np.zeros((num_shots, self.record_length), dtype=dtype)
+            self.excited_reservoir = np.zeros((num_shots, self.record_length), dtype=dtype)
+            self.reset_streaming()
+        else:
+            self.ground_data = np.zeros((self.record_length, self.num_segments//2), dtype=np.complex)
+            self.excited_data = np.zeros((self.record_length, self.num_segments//2), dtype=np.complex)
 
         output_descriptor = DataStreamDescriptor()
         output_descriptor.axes = [_ for _ in self.descriptor.axes if type(_) is SweepAxis]
-        output_descriptor._exp_src = self.sink.descriptor._exp_src
+        output_descriptor.exp_src = self.sink.descriptor.exp_src
         output_descriptor.dtype = np.complex128
         for os in self.fidelity.output_streams:
             os.set_descriptor(output_descriptor)
@@ -77,9 +259,76 @@ class SingleShotMeasurement(Filter):
 
     def final_init(self):
         self.counter = 1
+        if self.streaming.value:
+            self.reset_streaming()
+
+    def reset_streaming(self):
+        """Clear the running statistics and the shot reservoirs."""
+        self.ground_moments = RunningMoments(self.record_length)
+        self.excited_moments = RunningMoments(self.record_length)
+        self.ground_seen = 0
+        self.excited_seen = 0
+        self.records_seen = 0
+
+    def sample_reservoir(self, reservoir, records, seen):
+        """Reservoir sample the (N, T)-shaped records into the reservoir, given the number of
+        shots previously offered to it. Returns the new number of shots seen."""
+        capacity = reservoir.shape[0]
+        # Fill any empty slots first
+        num_fill = max(0, min(capacity - seen, records.shape[0]))
+        reservoir[seen:seen+num_fill] = records[:num_fill]
+        # Then replace slots with decreasing probability
+        records = records[num_fill:]
+        if records.shape[0] > 0:
+            shot_idx = seen + num_fill + np.arange(records.shape[0])
+            slots = (np.random.random(records.shape[0]) * (shot_idx + 1)).astype(np.int64)
+            keep = slots < capacity
+            reservoir[slots[keep]] = records[keep]
+        return seen + num_fill + records.shape[0]
+
+    def accumulate(self, records):
+        """Add (N, T)-shaped records of alternating ground and excited shots to the running
+        statistics, updating the kernel estimate as we go."""
+        first = self.records_seen % 2
+        ground = records[first::2]
+        excited = records[1-first::2]
+        self.ground_moments.update(ground)
+        self.excited_moments.update(excited)
+        if self.incremental_classifier_ready():
+            # Keep the shots interleaved so each minibatch holds both states
+            self.state_classifier.partial_fit(records, (first + np.arange(records.shape[0])) % 2)
+        self.ground_seen = self.sample_reservoir(self.ground_reservoir, ground, self.ground_seen)
+        self.excited_seen = self.sample_reservoir(self.excited_reservoir, excited, self.excited_seen)
+        self.records_seen += records.shape[0]
+
+        # The ground and excited data are views of the reservoirs in (T, N) layout
+        self.ground_data = self.ground_reservoir[:min(self.ground_seen, self.ground_reservoir.shape[0])].T
+        self.excited_data = self.excited_reservoir[:min(self.excited_seen, self.excited_reservoir.shape[0])].T
+        if self.ground_moments.count > 1 and self.excited_moments.count > 0:
+            self.kernel = self.matched_filter(self.ground_moments.mean, self.excited_moments.mean,
+                                              self.ground_moments.variance())[0]
+
+    def incremental_classifier_ready(self):
+        """Whether streamed shots can be fed to the incremental classifier, which needs the
+        feature projection found for a previous set of shots."""
+        return (self.logistic_regression.value and self.classifier.value == "Incremental" and
+                self.state_classifier is not None and self.state_classifier.basis is not None and
+                self.state_classifier.basis.shape[0] == 2*self.record_length)
 
     async def process_data(self, data):
         """Fill the ground and excited data bins"""
+        if self.streaming.value:
+            records = np.reshape(data, (-1, self.record_length))
+            while records.shape[0] > 0:
+                # Don't accumulate past the last segment
+                num_records = min(records.shape[0], self.num_segments - self.records_seen)
+                self.accumulate(records[:num_records])
+                records = records[num_records:]
+                if self.records_seen == self.num_segments:
+                    await self.process_shots()
+                    self.reset_streaming()
+            return
+
         if data.shape[0] == self.ground_data.size*2:
             dsplit = np.array(np.split(data,self.num_segments))
             gd = dsplit[::2]
@@ -97,60 +346,59 @@ class SingleShotMeasurement(Filter):
             self.counter += 1
         if self.counter > self.num_segments:
             self.counter = 1
-
-            filter_success = False 
-            filter_tries = 0
-            ORIG_TOL = self.TOLERANCE
-
-            while not filter_success:
-                try:
-                    filter_tries += 1
-                    self.compute_filter() 
-                    filter_success = True 
-                except np.linalg.linalg.LinAlgError as e:
-                    self.TOLERANCE *= 1.5
-                    logger.warning("Single shot filter failed with error: {}. Increasing kernel tolerance to {}.".format(e, self.TOLERANCE))
-                    logger.warning("Single shot filter retrying {} out of {} times.".format(filter_tries, self.MAX_TRIES))
-                if filter_tries > self.MAX_TRIES:
-                    logger.error("Could not find a non-singluar single-shot filter after {} tries with tolerance {}.".format(filter_tries, self.TOLERANCE))
-                    self.fidelity_result = np.complex128(0)
-                    break
-
-            self.TOLERANCE = ORIG_TOL
-
-            if self.logistic_regression.value:
-                self.logistic_fidelity()
-            if self.save_kernel.value:
-                self._save_kernel()
-            for os in self.fidelity.output_streams:
-                await os.push(self.fidelity_result)
+            await self.process_shots()
+
+    async def process_shots(self):
+        """Compute the filter and fidelity once all of the shots have been received."""
+        filter_success = False 
+        filter_tries = 0
+        ORIG_TOL = self.TOLERANCE
+
+        while not filter_success:
+            try:
+                filter_tries += 1
+                self.compute_filter() 
+                filter_success = True 
+            except np.linalg.linalg.LinAlgError as e:
+                self.TOLERANCE *= 1.5
+                logger.warning("Single shot filter failed with error: {}. Increasing kernel tolerance to {}.".format(e, self.TOLERANCE))
+                logger.warning("Single shot filter retrying {} out of {} times.".format(filter_tries, self.MAX_TRIES))
+            if filter_tries > self.MAX_TRIES:
+                logger.error("Could not find a non-singluar single-shot filter after {} tries with tolerance {}.".format(filter_tries, self.TOLERANCE))
+                self.fidelity_result = np.complex128(0)
+                break
+
+        self.TOLERANCE = ORIG_TOL
+
+        if self.logistic_regression.value:
+            self.logistic_fidelity()
+        if self.save_kernel.value:
+            self._save_kernel()
+        for os in self.fidelity.output_streams:
+            await os.push(self.fidelity_result)
 
     def compute_filter(self):
         """Compute the single shot kernel and obtain single-shot measurement fidelity.
 
         Expects that the data will be in self.ground_data and self.excited_data,
         which are (T, N)-shaped numpy arrays, with T the time axis and N the
-        number of shots."""
+        number of shots. In streaming mode the means and variances are taken
+        from the running statistics instead."""
         #get excited and ground state data
-        try:
-            ground_mean = np.mean(self.ground_data, axis=1)
-            excited_mean = np.mean(self.excited_data, axis=1)
-        except AttributeError:
-            raise Exception("Single shot filter does not appear to have any data!")
-        distance = np.abs(np.mean(ground_mean - excited_mean))
+        if self.streaming.value:
+            ground_mean = self.ground_moments.mean
+            excited_mean = self.excited_moments.mean
+            ground_var = self.ground_moments.variance()
+        else:
+            try:
+                ground_mean = np.mean(self.ground_data, axis=1)
+                excited_mean = np.mean(self.excited_data, axis=1)
+            except AttributeError:
+                raise Exception("Single shot filter does not appear to have any data!")
+            ground_var = np.var(self.ground_data, ddof=1, axis=1)
+        kernel, distance = self.matched_filter(ground_mean, excited_mean, ground_var)
         bias = np.mean(ground_mean + excited_mean) / distance
         logger.info("Found single-shot measurement distance: {} and bias {}.".format(distance, bias))
-        #construct matched filter kernel
-        old_settings = np.seterr(divide='ignore', invalid='ignore')
-        kernel = np.nan_to_num(np.divide(np.conj(ground_mean - excited_mean), np.var(self.ground_data, ddof=1, axis=1)))
-        np.seterr(**old_settings)
-        #sets kernel to zero when difference is too small, and prevents
-        #kernel from diverging when var->0 at beginning of record_length
-        kernel = np.multiply(kernel, np.greater(np.abs(ground_mean - excited_mean), self.TOLERANCE * distance))
-        #subtract offset to cancel low-frequency fluctuations when integrating
-        #raw data (not demod)
-        if self.zero_mean.value:
-            kernel = kernel - np.mean(kernel)
         logger.info("Found single shot filter norm: {}.".format(np.sum(np.abs(kernel))))
         #annoyingly numpy's isreal has the opposite behavior to MATLAB's
         if not np.any(np.imag(kernel) > np.finfo(np.complex128).eps):
@@ -162,6 +410,7 @@ class SingleShotMeasurement(Filter):
         weighted_ground = self.ground_data * kernel[:, np.newaxis]
         weighted_excited = self.excited_data * kernel[:, np.newaxis]
 
+
         if self.optimal_integration_time.value:
             #take cumulative sum up to each time step
             ground_I = np.real(weighted_ground)
@@ -175,23 +424,21 @@ class SingleShotMeasurement(Filter):
             I_mins = np.amin(np.minimum(int_ground_I, int_excited_I), axis=1)
             I_maxes = np.amax(np.maximum(int_ground_I, int_excited_I), axis=1)
             num_times = int_ground_I.shape[0]
-            fidelities = np.zeros((num_times, ))
-            #Loop through each integration point; estimate the CDF and
-            #then calculate best measurement fidelity
-            for pt in range(num_times):
-                bins = np.linspace(I_mins[pt], I_maxes[pt], 100)
-                g_PDF = np.histogram(int_ground_I[pt, :], bins)[0]
-                e_PDF = np.histogram(int_excited_I[pt,:], bins)[0]
-                fidelities[pt] = np.sum(np.abs(g_PDF - e_PDF)) / np.sum(g_PDF + e_PDF)
+            #Histogram every integration point at once with 100 bin edges spanning
+            #each point's range; then calculate best measurement fidelity
+            steps = (I_maxes - I_mins) / 99
+            edges = np.arange(100) * steps[:, np.newaxis] + I_mins[:, np.newaxis]
+            edges[:, -1] = I_maxes
+            g_PDFs = row_histograms(int_ground_I, edges)
+            e_PDFs = row_histograms(int_excited_I, edges)
+            fidelities = np.sum(np.abs(g_PDFs - e_PDFs), axis=1) / np.sum(g_PDFs + e_PDFs, axis=1)
             best_idx = fidelities.argmax(axis=0)
             self.best_integration_time = best_idx
             logger.info("Found best integration time at {} out of {} decimated points.".format(best_idx, num_times))
             #redo calculation with KDEs to get a more accurate estimate
             bins = np.linspace(I_mins[best_idx], I_maxes[best_idx], 100)
-            g_KDE = gaussian_kde(int_ground_I[best_idx, :])
-            e_KDE = gaussian_kde(int_excited_I[best_idx, :])
-            g_PDF = g_KDE(bins)
-            e_PDF = e_KDE(bins)
+            g_PDF = kernel_density(int_ground_I[best_idx, :], bins)
+            e_PDF = kernel_density(int_excited_I[best_idx, :], bins)
         else:
             ground_I = np.sum(np.real(weighted_ground), axis=0)
             ground_Q = np.sum(np.imag(weighted_excited), axis=0)
@@ -200,10 +447,8 @@ class SingleShotMeasurement(Filter):
             I_min = np.amin(np.minimum(ground_I, excited_I))
             I_max = np.amax(np.maximum(ground_I, excited_I))
             bins = np.linspace(I_min, I_max, 100)
-            g_KDE = gaussian_kde(ground_I)
-            e_KDE = gaussian_kde(excited_I)
-            g_PDF = g_KDE(bins)
-            e_PDF = e_KDE(bins)
+            g_PDF = kernel_density(ground_I, bins)
+            e_PDF = kernel_density(excited_I, bins)
 
         self.kernel = kernel
         max_F_I = 1 - 0.5 * (1 - 0.5 * (bins[2] - bins[1]) * np.sum(np.abs(g_PDF - e_PDF)))
@@ -232,15 +477,13 @@ class SingleShotMeasurement(Filter):
             Q_min = np.amin([int_ground_Q[best_idx,:], int_excited_Q[best_idx,:]])
             Q_max = np.argmax([int_ground_Q[best_idx,:], int_excited_Q[best_idx,:]])
             qbins = np.linspace(Q_min, Q_max, 100)
-            g_KDE = gaussian_kde(int_ground_Q[best_idx, :])
-            e_KDE = gaussian_kde(int_excited_Q[best_idx, :])
+            g_PDF_Q = kernel_density(int_ground_Q[best_idx, :], qbins)
+            e_PDF_Q = kernel_density(int_excited_Q[best_idx, :], qbins)
         else:
             qbins = np.linspace(np.amin([ground_Q, excited_Q]), np.amax([ground_Q, excited_Q]), 100)
-            g_KDE = gaussian_kde(ground_Q)
-            e_KDE = gaussian_kde(excited_Q)
+            g_PDF_Q = kernel_density(ground_Q, qbins)
+            e_PDF_Q = kernel_density(excited_Q, qbins)
         self.pdf_data["Q Bins"] = qbins
-        g_PDF_Q = g_KDE(qbins)
-        e_PDF_Q = e_KDE(qbins)
         self.pdf_data["Ground Q PDF"] =  g_PDF_Q
         self.pdf_data["Excited Q PDF"] =  e_PDF_Q
         self.pdf_data["Max Q Fidelity"] = 1 - 0.5 * (1 - 0.5 * (qbins[2] - qbins[1]) * np.sum(np.abs(g_PDF_Q - e_PDF_Q)))
@@ -257,27 +500,60 @@ class SingleShotMeasurement(Filter):
         self.fidelity_result = self.pdf_data["Max I Fidelity"] + 1j * self.pdf_data["Max Q Fidelity"]
         logger.info("Single shot fidelity filter found: {}".format(self.fidelity_result))
 
+    def matched_filter(self, ground_mean, excited_mean, ground_var):
+        """Construct the matched filter kernel from the per-time-bin state means and the ground
+        state variance. Returns the kernel and the mean distance between the states."""
+        distance = np.abs(np.mean(ground_mean - excited_mean))
+        #construct matched filter kernel
+        old_settings = np.seterr(divide='ignore', invalid='ignore')
+        kernel = np.nan_to_num(np.divide(np.conj(ground_mean - excited_mean), ground_var))
+        np.seterr(**old_settings)
+        #sets kernel to zero when difference is too small, and prevents
+        #kernel from diverging when var->0 at beginning of record_length
+        kernel = np.multiply(kernel, np.greater(np.abs(ground_mean - excited_mean), self.TOLERANCE * distance))
+        #subtract offset to cancel low-frequency fluctuations when integrating
+        #raw data (not demod)
+        if self.zero_mean.value:
+            kernel = kernel - np.mean(kernel)
+        return kernel, distance
+
     def logistic_fidelity(self):
-        #group data and assign state labels
-        gnd_features = np.hstack([np.real(self.ground_data.T),
-                                np.imag(self.ground_data.T)])
-        ex_features = np.hstack([np.real(self.excited_data.T),
-                                np.imag(self.excited_data.T)])
-        #liblinear wants arrays in C order
-        features = np.ascontiguousarray(np.vstack([gnd_features, ex_features]))
         state = np.ascontiguousarray(np.hstack([np.zeros(self.ground_data.shape[1]),
                                                 np.ones(self.excited_data.shape[1])]))
-        #Set up logistic regression with cross-validation using liblinear.
         #Cs sets the inverse of the regularization strength, which will be optimized
         #through cross-validation. Uses the default Stratified K-Folds
-        #CV generator, with 3 folds.
+        #CV generator, with 3 folds, which are run in parallel.
         #This is set up to be as consistent with the MATLAB implementation
         #as I can make it. --GJR
         Cs = np.logspace(-1,2,5)
-        logreg = LogisticRegressionCV(Cs, cv=3, solver='liblinear')
-        logreg.fit(features, state) #fit the model
-        predictions = logreg.predict(features) #in-place classification
-        score = logreg.score(features,state) #mean accuracy of classification
+        if self.classifier.value == "Full":
+            #group data and assign state labels
+            gnd_features = np.hstack([np.real(self.ground_data.T),
+                                    np.imag(self.ground_data.T)])
+            ex_features = np.hstack([np.real(self.excited_data.T),
+                                    np.imag(self.excited_data.T)])
+            #liblinear wants arrays in C order
+            features = np.ascontiguousarray(np.vstack([gnd_features, ex_features]))
+            #Set up logistic regression with cross-validation using liblinear.
+            logreg = LogisticRegressionCV(Cs=Cs, cv=3, solver='liblinear', n_jobs=-1)
+            logreg.fit(features, state) #fit the model
+            predictions = logreg.predict(features) #in-place classification
+        else:
+            records = np.vstack([self.ground_data.T, self.excited_data.T])
+            if self.state_classifier is None:
+                self.state_classifier = IncrementalStateClassifier(self.num_components.value)
+            if self.classifier.value == "Reduced" or self.state_classifier.needs_basis(self.kernel):
+                # The incremental model keeps its basis, and what it learned, while the kernel holds
+                self.state_classifier.set_basis(self.kernel, records)
+            if self.classifier.value == "Reduced":
+                features = np.ascontiguousarray(self.state_classifier.features(records))
+                logreg = LogisticRegressionCV(Cs=Cs, cv=3, solver='liblinear', n_jobs=-1)
+                logreg.fit(features, state)
+                predictions = logreg.predict(features)
+            else:
+                self.state_classifier.fit(records, state)
+                predictions = self.state_classifier.predict(records)
+        score = np.mean(predictions == state) #mean accuracy of classification
         N = len(predictions)
         S = np.sum(predictions == state) #how many we got right
         #now calculate confidence intervals
@@ -9,7 +9,6 @@
 __all__ = ['AlazarStreamSelector', 'X6StreamSelector', 'DummydigStreamSelector']
 
 from auspex.log import logger
-from auspex.instruments import *
 from auspex.parameter import Parameter, IntParameter
 from .filter import Filter
 from auspex.stream import DataStreamDescriptor, DataAxis, InputConnector, OutputConnector
@@ -29,6 +28,7 @@ class AlazarStreamSelector(Filter):
         self.quince_parameters = [self.channel]
 
     def get_descriptor(self, source_instr_settings, channel_settings):
+        from auspex.instruments import AlazarChannel
         channel = AlazarChannel(channel_settings)
 
         # Add the time axis
@@ -55,6 +55,7 @@ class X6StreamSelector(Filter):
 
     def get_descriptor(self, source_instr_settings, channel_settings):
         # Create a channel
+        from auspex.instruments import X6Channel
         channel = X6Channel(channel_settings)
 
         descrip = DataStreamDescriptor()
@@ -88,6 +89,7 @@ class DummydigStreamSelector(Filter):
         self.quince_parameters = [self.channel]
 
     def get_descriptor(self, source_instr_settings, channel_settings):
+        from auspex.instruments import DummydigChannel
         channel = DummydigChannel(channel_settings)
 
         # Add the time axis
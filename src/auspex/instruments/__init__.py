@@ -1,7 +1,7 @@
-import pkgutil
-import importlib
+# Exported names are resolved on first access, so that only the modules
+# (and drivers or libraries) actually used by an experiment get imported.
+from auspex.registry import LazyRegistry
 
-for loader, name, is_pkg in pkgutil.iter_modules(__path__):
-	module = importlib.import_module('auspex.instruments.' + name)
-	if hasattr(module, "__all__"):
-		globals().update((name, getattr(module, name)) for name in module.__all__)
+registry    = LazyRegistry(__name__, __path__)
+__getattr__ = registry.getattr
+__dir__     = registry.dir
@@ -88,6 +88,8 @@ class Agilent33500B(SCPIInstrument):
 
     Replacement model for 33220 series with some changes and additional sequencing functionality
     """
+    batch_length = 1024 # Takes compound messages, see SCPIInstrument.batch
+
     def __init__(self, resource_name=None, *args, **kwargs):
         super(Agilent33500B, self).__init__(resource_name, *args, **kwargs)
         self.name = "Agilent 33500B AWG"
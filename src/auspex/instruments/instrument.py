@@ -7,10 +7,11 @@ import numpy as np
 import os
 import time
 import socket
+from contextlib import contextmanager
 from unittest.mock import MagicMock
 
 from auspex.log import logger
-from .interface import Interface, VisaInterface, PrologixInterface
+from .interface import Interface, VisaInterface, PrologixInterface, BatchedInterface, PendingQuery
 
 # ----- 25 Oct 2018 -- Added config import for ST-15 delta support
 # config mods include optional parameters to help constrain import prompted
@@ -108,6 +109,10 @@ class SCPICommand(Command):
         if self.set_string is None and self.get_string is None:
             raise ValueError("Neither a setter nor a getter was specified.")
 
+        # Skip writing values the instrument already holds. Only commands that can be read
+        # back are assumed to be settings rather than actions, unless told otherwise.
+        self.cached = self.kwargs.pop('cached', self.get_string is not None and self.set_string is not None)
+
 class StringCommand(Command):
     formatter = '{:s}'
     def convert_get(self, get_value_instrument):
@@ -221,6 +226,12 @@ class Instrument(metaclass=MetaInstrument):
     def disconnect(self):
         pass
 
+    def setup_group(self):
+        """Instruments returning the same key share a driver, bus or connection, and are
+        connected and configured one at a time by the experiment. Others are set up
+        concurrently. Drivers are not assumed to be thread safe, so this defaults to the class."""
+        return type(self)
+
     # We now expect the main experiment to deal with shutting down the instruments
     # def __del__(self):
     #     self.disconnect()
@@ -244,6 +255,10 @@ class SCPIInstrument(Instrument):
 
     __isfrozen = False
 
+    # Longest compound message (commands joined by semicolons) the instrument accepts.
+    # Batched messages are sent one by one unless a driver raises this.
+    batch_length = 0
+
     def __init__(self, resource_name=None, name="Yet-to-be-named SCPI Instrument"):
         self.name            = name
         self.resource_name   = resource_name
@@ -294,11 +309,86 @@ class SCPIInstrument(Instrument):
     def disconnect(self):
         self.interface.close()
 
+    def invalidate_settings(self):
+        """Forget which settings the instrument holds, e.g. after changing them from the front
+        panel or through write_raw, so that the next writes are all sent. Settings changed by
+        messages sent with write or query are forgotten on their own."""
+        if self.interface is not None:
+            self.interface.settings_cache.clear()
+
+    @contextmanager
+    def batch(self, max_length=None):
+        """Hold back the messages sent inside this block and send them as a few compound
+        messages instead, e.g.
+
+            with awg.batch():
+                awg.frequency = 1e6
+                amplitude = awg.queue("amplitude")
+            print(amplitude.value)
+        """
+        if isinstance(self.interface, BatchedInterface):
+            yield self.interface
+            return
+        interface = BatchedInterface(self.interface, self.batch_length if max_length is None else max_length)
+        self.interface = interface
+        try:
+            yield interface
+        finally:
+            self.interface = interface.interface
+            interface.flush()
+
+    def queue(self, name, **kwargs):
+        """Read the setting `name` along with the rest of the current batch, returning a
+        PendingQuery whose value is available once the batch has been sent."""
+        cmd   = getattr(type(self), "get_" + name).command
+        query = cmd.get_string.format(**kwargs)
+        if isinstance(self.interface, BatchedInterface) and cmd.get_delay is None:
+            return self.interface.queue(query, cmd.convert_get)
+        pending = PendingQuery(query, cmd.convert_get)
+        pending.resolve(self.interface.query(query))
+        if cmd.get_delay is not None:
+            time.sleep(cmd.get_delay)
+        return pending
+
+    async def set_async(self, name, value, **kwargs):
+        """Set `name` on the interface's worker thread, so that slow writes, set delays and
+        ramps don't hold up the event loop."""
+        return await self.interface.run_async(getattr(self, "set_" + name), value, **kwargs)
+
+    async def get_async(self, name, **kwargs):
+        return await self.interface.run_async(getattr(self, "get_" + name), **kwargs)
+
+    def setting(self, name, value, **kwargs):
+        """The message that sets `name` to `value`, for sending as part of a larger message, or
+        None if the instrument already holds that setting. The setting is recorded as held, so
+        the message has to be sent."""
+        cmd     = getattr(type(self), "set_" + name).command
+        command = cmd.set_string.format(cmd.convert_set(value), **kwargs)
+        if cmd.cached:
+            key = settings_key(name, kwargs)
+            if self.interface.settings_cache.get(key) == command:
+                return None
+            self.interface.settings_cache[key] = command
+        return command
+
+    def set_all(self, settings_dict):
+        with self.batch():
+            super(SCPIInstrument, self).set_all(settings_dict)
+
+    def setup_group(self):
+        """VISA sessions are independent, except that instruments on one GPIB bus or behind
+        one Prologix adapter (IPv4_ADDR::GPIB_ADDR) have to take turns."""
+        parts = str(self.resource_name).split("::")
+        if "GPIB" in parts[0] or (len(parts) == 2 and parts[1].isdigit() and is_valid_ipv4(parts[0])):
+            return parts[0]
+        return self
+
     # We want to lock the class dictionary
     # This solution from http://stackoverflow.com/questions/3603502/prevent-creating-new-attributes-outside-init
 
     def __setattr__(self, key, value):
-        if self.__isfrozen and not hasattr(self, key):
+        # Look the name up without hasattr, which would run a property's getter (and query the instrument)
+        if self.__isfrozen and not (key in self.__dict__ or hasattr(type(self), key)):
             raise TypeError( "{} has a frozen class. Cannot access attribute {}".format(self, key) )
         object.__setattr__(self, key, value)
 
@@ -318,6 +408,10 @@ class SCPIInstrument(Instrument):
         return "{} @ {}".format(self.name, self.resource_name)
 
 
+def settings_key(name, kwargs):
+    """How a setting is filed in the interface's settings_cache."""
+    return (name,) + tuple(sorted(kwargs.items()))
+
 def add_command_SCPI(instr, name, cmd):
     """Helper function for parsing Instrument attributes and turning them into
     setters and getters for SCPI style commands."""
@@ -330,6 +424,7 @@ def add_command_SCPI(instr, name, cmd):
         if new_cmd.get_delay is not None:
             time.sleep(new_cmd.get_delay)
         return new_cmd.convert_get(val)
+    fget.command = new_cmd
 
     def fset(self, val, **kwargs):
         if new_cmd.value_range is not None:
@@ -344,9 +439,18 @@ def add_command_SCPI(instr, name, cmd):
 
         if isinstance(cmd, RampCommand):
             if 'increment' in kwargs:
-                new_cmd.increment = kwargs['increment'] 
+                new_cmd.increment = kwargs.pop('increment')
             if 'pause' in kwargs:
-                new_cmd.pause = kwargs['pause']
+                new_cmd.pause = kwargs.pop('pause')
+            command = new_cmd.set_string.format(val)
+        else:
+            command = new_cmd.set_string.format(new_cmd.convert_set(val), **kwargs)
+
+        key = settings_key(name, kwargs)
+        if new_cmd.cached and self.interface.settings_cache.get(key) == command:
+            return
+
+        if isinstance(cmd, RampCommand):
             # Ramp from one value to another, making sure we actually take some steps
             start_value = float(self.interface.query(new_cmd.get_string))
             approx_steps = int(abs(val-start_value)/new_cmd.increment)
@@ -356,14 +460,20 @@ def add_command_SCPI(instr, name, cmd):
                 values = np.linspace(start_value, val, approx_steps+2)
             for v in values:
                 self.interface.write(new_cmd.set_string.format(v))
+                self.interface.flush()
                 time.sleep(new_cmd.pause)
         else:
             # Go straight to the desired value
-            set_value = new_cmd.convert_set(val)
-            self.interface.write(new_cmd.set_string.format(set_value, **kwargs))
+            self.interface.write(command)
             if new_cmd.set_delay is not None:
+                # Only wait once the command has actually gone out
+                self.interface.flush()
                 time.sleep(new_cmd.set_delay)
 
+        if new_cmd.cached:
+            self.interface.settings_cache[key] = command
+    fset.command = new_cmd
+
     # Add getter and setter methods for passing around
     if new_cmd.additional_args is None:
         # We add properties in this case since not additional arguments are required
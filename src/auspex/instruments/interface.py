@@ -1,14 +1,85 @@
 import os
-import visa
+import asyncio
+import functools
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from auspex.log import logger
-from .prologix import PrologixSocketResource
+
+def setting_units(message):
+    """The program message units of an SCPI message that aren't queries, as (header, unit) pairs.
+    Headers are cut down to the first three letters of each node, which the long and short forms
+    of a command share, so a few unrelated commands may match as well."""
+    units = []
+    for unit in str(message).split(";"):
+        unit = " ".join(unit.split()).lstrip(":")
+        header = unit.split(" ", 1)[0].upper()
+        if header and not header.endswith("?"):
+            units.append((tuple(node[:3] for node in header.split(":")), unit))
+    return units
+
+def headers_match(first, second):
+    """Whether two headers from setting_units agree on the trailing nodes they have in common,
+    since either may be relative to a subsystem the other spells out."""
+    n = min(len(first), len(second))
+    return first[-n:] == second[-n:]
 
 class Interface(object):
     """Currently just a dummy interface for testing."""
     def __init__(self):
         super(Interface, self).__init__()
+        # The last command written for each cached instrument setting (see add_command_SCPI).
+        # This belongs to the connection, so that reconnecting starts afresh.
+        self.settings_cache = {}
+        # Called whenever the instrument is reset, for drivers that keep other state about it
+        self.reset_callbacks = []
+        self._executor = None
+    @property
+    def executor(self):
+        """The worker thread this connection's awaitable calls run on, one call at a time."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="interface")
+        return self._executor
+    def run_async(self, func, *args, **kwargs):
+        """Run a blocking call (anything that talks to this instrument) on the worker thread,
+        returning a future the event loop can await while the call is in progress."""
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    async def write_async(self, value):
+        return await self.run_async(self.write, value)
+    async def query_async(self, value):
+        return await self.run_async(self.query, value)
+    def check_reset(self, command):
+        # Resets and recalls change the instrument state behind the cache's back
+        if "*RST" in command or "*RCL" in command:
+            self.forget_state()
+        elif self.settings_cache:
+            self.forget_settings(command)
+    def add_reset_callback(self, callback):
+        if callback not in self.reset_callbacks:
+            self.reset_callbacks.append(callback)
+    def forget_state(self):
+        """Forget everything known about the instrument's state, as after a reset or recall."""
+        self.settings_cache.clear()
+        for callback in self.reset_callbacks:
+            callback()
+    def forget_settings(self, message):
+        """Forget the cached settings that a message sets to something else, since drivers and
+        experiments also write settings directly rather than through their commands. Cached
+        commands are matched on the trailing header nodes the two have in common, so relative
+        headers on either side are caught too, and the last unit of a message that matches wins."""
+        written = setting_units(message)
+        if not written:
+            return
+        for key, command in list(self.settings_cache.items()):
+            for header, unit in setting_units(command):
+                matches = [u for h, u in written if headers_match(h, header)]
+                if matches and matches[-1] != unit:
+                    del self.settings_cache[key]
+                    break
+    def flush(self):
+        # Nothing is held back unless batching, see BatchedInterface
+        pass
     def write(self, value):
+        self.check_reset(value)
         logger.debug("Writing '%s'" % value)
     def query(self, value):
         logger.debug("Querying '%s'" % value)
@@ -19,12 +90,15 @@ class Interface(object):
         logger.debug("Returning values %s" % query)
         return np.random.random()
     def close(self):
-        pass
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
 class VisaInterface(Interface):
     """PyVISA interface for communicating with instruments."""
     def __init__(self, resource_name):
         super(VisaInterface, self).__init__()
+        import visa # Deferred, since pyvisa is slow to import
         try:
             if os.name == "nt":
                 visa_loc = 'C:\\windows\\system32\\visa64.dll'
@@ -39,6 +113,7 @@ class VisaInterface(Interface):
     def value(self, query_string):
         return self._resource.query_ascii_values(query_string)
     def write(self, write_string):
+        self.check_reset(write_string)
         self._resource.write(write_string)
     def write_raw(self, raw_string):
         self._resource.write_raw(raw_string)
@@ -46,7 +121,10 @@ class VisaInterface(Interface):
         return self._resource.read()
     def read_raw(self):
         return self._resource.read_raw()
+    def read_bytes(self, count):
+        return self._resource.read_bytes(count)
     def query(self, query_string):
+        self.check_reset(query_string)
         return self._resource.query(query_string)
     def write_binary_values(self, query_string, values, **kwargs):
         return self._resource.write_binary_values(query_string, values, **kwargs)
@@ -57,6 +135,7 @@ class VisaInterface(Interface):
         return self._resource.query_binary_values(query_string, container=container, datatype=datatype,
                 is_big_endian=is_big_endian)
     def close(self):
+        super(VisaInterface, self).close()
         self._resource.close()
 
     # IEEE Mandated SCPI commands
@@ -71,6 +150,7 @@ class VisaInterface(Interface):
     def OPC(self):
         return self._resource.query("*OPC?") # Operation Complete Command
     def RST(self):
+        self.forget_state()
         self._resource.write("*RST") # Reset Command
     def SRE(self):
         return self._resource.query("*SRE?") # Service Request Enable Query
@@ -85,6 +165,7 @@ class PrologixInterface(VisaInterface):
     """Prologix-Ethernet interface for communicating with remote GPIB instruments."""
     def __init__(self, resource_name):
         Interface.__init__(self)
+        from .prologix import PrologixSocketResource
         try:
             if len(resource_name.split("::")) != 2:
                     raise Exception("Resource name for Prologix-Ethernet adapter must be of form IPv4_ADDR::GPIB_ADDR")
@@ -92,3 +173,99 @@ class PrologixInterface(VisaInterface):
             self._resource.connect()
         except:
             raise Exception("Unable to create the resource '%s'" % resource_name)
+
+class PendingQuery(object):
+    """The response to a query queued in a batch, available as `value` once the batch is sent."""
+    def __init__(self, query_string, convert=None):
+        super(PendingQuery, self).__init__()
+        self.query_string = query_string
+        self.convert      = convert
+        self.done         = False
+        self._value       = None
+    def resolve(self, response):
+        self._value = self.convert(response) if self.convert is not None else response
+        self.done   = True
+    @property
+    def value(self):
+        if not self.done:
+            raise RuntimeError("Query '{}' has not been sent yet.".format(self.query_string))
+        return self._value
+
+class BatchedInterface(object):
+    """Stands in for an instrument's interface while batching (see SCPIInstrument.batch).
+    Writes are held back and sent joined into SCPI compound messages of at most `max_length`
+    characters, and queued queries are sent together, their responses split in order.
+    Anything else is passed on to the wrapped interface once the pending messages are out."""
+    def __init__(self, interface, max_length=0):
+        super(BatchedInterface, self).__init__()
+        self.interface  = interface
+        self.max_length = max_length
+        self.pending    = []
+        self.queries    = []
+        self.held       = {} # The settings cache as it was before the pending messages
+    @staticmethod
+    def join(messages):
+        if len(messages) == 1:
+            return messages[0]
+        # Start each message from the root of the command tree, otherwise the instrument reads
+        # it relative to the subsystem of the one before
+        parts = [m.strip().rstrip(";") for m in messages]
+        return ";".join([parts[0]] + [m if m[:1] in (":", "*") else ":" + m for m in parts[1:]])
+    def fits(self, message):
+        return len(self.join(self.pending + [message])) <= self.max_length
+    def hold(self, message, query=None):
+        if self.pending and not self.fits(message):
+            self.flush()
+        if not self.pending:
+            self.held = dict(self.interface.settings_cache)
+        self.pending.append(message)
+        if query is not None:
+            self.queries.append(query)
+        if not self.max_length:
+            # The instrument takes one message at a time, so send it straight away
+            self.flush()
+    def write(self, value):
+        # Forget cached settings now, so that settings queued after a reset are not skipped
+        self.interface.check_reset(value)
+        self.hold(value)
+    def query(self, value):
+        self.flush()
+        return self.interface.query(value)
+    def run_async(self, func, *args, **kwargs):
+        self.flush()
+        return self.interface.run_async(func, *args, **kwargs)
+    def queue(self, query_string, convert=None):
+        """Queue a query and return its PendingQuery."""
+        pending = PendingQuery(query_string, convert)
+        self.hold(query_string, pending)
+        return pending
+    def flush(self):
+        """Send everything held back."""
+        if not self.pending:
+            return
+        message, queries = self.join(self.pending), self.queries
+        self.pending, self.queries = [], []
+        try:
+            if not queries:
+                self.interface.write(message)
+                return
+            response = self.interface.query(message)
+        except:
+            # Settings were recorded as they were queued, but may never have arrived
+            cache = self.interface.settings_cache
+            for key in [k for k, v in cache.items() if self.held.get(k) != v]:
+                del cache[key]
+            raise
+        responses = [response] if len(queries) == 1 else str(response).strip().split(";")
+        if len(responses) != len(queries):
+            raise ValueError("Expected {} responses to '{}' but got '{}'.".format(len(queries), message, ";".join(responses)))
+        for q, r in zip(queries, responses):
+            q.resolve(r)
+    def __getattr__(self, name):
+        attr = getattr(self.interface, name)
+        if not callable(attr):
+            return attr
+        def passthrough(*args, **kwargs):
+            self.flush()
+            return attr(*args, **kwargs)
+        return passthrough
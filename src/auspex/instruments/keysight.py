@@ -11,6 +11,7 @@ __all__ = ['KeysightM8190A', 'Sequence', 'Scenario']
 from auspex.log import logger
 from .instrument import SCPIInstrument, StringCommand, FloatCommand, IntCommand, Command
 from .binutils import BitField, BitFieldUnion
+from .segment_cache import SegmentCache
 
 import logging
 import warnings
@@ -167,6 +168,12 @@ class Scenario(object):
 class KeysightM8190A(SCPIInstrument):
     """Keysight M8190A arbitrary waveform generator"""
 
+    batch_length = 1024 # Takes compound messages, see SCPIInstrument.batch
+
+    # Waveform memory per channel (option -02G) and the number of segments it can be split into
+    segment_memory = 2*1024**3
+    max_segments   = 512*1024
+
     ref_source         = StringCommand(scpi_string=":ROSC:SOUR",
                           allowed_values=("EXTERNAL", "AXI", "INTERNAL"))
     ref_source_freq    = FloatCommand(scpi_string=":ROSC:FREQ", value_range=(1e6, 200e6))
@@ -212,6 +219,7 @@ class KeysightM8190A(SCPIInstrument):
         self._unfreeze()
         self.run = self.initiate
         self.stop = self.abort
+        self.segment_caches = {} # By channel, see cached_waveform
         self._freeze()
 
     def connect(self, resource_name=None, interface_type=None):
@@ -221,6 +229,7 @@ class KeysightM8190A(SCPIInstrument):
             self.resource_name += "::inst0::INSTR"
         super(KeysightM8190A, self).connect(resource_name=resource_name, interface_type=interface_type)
         self.interface._resource.read_termination = u"\n"
+        self.segment_caches.clear()
 
     def abort(self):
         """Abort/stop signal generation on a channel"""
@@ -237,8 +246,31 @@ class KeysightM8190A(SCPIInstrument):
             raise ValueError("reference source must be one of {:s}".format(str(allowed_values)))
         return self.interface.query(":ROSC:SOUR:CHEC? {:s}".format(source)) == '1'
 
+    def segment_cache(self, channel=1):
+        if channel not in self.segment_caches:
+            self.segment_caches[channel] = SegmentCache(self.segment_memory, self.max_segments)
+        return self.segment_caches[channel]
+
+    def cached_waveform(self, wf_data, channel=1):
+        """Return a segment holding `wf_data`, only defining and uploading one if the AWG
+        doesn't have it already. Least recently used cached segments are deleted to make room,
+        so reference segments from the sequence table only after getting them all."""
+        # A reset deletes the segments, so stop trusting the cache then
+        self.interface.add_reset_callback(self.segment_caches.clear)
+        cache = self.segment_cache(channel)
+        key = cache.key(wf_data)
+        segment_id = cache.lookup(key)
+        if segment_id is None:
+            for old_segment_id in cache.make_room(len(wf_data)):
+                self.delete_waveform(old_segment_id, channel=channel)
+            segment_id = self.define_waveform(len(wf_data), channel=channel)
+            self.upload_waveform(wf_data, segment_id, channel=channel)
+            cache.add(key, segment_id, len(wf_data))
+        return segment_id
+
     def define_waveform(self, length, segment_id=None, channel=1):
         if segment_id:
+            self.segment_cache(channel).discard(segment_id)
             self.interface.write(":TRAC{:d}:DEF {:d},{:d}".format(channel, segment_id, length))
         else:
             r = self.interface.query(":TRAC{:d}:DEF:NEW? {:d}".format(channel, length))
@@ -256,6 +288,7 @@ class KeysightM8190A(SCPIInstrument):
             raise ValueError("Waveform is too large for single transfer, go improve the upload_waveform() method.")
         offset = 0
         command_string = ":TRAC{:d}:DATA {:d},{:d},".format(channel, segment_id, offset)
+        self.segment_cache(channel).discard(segment_id)
 
         if binary:
             # Explicity set the endianess of the transfer
@@ -266,20 +299,26 @@ class KeysightM8190A(SCPIInstrument):
             self.interface.write(command_string + ascii_string)
 
     def delete_waveform(self, segment_id, channel=1):
+        self.segment_cache(channel).discard(segment_id)
         self.interface.write(":TRAC{:d}:DEL {:d}".format(channel, segment_id))
 
     def delete_all_waveforms(self, channel=1):
+        self.segment_cache(channel).clear()
         self.interface.write(":TRAC{:d}:DEL:ALL".format(channel) )
 
     def select_waveform(self, segment_id, channel=1):
         self.interface.write(":TRAC{:d}:SEL {:d}".format(channel, segment_id))
 
     def use_waveform(self, wf_data, segment_id=None, channel=1):
+        """Play `wf_data`, in `segment_id` if given, otherwise in whichever segment already
+        holds it (see cached_waveform)."""
         self.abort()
         if segment_id:
             self.delete_waveform(segment_id, channel=channel)
-        segment_id = self.define_waveform(len(wf_data), segment_id=segment_id, channel=channel)
-        self.upload_waveform(wf_data, segment_id, channel=channel)
+            segment_id = self.define_waveform(len(wf_data), segment_id=segment_id, channel=channel)
+            self.upload_waveform(wf_data, segment_id, channel=channel)
+        else:
+            segment_id = self.cached_waveform(wf_data, channel=channel)
         self.select_waveform(segment_id, channel=channel)
         self.initiate(channel=channel)
 
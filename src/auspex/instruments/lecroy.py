@@ -2,7 +2,9 @@ __all__ = ['HDO6104']
 
 from auspex.log import logger
 from .instrument import SCPIInstrument, StringCommand, FloatCommand, IntCommand, Command
+from .scope import Waveform, copy_samples, sample_buffer
 import numpy as np
+import struct
 import time
 
 class HDO6104(SCPIInstrument):
@@ -13,6 +15,9 @@ class HDO6104(SCPIInstrument):
     def connect(self, resource_name=None, interface_type=None):
         super(HDO6104,self).connect(resource_name=resource_name,interface_type=interface_type)
         self.interface.write("COMM_HEADER OFF")
+        # Waveforms as 16 bit samples, most significant byte first
+        self.interface.write("COMM_ORDER HI")
+        self.interface.write("COMM_FORMAT DEF9,WORD,BIN")
         self.interface._resource.read_termination = u"\n"
 
     def get_info(self,channel=1):
@@ -21,17 +26,30 @@ class HDO6104(SCPIInstrument):
         return {k[0].strip(): k[1].strip() for k in info}
 
     def fetch_waveform(self,channel):
-        # Send the MSB first
-        self.interface.write("COMM_ORDER HI")
-        self.interface.write("COMM_FORMAT DEF9,WORD,BIN")
-        mydict = self.get_info(channel=channel)
-        points = int(mydict["PNTS_PER_SCREEN"])
-        xincrement = float(mydict["HORIZ_INTERVAL"])
-        xorigin = float(mydict["HORIZ_OFFSET"])
-        yincrement = float(mydict["VERTICAL_GAIN"])
-        yorigin = float(mydict["VERTICAL_OFFSET"])
-        # Read waveform data
-        y_axis = np.array(self.interface.query_binary_values('C%d:WAVEFORM? DAT1' % channel, datatype='h', is_big_endian=True))
-        y_axis = y_axis*yincrement - yorigin
-        x_axis = xorigin + np.arange(0, xincrement*len(y_axis), xincrement)
-        return x_axis, y_axis
+        """The trace of `channel`, which unpacks as (time, volts)."""
+        return self.fetch_waveforms([channel])[0]
+
+    def fetch_waveforms(self, channels, out=None):
+        """Fetch the traces of `channels`, one query each that returns the binary wave descriptor
+        (scaling and timing) along with the samples, as a list of Waveforms. The samples are
+        read into new arrays, or into those of `out`: one per channel, or a WaveformBuffers."""
+        waveforms = []
+        for i, channel in enumerate(channels):
+            block = self.interface.query_binary_values("C{:d}:WF? ALL".format(channel), datatype='B',
+                                                       container=np.array).tobytes()
+            desc  = block[block.find(b"WAVEDESC"):]
+            # COMM_ORDER (0 for HI) applies to the descriptor as well as the samples
+            order = ">" if desc[34:36] == b"\x00\x00" else "<"
+            lengths = struct.unpack_from(order + "7l", desc, 36)
+            count   = struct.unpack_from(order + "l", desc, 116)[0]
+            gain, offset = struct.unpack_from(order + "2f", desc, 156)
+            interval     = struct.unpack_from(order + "f", desc, 176)[0]
+            origin       = struct.unpack_from(order + "d", desc, 180)[0]
+            # The samples come after the descriptor, user text, and time arrays
+            start = sum(lengths[:6])
+            dtype = np.dtype(order + "i2")
+            data  = desc[start:start + count*dtype.itemsize]
+            buf   = sample_buffer(out, i, channel, count, dtype)
+            waveforms.append(Waveform(copy_samples(data, dtype, buf), y_scale=gain, y_zero=-offset,
+                                      x_increment=interval, x_origin=origin))
+        return waveforms
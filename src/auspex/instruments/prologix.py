@@ -6,21 +6,155 @@
 #
 #    http://www.apache.org/licenses/LICENSE-2.0
 
-__all__ = ['PrologixSocketResource']
+__all__ = ['PrologixSocketResource', 'PrologixController']
 
 import os
 import numpy as np
 import socket
+import select
+import threading
 import functools
+from contextlib import contextmanager
 from auspex.log import logger
-from pyvisa.util import _converters, from_ascii_block, to_ascii_block, to_ieee_block, from_binary_block
+from pyvisa.util import _converters, from_ascii_block, to_ascii_block, to_ieee_block, from_ieee_block
 
 class PrologixError(Exception):
     """Error interacting with the Prologix GPIB-ETHERNET controller."""
 
+class PrologixController(object):
+    """The one TCP connection to a Prologix GPIB-ETHERNET controller, shared by all of the GPIB
+    instruments behind it. Hold `lock` around each exchange with an instrument; `select` only
+    sends ++addr when the exchange is with a different instrument than the last one. Each
+    instrument sets its own timeout for its exchanges, see PrologixSocketResource.transaction.
+
+    Use PrologixController.open(ipaddr) to get the connection for an address, and `release`
+    when done with it. The socket is closed once every instrument has released it."""
+
+    PORT = 1234 # Prologix communicates on port 1234
+
+    _controllers = {}
+    _controllers_lock = threading.Lock()
+
+    def __init__(self, ipaddr, port=None, timeout=5):
+        super(PrologixController, self).__init__()
+        self.ipaddr  = ipaddr
+        self.port    = self.PORT if port is None else port
+        self.lock    = threading.RLock()
+        self.address = None
+        self.timeout = timeout
+        self.users   = 0
+        self.buffer  = b""
+        try:
+            self.sock = socket.create_connection((self.ipaddr, self.port), timeout)
+        except socket.error as err:
+            logger.error("Cannot open socket to Prologix at {0}: {1}".format(self.ipaddr, err))
+            raise PrologixError(self.ipaddr) from err
+        self.send(b"++ver\r\n")
+        whoami = self.read_until(b"\n").decode()
+        if "Prologix" not in whoami:
+            self.sock.close()
+            logger.error("The device at {0} does not appear to be a Prologix; got {1}.".format(self.ipaddr, whoami))
+            raise PrologixError(whoami)
+        self.send(b"++mode 1\r\n") #set to controller mode
+        self.send(b"++auto 1\r\n") #enable read-after-write
+
+    @classmethod
+    def open(cls, ipaddr, port=None, timeout=5):
+        """Return the shared connection to the controller at `ipaddr`, opening it if need be."""
+        with cls._controllers_lock:
+            key = (ipaddr, cls.PORT if port is None else port)
+            if key not in cls._controllers:
+                cls._controllers[key] = cls(ipaddr, port, timeout)
+            controller = cls._controllers[key]
+            controller.users += 1
+            return controller
+
+    def release(self):
+        with self._controllers_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            del self._controllers[(self.ipaddr, self.port)]
+        with self.lock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.sock.close()
+
+    def settimeout(self, timeout):
+        if timeout != self.timeout:
+            self.sock.settimeout(timeout)
+            self.timeout = timeout
+
+    def select(self, gpib):
+        """Point the controller at GPIB address `gpib`, unless it already is."""
+        if self.address != gpib:
+            self.discard()
+            self.send(('++addr %d\n' % gpib).encode())
+            self.address = gpib
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def discard(self):
+        """Drop anything another instrument left unread (e.g. after a timeout), so that it isn't
+        mistaken for the response of the next one."""
+        self.buffer = b""
+        while select.select([self.sock], [], [], 0)[0]:
+            if not self.sock.recv(4096):
+                break
+
+    def fill(self, bufsize):
+        data = self.sock.recv(bufsize)
+        if not data:
+            raise PrologixError("Connection to Prologix at {} closed.".format(self.ipaddr))
+        self.buffer += data
+
+    def read_until(self, terminator, bufsize=4096):
+        """Read up to and including `terminator`. If the instrument goes quiet first, whatever
+        did arrive is returned."""
+        while terminator not in self.buffer:
+            try:
+                self.fill(bufsize)
+            except socket.timeout:
+                if not self.buffer:
+                    raise
+                logger.debug("Prologix at {} timed out waiting for {}.".format(self.ipaddr, terminator))
+                break
+        end = self.buffer.find(terminator)
+        end = len(self.buffer) if end < 0 else end + len(terminator)
+        data, self.buffer = self.buffer[:end], self.buffer[end:]
+        return data
+
+    def read_bytes(self, length, bufsize=4096):
+        """Read exactly `length` bytes."""
+        while len(self.buffer) < length:
+            self.fill(max(bufsize, length - len(self.buffer)))
+        data, self.buffer = self.buffer[:length], self.buffer[length:]
+        return data
+
+    def read_block(self, bufsize=4096):
+        """Read an IEEE 488.2 definite length block (#<n><length><data>), header included."""
+        header = self.read_bytes(2, bufsize)
+        if header[:1] != b"#" or not header[1:].isdigit() or header[1:] == b"0":
+            # Not a definite length block, so fall back to reading up to the terminator
+            return header + self.read_until(b"\n", bufsize)
+        digits = self.read_bytes(int(header[1:]), bufsize)
+        return header + digits + self.read_bytes(int(digits), bufsize)
+
+    def skip(self, chars, wait=0.1):
+        """Consume any of `chars` (e.g. the terminator after a binary block) that follow."""
+        while True:
+            self.buffer = self.buffer.lstrip(chars)
+            if self.buffer or not select.select([self.sock], [], [], wait)[0]:
+                return
+            self.fill(4096)
+
 class PrologixSocketResource(object):
     """A resource representing a GPIB instrument controlled through a PrologixError
     GPIB-ETHERNET controller. Mimics the functionality of a pyVISA resource object.
+    Resources for instruments behind the same controller share one PrologixController.
 
     See http://prologix.biz/gpib-ethernet-controller.html for more details
     and a utility that will discover all prologix instruments on the network.
@@ -38,7 +172,7 @@ class PrologixSocketResource(object):
             self.ipaddr = ipaddr
         if gpib is not None:
             self.gpib = gpib
-        self.sock = None
+        self.controller = None
         self._timeout = 5
         self.read_termination = "\r\n"
         self.write_termination = "\r\n"
@@ -51,17 +185,32 @@ class PrologixSocketResource(object):
 
     @timeout.setter
     def timeout(self, value):
-        self._timeout = timeout
-        if self.sock is not None:
-            self.sock.settimeout(self._timeout)
+        # Applied to the shared socket only for this instrument's own exchanges
+        self._timeout = value
+
+    @contextmanager
+    def transaction(self):
+        """Hold the controller for an exchange with this instrument, at its GPIB address and
+        with its timeout."""
+        with self.controller.lock:
+            self.controller.select(self.gpib)
+            self.controller.settimeout(self._timeout)
+            yield self.controller
 
-    def connect(self, ipaddr=None, gpib=None):
+    @property
+    def terminator(self):
+        """The end of a response: the last character of the read termination, since instruments
+        don't all send the whole of it."""
+        return self.read_termination[-1:].encode()
+
+    def connect(self, ipaddr=None, gpib=None, port=None):
         """Connect to a GPIB device through a Prologix GPIB-ETHERNET controller.
         box.
 
         Args:
             ipaddr: The IP address of the Prologix GPIB-ETHERNET.
             gpib: The GPIB address of the instrument to be controlled.
+            port: The controller's TCP port, if not the standard one.
         Returns:
             None.
         """
@@ -69,43 +218,28 @@ class PrologixSocketResource(object):
             self.ipaddr = ipaddr
         if gpib is not None:
             self.gpib = gpib
+        self.controller = PrologixController.open(self.ipaddr, port, self._timeout)
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM,
-                socket.IPPROTO_TCP)
-            self.sock.settimeout(self._timeout)
-            self.sock.connect((self.ipaddr, 1234)) #Prologix communicates on port 1234
-        except socket.error as err:
-            logger.error("Cannot open socket to Prologix at {0}: {1}".format(self.ipaddr,
-                err.msg))
-            raise PrologixError(self.ipaddr) from err
-        self.sock.send(b"++ver\r\n")
-        whoami = self.sock.recv(128).decode()
-        if "Prologix" not in whoami:
-            logger.error("The device at {0} does not appear to be a Prologix; got {1}.".format(self.ipaddr, whoami))
-            raise PrologixError(whoami)
-        self.sock.send(b"++mode 1\r\n") #set to controller mode
-        self.sock.send(b"++auto 1\r\n") #enable read-after-write
-        self._addr()
-        self.sock.send(b"++clr\r\n")
-        idn = self.query(self.idn_string)
-        if idn is '':
-            logger.error(("Did not receive response to GPIB command {0} " +
-                "from GPIB device {1} on Prologix at {2}.").format(self.idn_string,
-                self.gpib, self.ipaddr))
-            raise PrologixError(idn)
-        else:
-            logger.debug(("Succesfully connected to device {0} at GPIB port {1} on" +
-                " Prologix controller at {2}.").format(idn, self.gpib, self.ipaddr))
+            with self.transaction() as controller:
+                controller.send(b"++clr\r\n")
+            idn = self.query(self.idn_string)
+            if idn == '':
+                logger.error(("Did not receive response to GPIB command {0} " +
+                    "from GPIB device {1} on Prologix at {2}.").format(self.idn_string,
+                    self.gpib, self.ipaddr))
+                raise PrologixError(idn)
+        except:
+            # Give back our share of the connection, which would otherwise stay open for good
+            self.close()
+            raise
+        logger.debug(("Succesfully connected to device {0} at GPIB port {1} on" +
+            " Prologix controller at {2}.").format(idn, self.gpib, self.ipaddr))
 
     def close(self):
-        """Close the connection to the Prologix."""
-        if self.sock is not None:
-            self.sock.shutdown(socket.SHUT_RDWR)
-            self.sock.close()
-
-    def _addr(self):
-        """Set PROLOGIX to address of instrument we want to control."""
-        self.sock.send(('++addr %d\n' % self.gpib).encode())
+        """Release this instrument's share of the connection to the Prologix."""
+        if self.controller is not None:
+            self.controller.release()
+            self.controller = None
 
     def read(self):
         """Read an ASCII value from the instrument.
@@ -115,8 +249,8 @@ class PrologixSocketResource(object):
         Returns:
             The instrument data with termination character stripped.
         """
-        self._addr()
-        ans = self.sock.recv(self.bufsize).decode()
+        with self.transaction():
+            ans = self.controller.read_until(self.terminator, self.bufsize).decode()
         return ans.rstrip(self.read_termination)
 
     def query(self, command):
@@ -127,9 +261,9 @@ class PrologixSocketResource(object):
         Returns:
             The instrument data with termination character stripped.
         """
-        self._addr()
-        self.sock.send((command + self.write_termination).encode())
-        ans = self.sock.recv(self.bufsize).decode()
+        with self.transaction():
+            self.controller.send((command + self.write_termination).encode())
+            ans = self.controller.read_until(self.terminator, self.bufsize).decode()
         return ans.rstrip(self.read_termination)
 
     def write(self, command):
@@ -140,8 +274,8 @@ class PrologixSocketResource(object):
         Returns:
             The number of bytes in the message.
         """
-        self._addr()
-        self.sock.send((command + self.write_termination).encode())
+        with self.transaction():
+            self.controller.send((command + self.write_termination).encode())
         return len(command)
 
     def read_raw(self, bufsize=None):
@@ -155,8 +289,19 @@ class PrologixSocketResource(object):
         """
         if bufsize is None:
             bufsize = self.bufsize
-        self._addr()
-        return self.socket.recv(bufsize)
+        with self.transaction():
+            return self.controller.read_until(self.terminator, bufsize)
+
+    def read_bytes(self, count):
+        """Read exactly `count` bytes from the instrument.
+
+        Args:
+            count: Number of bytes to read.
+        Returns:
+            Instrument data. Nothing is stripped from response.
+        """
+        with self.transaction():
+            return self.controller.read_bytes(count, self.bufsize)
 
     def write_raw(self, command):
         """Write a string message to device as raw bytes. No termination
@@ -167,8 +312,8 @@ class PrologixSocketResource(object):
         Returns:
             The number of bytes in the message.
         """
-        self._addr()
-        self.sock.send(command)
+        with self.transaction():
+            self.controller.send(command)
         return len(command)
 
     def write_ascii_values(self, command, values, converter='f', separator=','):
@@ -201,10 +346,8 @@ class PrologixSocketResource(object):
         Returns:
             Iterable of values converted from instrument response.
         """
-        if bufsize is None:
-            bufsize = self.bufsize
-        ascii = self.query(command, bufsize=bufsize)
-        return from_ascii_block(ascii, convereter, separator, container)
+        ascii = self.query(command)
+        return from_ascii_block(ascii, converter, separator, container)
 
     def write_binary_values(self, command, values, datatype='f',
         is_big_endian=False):
@@ -239,7 +382,9 @@ class PrologixSocketResource(object):
         """
         if bufsize is None:
             bufsize = self.bufsize
-        self.write(command, bufsize=bufsize)
-        block = self.read_raw()
-        return from_binary_block(block, datatype=datatype,
+        with self.transaction():
+            self.controller.send((command + self.write_termination).encode())
+            block = self.controller.read_block(bufsize)
+            self.controller.skip(self.read_termination.encode())
+        return from_ieee_block(block, datatype=datatype,
             is_big_endian=is_big_endian, container=container)
@@ -0,0 +1,114 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+__all__ = ['Waveform', 'WaveformBuffers']
+
+import numpy as np
+
+def read_response_units(read_bytes, count):
+    """Read the responses to a compound query, `count` response message units separated by
+    semicolons, using `read_bytes(n)`. IEEE 488.2 definite length blocks (#<n><length><data>)
+    are returned as their data bytes, anything else as a stripped string."""
+    units = []
+    for i in range(count):
+        first = read_bytes(1)
+        while first in (b"\r", b"\n", b" "):
+            first = read_bytes(1)
+        if first == b"#":
+            digits = int(read_bytes(1))
+            units.append(read_bytes(int(read_bytes(digits))))
+            read_bytes(1) # The separator or terminator that follows
+        else:
+            chars = first
+            while chars[-1:] not in (b";", b"\n"):
+                chars += read_bytes(1)
+            units.append(chars[:-1].strip().decode())
+    return units
+
+def copy_samples(data, dtype, out=None):
+    """Interpret the bytes `data` as samples of `dtype` and copy them into `out`, which is
+    allocated if not given. Returns the part of `out` that holds the samples."""
+    samples = np.frombuffer(data, dtype=dtype)
+    if out is None:
+        return samples.copy()
+    out = out[:len(samples)]
+    out[...] = samples
+    return out
+
+def sample_buffer(out, index, key, length, dtype):
+    """The array to read the samples of the `index`th trace into, given the `out` argument of a
+    fetch: None for a new one, a WaveformBuffers to reuse its buffer for `key`, or else a
+    sequence of arrays, one per trace."""
+    if out is None:
+        return None
+    if isinstance(out, WaveformBuffers):
+        return out.get(key, length, dtype)
+    return out[index]
+
+class Waveform(object):
+    """A trace as the raw samples the scope sent, scaled to volts (y_zero + (raw - y_offset)*y_scale)
+    only when `volts` is first asked for. Unpacks like the (time, volts) tuples it replaces.
+
+    Unless the samples were fetched into buffers of the caller's (see WaveformBuffers), they are
+    the waveform's own. Otherwise read what's needed before fetching into the buffers again."""
+
+    def __init__(self, raw, y_scale=1.0, y_offset=0.0, y_zero=0.0, x_increment=1.0, x_origin=0.0):
+        super(Waveform, self).__init__()
+        self.raw         = raw
+        self.y_scale     = y_scale
+        self.y_offset    = y_offset
+        self.y_zero      = y_zero
+        self.x_increment = x_increment
+        self.x_origin    = x_origin
+        self._volts      = None
+
+    def scaled(self, out=None):
+        """Scale the raw samples to volts, into `out` if given."""
+        if out is None:
+            out = np.empty(len(self.raw), dtype=np.float64)
+        np.subtract(self.raw, self.y_offset, out=out)
+        out *= self.y_scale
+        out += self.y_zero
+        return out
+
+    @property
+    def volts(self):
+        if self._volts is None:
+            self._volts = self.scaled()
+        return self._volts
+
+    @property
+    def time(self):
+        return self.x_origin + self.x_increment*np.arange(len(self.raw))
+
+    def __getitem__(self, index):
+        return (self.time, self.volts)[index]
+
+    def __iter__(self):
+        yield self.time
+        yield self.volts
+
+    def __repr__(self):
+        return "<Waveform({} samples of {})>".format(len(self.raw), self.raw.dtype)
+
+class WaveformBuffers(object):
+    """Sample arrays kept from one fetch to the next, one per channel, so that fetching the same
+    traces over and over doesn't allocate each time. Pass one as the `out` of a fetch to use it."""
+
+    def __init__(self):
+        super(WaveformBuffers, self).__init__()
+        self.buffers = {}
+
+    def get(self, key, length, dtype):
+        buf = self.buffers.get(key)
+        if buf is None or buf.dtype != dtype or len(buf) < length:
+            buf = self.buffers[key] = np.empty(length, dtype=dtype)
+        return buf[:length]
+
+    def clear(self):
+        self.buffers.clear()
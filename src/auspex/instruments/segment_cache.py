@@ -0,0 +1,73 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+__all__ = ['SegmentCache']
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+class SegmentCache(object):
+    """Keeps track of the waveforms an AWG holds, by a hash of their samples, so that a waveform
+    the AWG already has is used through its segment (or name) instead of being uploaded again.
+    When the waveforms would overflow `capacity` samples, or `max_segments` segments, the least
+    recently used ones are given up.
+
+    Only waveforms that go through the cache are counted, so `capacity` is the part of the
+    memory set aside for them."""
+
+    def __init__(self, capacity, max_segments=None):
+        super(SegmentCache, self).__init__()
+        self.capacity     = capacity
+        self.max_segments = max_segments
+        self.segments     = OrderedDict() # key: (segment, length), least recently used first
+        self.used         = 0
+
+    @staticmethod
+    def key(data):
+        data = np.ascontiguousarray(data)
+        return (data.dtype.str, data.shape, hashlib.blake2b(data, digest_size=16).hexdigest())
+
+    def lookup(self, key):
+        """The segment holding the waveform with this key, or None."""
+        if key in self.segments:
+            self.segments.move_to_end(key)
+            return self.segments[key][0]
+
+    def make_room(self, length):
+        """Forget least recently used waveforms until one of `length` samples fits, returning
+        their segments, which are to be deleted from the AWG."""
+        if length > self.capacity:
+            raise ValueError("A waveform of {} samples does not fit in {} samples of memory.".format(length, self.capacity))
+        evicted = []
+        while self.segments and (self.used + length > self.capacity or
+                                 (self.max_segments and len(self.segments) >= self.max_segments)):
+            segment, seg_length = self.segments.popitem(last=False)[1]
+            self.used -= seg_length
+            evicted.append(segment)
+        return evicted
+
+    def add(self, key, segment, length):
+        self.discard(segment)
+        self.segments[key] = (segment, length)
+        self.used += length
+
+    def discard(self, segment):
+        """Forget the waveform in `segment`, e.g. because it was deleted or overwritten."""
+        for key, (seg, length) in list(self.segments.items()):
+            if seg == segment:
+                del self.segments[key]
+                self.used -= length
+
+    def clear(self):
+        self.segments.clear()
+        self.used = 0
+
+    def __len__(self):
+        return len(self.segments)
@@ -0,0 +1,127 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+__all__ = ['SimulatedScope']
+
+import time
+import numpy as np
+
+from auspex.log import logger
+from .interface import Interface
+from .tektronix import TekDPO72004C
+
+class SimulatedScopeInterface(Interface):
+    """Answers the waveform transfer commands of a Tektronix DPO70000 series scope with simulated
+    traces, taking `latency` seconds to respond to each message, so that waveform transfers can
+    be tried out and benchmarked without a scope."""
+
+    ENCODINGS = {"RIB": ">i", "SRI": "<i", "RPB": ">u", "SRP": "<u"}
+
+    def __init__(self, record_length=10000, latency=0.0):
+        super(SimulatedScopeInterface, self).__init__()
+        self.record_length = record_length
+        self.latency       = latency
+        self.output        = b""
+        self.traces        = {}
+        self.state = {"DAT:SOU": "CH1", "DAT:ENC": "RIB", "WFM:BYT": "1", "DAT:STA": "1",
+                      "DAT:STO": str(record_length), "ACQ:MOD": "SAMPLE", "ACQ:NUM": "1"}
+
+    @staticmethod
+    def header(header):
+        # Short and long forms of a command share their first three letters
+        return ":".join(node[:3] for node in header.upper().lstrip(":").split(":"))
+
+    def trace(self):
+        """The current source's record, in the current encoding (generated once per format)."""
+        dtype = np.dtype(self.ENCODINGS[self.state["DAT:ENC"]] + self.state["WFM:BYT"])
+        key = (self.state["DAT:SOU"], dtype.str)
+        if key not in self.traces:
+            channel = int(self.state["DAT:SOU"][-1])
+            phase   = np.linspace(0, 2*np.pi*channel, self.record_length)
+            counts  = 100*np.sin(phase) + np.random.normal(scale=5, size=self.record_length)
+            counts *= 256**(dtype.itemsize-1)
+            if dtype.kind == "u":
+                counts += 2**(8*dtype.itemsize-1)
+            self.traces[key] = counts.astype(dtype)
+        start = int(self.state["DAT:STA"]) - 1
+        stop  = min(int(self.state["DAT:STO"]), self.record_length)
+        return self.traces[key][start:stop]
+
+    def answer(self, header):
+        bytes_per_sample = int(self.state["WFM:BYT"])
+        if header == "CUR":
+            data   = self.trace().tobytes()
+            length = str(len(data)).encode()
+            return b"#" + str(len(length)).encode() + length + data
+        elif header == "WFM:YMU":
+            return "{:e}".format(0.01/256**(bytes_per_sample-1)).encode()
+        elif header == "WFM:YOF":
+            return b"0" if self.state["DAT:ENC"] in ("RIB", "SRI") else str(2**(8*bytes_per_sample-1)).encode()
+        elif header in ("WFM:YZE", "WFM:XZE"):
+            return b"0.0E+0"
+        elif header == "WFM:XIN":
+            return b"1.0E-10"
+        elif header == "HOR:ACQ":
+            return str(self.record_length).encode()
+        elif header == "*ID":
+            return b"TEKTRONIX,SIMULATED,0,0"
+        elif header in self.state:
+            return self.state[header].encode()
+        logger.debug("Simulated scope has no answer to '%s'", header)
+        return b"0"
+
+    def respond(self, message):
+        time.sleep(self.latency)
+        responses = []
+        for unit in message.split(";"):
+            header, _, argument = unit.strip().partition(" ")
+            if not header:
+                continue
+            if header.endswith("?"):
+                responses.append(self.answer(self.header(header[:-1])))
+            else:
+                self.state[self.header(header)] = argument.strip()
+        if responses:
+            self.output += b";".join(responses) + b"\n"
+
+    def write(self, value):
+        super(SimulatedScopeInterface, self).write(value)
+        self.respond(value)
+
+    def read_bytes(self, count):
+        data, self.output = self.output[:count], self.output[count:]
+        return data
+
+    def read(self):
+        end = self.output.find(b"\n") + 1
+        data, self.output = self.output[:end], self.output[end:]
+        return data.decode().strip()
+
+    def query(self, value):
+        self.write(value)
+        return self.read()
+
+    def value(self, query_string):
+        return float(self.query(query_string))
+
+    def query_ascii_values(self, query_string, converter='f', **kwargs):
+        return [float(v) if converter in ('f', 'e') else v for v in self.query(query_string).split(",")]
+
+class SimulatedScope(TekDPO72004C):
+    """A TekDPO72004C driving a SimulatedScopeInterface instead of a scope."""
+
+    def __init__(self, resource_name="Simulated", record_length=10000, latency=0.0, *args, **kwargs):
+        super(SimulatedScope, self).__init__(resource_name, *args, **kwargs)
+        self.name = "Simulated Scope"
+        self._unfreeze()
+        self.simulation = {"record_length": record_length, "latency": latency}
+        self._freeze()
+
+    def connect(self, resource_name=None, interface_type=None):
+        self.interface    = SimulatedScopeInterface(**self.simulation)
+        self.sample_bytes = None
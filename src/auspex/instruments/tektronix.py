@@ -10,6 +10,9 @@ __all__ = ['TekDPO72004C','TekAWG5014']
 
 from auspex.log import logger
 from .instrument import SCPIInstrument, StringCommand, FloatCommand, IntCommand, is_valid_ipv4
+from .interface import BatchedInterface
+from .scope import Waveform, read_response_units, copy_samples, sample_buffer
+from .segment_cache import SegmentCache
 import numpy as np
 
 class TekDPO72004C(SCPIInstrument):
@@ -38,6 +41,10 @@ class TekDPO72004C(SCPIInstrument):
 
     # Acquistion options and control
     num_averages = IntCommand(get_string="ACQUIRE:NUMAVG?;",set_string="ACQUIRE:NUMAVE {:d};")
+    acquire_mode = StringCommand(get_string="ACQUIRE:MODE?;", set_string="ACQUIRE:MODE {:s};",
+                        allowed_values=["SAM","PEAK","HIR","AVE","ENV"])
+
+    ALL_POINTS = 1000000000 # DAT:STOP beyond the record length transfers the whole record
 
     def __init__(self, resource_name=None, *args, **kwargs):
         # resource_name += "::4000::SOCKET" #user guide recommends HiSLIP protocol
@@ -46,6 +53,9 @@ class TekDPO72004C(SCPIInstrument):
         # self.interface._resource.read_termination = u"\n"
         super(TekDPO72004C, self).__init__(resource_name, *args, **kwargs)
         self.name = "Tektronix DPO72004C Oscilloscope"
+        self._unfreeze()
+        self.sample_bytes = None # Negotiated on the first fetch, see negotiate_format
+        self._freeze()
 
     def connect(self, resource_name=None, interface_type=None):
         if resource_name is not None:
@@ -55,6 +65,7 @@ class TekDPO72004C(SCPIInstrument):
             self.resource_name += "::4000::SOCKET" #user guide recommends HiSLIP protocol
         super(TekDPO72004C, self).connect(resource_name=self.resource_name, interface_type=interface_type)
         self.interface._resource.read_termination = u"\n" 
+        self.sample_bytes = None
 
     @property
     def clear(self):
@@ -104,32 +115,67 @@ class TekDPO72004C(SCPIInstrument):
     # Get Waveform trace
     @property
     def get_trace(self):
-        self.encoding = "SRI" # Signed ints
-
-        record_length = self.record_length
-        self.data_start = 1
-        self.data_stop  = record_length
-
-        strf_from_depth = {1: 'b', 2: 'h', 4: 'l', 8: 'q'}
-
-        vals = self.interface.query_binary_values("CURVe?;", datatype=strf_from_depth[self.byte_depth])
-        scale = self.interface.value('WFMO:YMU?;')
-        offset = self.interface.value('WFMO:YOF?;')
-        vals = (vals - offset)*scale
-        vals = vals.reshape((vals.size,))
-        time = np.linspace(0, self.record_duration, self.record_length)
-        # if self.fast_frame:
-        #     vals.resize((self.num_fast_frames, record_length))
-        return (time,vals)
-
-    def get_fastaq_curve(self, channel=1):
-        self.source_channel = channel
-        self.encoding = "SRP" # Unsigned ints
-        self.byte_depth  = 8
-        self.data_start = 1
-        self.data_stop  = self.record_length
-        curve = self.interface.query_binary_values("CURVe?;", datatype='Q').reshape((1000,252))
-        return curve
+        """The trace of the current data source, which unpacks as (time, volts)."""
+        return self.fetch_waveforms()[0]
+
+    @staticmethod
+    def bytes_per_sample(mode):
+        """The fewest bytes per sample that hold what the acquisition mode produces: one for plain
+        sampling or peak detection, two when averaging or in high resolution mode."""
+        mode = mode.strip().upper()
+        return 1 if mode.startswith("SAM") or mode.startswith("PEAK") else 2
+
+    def negotiate_format(self):
+        """Pick the sample width for the current acquisition mode. Runs on the first fetch after
+        connecting. Each fetch reads back the mode as well, and fetches again at the right width
+        if the mode has changed since, through this driver or otherwise."""
+        self.sample_bytes = self.bytes_per_sample(self.acquire_mode)
+        return self.sample_bytes
+
+    def fetch_waveforms(self, channels=None, out=None):
+        """Fetch the traces of `channels` (by default just the current data source) with a single
+        compound query that also carries the scaling, as a list of Waveforms. The samples come
+        as signed integers of the negotiated width and are read into new arrays, or into those
+        of `out`: one per channel, or a WaveformBuffers."""
+        if self.sample_bytes is None:
+            self.negotiate_format()
+        dtype   = np.dtype("<i{:d}".format(self.sample_bytes)) # SRI: signed, least significant byte first
+        sources = [None] if channels is None else list(channels)
+
+        # Settings the scope already holds are left out of the message
+        message = ["ACQ:MOD?", self.setting("encoding", "SRI"), self.setting("byte_depth", self.sample_bytes),
+                   self.setting("data_start", 1), self.setting("data_stop", self.ALL_POINTS),
+                   "WFMO:XIN?", "WFMO:XZE?"]
+        for source in sources:
+            if source is not None:
+                message.append(self.setting("channel", source))
+            message += ["WFMO:YMU?", "WFMO:YOF?", "WFMO:YZE?", "CURV?"]
+        self.interface.write(BatchedInterface.join([m for m in message if m is not None]))
+        units = read_response_units(self.interface.read_bytes, 3 + 4*len(sources))
+
+        if self.bytes_per_sample(units[0]) != self.sample_bytes:
+            # The acquisition mode changed since the format was negotiated
+            self.sample_bytes = self.bytes_per_sample(units[0])
+            return self.fetch_waveforms(channels, out)
+
+        waveforms = []
+        for i, source in enumerate(sources):
+            y_scale, y_offset, y_zero, data = units[3+4*i:7+4*i]
+            buf = sample_buffer(out, i, source, len(data)//dtype.itemsize, dtype)
+            waveforms.append(Waveform(copy_samples(data, dtype, buf), float(y_scale), float(y_offset),
+                                      float(y_zero), float(units[1]), float(units[2])))
+        return waveforms
+
+    def get_fastaq_curve(self, channel=1, out=None):
+        """The FastAcq waveform database of `channel`, as 1000 x 252 hit counts read in one
+        message into a new array, or into the contiguous array `out`."""
+        dtype   = np.dtype("<u8") # SRP: unsigned, least significant byte first
+        message = [self.setting("channel", channel), self.setting("encoding", "SRP"),
+                   self.setting("byte_depth", 8), self.setting("data_start", 1),
+                   self.setting("data_stop", self.ALL_POINTS), "CURV?"]
+        self.interface.write(BatchedInterface.join([m for m in message if m is not None]))
+        data = read_response_units(self.interface.read_bytes, 1)[0]
+        return copy_samples(data, dtype, None if out is None else out.reshape(-1)).reshape((1000,252))
 
     # Select Measurement
     @property
@@ -209,15 +255,24 @@ class TekDPO72004C(SCPIInstrument):
 class TekAWG5014(SCPIInstrument):
     """Tektronix AWG 5014"""
 
+    batch_length = 1024 # Takes compound messages, see SCPIInstrument.batch
+
     CHANNEL = 1 # Default Channel 
     MARKER = 1 # Default Marker
     ONOFF_VALUES    = ['ON', 'OFF']
 
+    # Waveform list memory (without memory options) and how many waveforms it can hold
+    waveform_memory = 16200000
+    max_waveforms   = 32000
+
     runmode = StringCommand(scpi_string="AWGCONTROL:RMODE",allowed_values=['CONT','TRIG','GAT','SEQ','ENH'])
 
     def __init__(self, resource_name=None, *args, **kwargs):
         super(TekAWG5014, self).__init__(resource_name, *args, **kwargs)
         self.name = "Tektronix AWG 5014"
+        self._unfreeze()
+        self.segment_cache = SegmentCache(self.waveform_memory, self.max_waveforms)
+        self._freeze()
 
     def connect(self, resource_name=None, interface_type=None):
         if resource_name is not None:
@@ -228,6 +283,7 @@ class TekAWG5014(SCPIInstrument):
         super(TekAWG5014, self).connect(resource_name=self.resource_name, interface_type=interface_type)
         self.interface._resource.read_termination = u"\r" 
         self.interface._resource.write_termination = u"\n"
+        self.segment_cache.clear()
 
     # Run Selected Waveforms
     @property
@@ -240,16 +296,36 @@ class TekAWG5014(SCPIInstrument):
         self.interface.write("AWGCONTROL:STOP")
 
     # Load Waveform
-    def loadwaveform(self,name,points):
-
+    def loadwaveform(self,name,points,replace=True):
+        """Load `points` (INT format) into the waveform list as `name`, first deleting any
+        waveform of that name unless the caller knows there is none (replace=False)."""
         if name is not None: 
-            self.interface.write("WLIST:WAVEFORM:DELETE {:s}".format(name))
+            self.segment_cache.discard(name)
+            if replace:
+                self.interface.write("WLIST:WAVEFORM:DELETE {:s}".format(name))
             self.interface.write("WLIST:WAVEFORM:NEW {:s}, {:d}, INT".format(name,len(points)))
-            self.interface.write_binary_values("WLIST:WAVEFORM:DATA {:s},".format(name),points,dataype='d',is_big_endian=False)
+            self.interface.write_binary_values("WLIST:WAVEFORM:DATA {:s},".format(name),points,datatype='H',is_big_endian=False)
 
         else: 
             raise ValueError("No Name given for Waveform.")
 
+    def cached_waveform(self, points):
+        """Return the name of a waveform in the waveform list holding `points` (INT format),
+        only loading one if the AWG doesn't have it already. Least recently used cached
+        waveforms are deleted to make room."""
+        # A reset clears the waveform list, so stop trusting the cache then
+        self.interface.add_reset_callback(self.segment_cache.clear)
+        key  = self.segment_cache.key(points)
+        name = self.segment_cache.lookup(key)
+        if name is None:
+            for old_name in self.segment_cache.make_room(len(points)):
+                self.interface.write("WLIST:WAVEFORM:DELETE {:s}".format(old_name))
+            name = '"auspex_{:s}"'.format(key[2][:16])
+            # Not in the cache, so not in the list: deleting it would only queue an error
+            self.loadwaveform(name, points, replace=False)
+            self.segment_cache.add(key, name, len(points))
+        return name
+
 
     # Select Channel
     @property
@@ -16,6 +16,7 @@ import time
 import random
 import json
 import ctypes
+import platform
 
 from scipy.spatial import Delaunay
 
@@ -35,22 +36,43 @@ progversion = "0.1"
 
 import zmq
 
+class SharedRingReader(object):
+    """Reads frame data that a plot server on the same host placed in its shared ring."""
+    header_size = 64
+
+    def __init__(self, path, capacity):
+        self.buffer   = np.memmap(path, dtype=np.uint8, mode='r')
+        self.capacity = capacity
+
+    def read(self, md):
+        offset = self.header_size + md['position'] % self.capacity
+        return np.frombuffer(self.buffer, dtype=md['dtype'], count=md['count'], offset=offset)
+
+    def valid(self, md):
+        """Whether the data described by md is still intact, i.e. the server hasn't lapped it."""
+        return int(self.buffer[:8].view(np.int64)[0]) <= md['position'] + self.capacity
+
 class DataListener(QtCore.QObject):
 
     message = QtCore.pyqtSignal(tuple)
-    finished = QtCore.pyqtSignal(bool)
+    finished = QtCore.pyqtSignal(str)
 
-    def __init__(self, host, port=7772):
+    def __init__(self, host, port=7772, transport={}):
         QtCore.QObject.__init__(self)
 
+        self.ring = SharedRingReader(transport['shm'], transport['capacity']) if 'shm' in transport else None
+
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.SUB)
         self.socket.connect("tcp://{}:{}".format(host, port))
         self.socket.setsockopt_string(zmq.SUBSCRIBE, "data")
         self.socket.setsockopt_string(zmq.SUBSCRIBE, "done")
+        self.socket.setsockopt_string(zmq.SUBSCRIBE, "delta")
         self.poller = zmq.Poller()
         self.poller.register(self.socket, zmq.POLLIN)
         self.running = True
+        # Latest frame for each plot, which deltas are applied to
+        self.frames = {}
 
     def loop(self):
         while self.running:
@@ -60,17 +82,25 @@ class DataListener(QtCore.QObject):
                 msg_type = msg[0].decode()
                 name     = msg[1].decode()
                 if msg_type == "done":
-                    self.finished.emit(True)
-                elif msg_type == "data":
-                    result = [name]
-                    # How many pairs of metadata and data are there?
-                    num_arrays = int((len(msg) - 2)/2)
-                    for i in range(num_arrays):
-                        md, data = msg[2+2*i:4+2*i]
-                        md = json.loads(md.decode())
-                        A = np.frombuffer(data, dtype=md['dtype'])
-                        result.append(A)
-                    self.message.emit(tuple(result))
+                    self.finished.emit(name)
+                elif msg_type in ("data", "delta"):
+                    # Pairs of metadata and data follow. Local servers leave the data in the shared ring.
+                    arrays = [json.loads(md.decode()) for md in msg[2::2]]
+                    arrays = [(md, self.ring.read(md) if 'position' in md else np.frombuffer(data, dtype=md['dtype']))
+                              for md, data in zip(arrays, msg[3::2])]
+                    if msg_type == "data":
+                        self.frames[name] = [data.copy() for md, data in arrays]
+                    elif name in self.frames:
+                        for frame, (md, data) in zip(self.frames[name], arrays):
+                            frame[md['start']:md['stop']] = data
+                    else:
+                        # Wait for the next full frame
+                        continue
+                    if not all(self.ring.valid(md) for md, data in arrays if 'position' in md):
+                        # The server overwrote the data while we were copying it
+                        self.frames.pop(name)
+                        continue
+                    self.message.emit(tuple([name] + [frame.copy() for frame in self.frames[name]]))
         self.socket.close()
 
 class MplCanvas(FigureCanvas):
@@ -124,26 +154,56 @@ class MplCanvas(FigureCanvas):
                                    QtWidgets.QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
 
+        # Static parts of each axis, captured after every full draw, for blitting the plots
+        self.backgrounds = None
+        self.mpl_connect('draw_event', self.on_draw)
+
     def compute_initial_figure(self):
         pass
 
+    def on_draw(self, event):
+        self.backgrounds = [self.copy_from_bbox(ax.bbox) for ax in self.axes]
+        for ax, plt in zip(self.axes, self.plots):
+            ax.draw_artist(plt)
+
+    def blit_plots(self):
+        """Redraw only the (animated) plots on top of the cached backgrounds."""
+        for background, ax, plt in zip(self.backgrounds, self.axes, self.plots):
+            self.restore_region(background)
+            ax.draw_artist(plt)
+            self.blit(ax.bbox)
+
 class Canvas1D(MplCanvas):
     def compute_initial_figure(self):
         for ax in self.axes:
-            plt, = ax.plot([0,0,0], marker='o', markersize=4)
+            plt, = ax.plot([0,0,0], marker='o', markersize=4, animated=True)
             ax.ticklabel_format(style='sci', axis='x', scilimits=(-3,3))
             ax.ticklabel_format(style='sci', axis='y', scilimits=(-3,3))
             self.plots.append(plt)
 
     def update_figure(self, data):
         x_data, y_data = data
+        rescale = self.backgrounds is None
         for plt, ax, f in zip(self.plots, self.axes, self.plot_funcs):
-            plt.set_xdata(x_data)
-            plt.set_ydata(f(y_data))
-            ax.relim()
-            ax.autoscale_view()
+            y = f(y_data)
+            plt.set_data(x_data, y)
+            rescale = rescale or self.outside_view(ax, x_data, y)
+        # Only pay for a full redraw when the axes limits have to change
+        if rescale:
+            for ax in self.axes:
+                ax.relim()
+                ax.autoscale_view()
             self.draw()
-            self.flush_events()
+        else:
+            self.blit_plots()
+
+    def outside_view(self, ax, x_data, y_data):
+        finite = np.isfinite(y_data)
+        if not np.any(finite):
+            return False
+        x_data, y_data = x_data[finite], y_data[finite]
+        (x_min, x_max), (y_min, y_max) = sorted(ax.get_xlim()), sorted(ax.get_ylim())
+        return x_data.min() < x_min or x_data.max() > x_max or y_data.min() < y_min or y_data.max() > y_max
 
     def set_desc(self, desc):
         for ax, name in zip(self.axes, self.func_names):
@@ -154,6 +214,7 @@ class Canvas1D(MplCanvas):
         for plt in self.plots:
             plt.set_xdata(np.linspace(desc['x_min'], desc['x_max'], desc['x_len']))
             plt.set_ydata(np.nan*np.linspace(desc['x_min'], desc['x_max'], desc['x_len']))
+        self.backgrounds = None
         self.fig.tight_layout()
 
 class CanvasManual(MplCanvas):
@@ -214,8 +275,11 @@ class Canvas2D(MplCanvas):
         for plt, f in zip(self.plots, self.plot_funcs):
             plt.set_data(f(im_data))
             plt.autoscale()
-        self.draw()
-        self.flush_events()
+        # The extent is fixed by the descriptor, so the images can always be blitted
+        if self.backgrounds is None:
+            self.draw()
+        else:
+            self.blit_plots()
 
     def set_desc(self, desc):
         self.aspect = (desc['x_max']-desc['x_min'])/(desc['y_max']-desc['y_min'])
@@ -235,22 +299,23 @@ class Canvas2D(MplCanvas):
                 ax.set_xlabel(desc['x_label'])
             if 'y_label' in desc.keys():
                 ax.set_ylabel(name + " " + desc['y_label'])
+        self.backgrounds = None
         self.fig.tight_layout()
 
 class CanvasMesh(MplCanvas):
     def compute_initial_figure(self):
         # data = np.array([[0,0,0],[0,1,0],[1,1,0],[1,0,0]])
         # self.update_figure(np.array(data))
-        pass
+        self.mesh = None
 
     def update_figure(self, data):
         # Expected xs, ys, zs coming in as
         # data = np.array([xs, ys, zs]).transpose()
         data = data.reshape((-1, 3), order='c')
         points = data[:,0:2]
-        mesh = self.scaled_Delaunay(points)
-        xs   = mesh.points[:,0]
-        ys   = mesh.points[:,1]
+        mesh = self.extend_Delaunay(points)
+        xs   = points[:,0]
+        ys   = points[:,1]
         for ax, f in zip(self.axes, self.plot_funcs):
             ax.clear()
             ax.tripcolor(xs, ys, mesh.simplices, f(data[:,2]), cmap="RdGy", shading="flat")
@@ -261,6 +326,7 @@ class CanvasMesh(MplCanvas):
     def set_desc(self, desc):
 
         self.plots = []
+        self.mesh  = None
         for ax, name in zip(self.axes, self.func_names):
             if 'x_label' in desc.keys():
                 ax.set_xlabel(desc['x_label'])
@@ -270,20 +336,20 @@ class CanvasMesh(MplCanvas):
             ax.ticklabel_format(style='sci', axis='y', scilimits=(-3,3))
         self.fig.tight_layout()
 
-    def scaled_Delaunay(self, points):
-        """ Return a scaled Delaunay mesh and scale factors """
-        scale_factors = []
-        points = np.array(points)
-        for i in range(points.shape[1]):
-            scale_factors.append(1.0/np.mean(points[:,i]))
-            points[:,i] = points[:,i]*scale_factors[-1]
-        mesh = Delaunay(points)
-        for i in range(points.shape[1]):
-            mesh.points[:,i] = mesh.points[:,i]/scale_factors[i]
-        return mesh
+    def extend_Delaunay(self, points):
+        """ Return a Delaunay mesh of the points, scaled by their initial means. Points appended
+        since the last call are added to the existing mesh rather than triangulating from scratch. """
+        num_old = 0 if self.mesh is None else self.mesh_points.shape[0]
+        if self.mesh is None or points.shape[0] < num_old or not np.array_equal(points[:num_old], self.mesh_points):
+            self.scale_factors = 1.0/np.mean(points, axis=0)
+            self.mesh = Delaunay(points*self.scale_factors, incremental=True)
+        elif points.shape[0] > num_old:
+            self.mesh.add_points(points[num_old:]*self.scale_factors)
+        self.mesh_points = np.array(points)
+        return self.mesh
 
 class MatplotClientWindow(QtWidgets.QMainWindow):
-    def __init__(self, hostname=None, status_port=7771, data_port=7772):
+    def __init__(self, hostname=None, status_port=7771, data_port=7772, persistent=False):
         QtWidgets.QMainWindow.__init__(self)
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
         self.setWindowTitle("Auspex Plotting")
@@ -309,33 +375,63 @@ class MatplotClientWindow(QtWidgets.QMainWindow):
 
         self.listener_thread = None
 
+        # Persistent clients go back to waiting for a server once a run is done
+        self.persistent    = persistent
+        self.status_socket = None
+        self.connect_timer = QtCore.QTimer(self)
+        self.connect_timer.timeout.connect(self.check_connection)
+
+        # Draw at most max_fps times per second, using only the latest data for each plot
+        self.max_fps = 20
+        self.pending_updates = {}
+        self.redraw_timer = QtCore.QTimer(self)
+        self.redraw_timer.timeout.connect(self.redraw)
+        self.redraw_timer.start(int(1000/self.max_fps))
+
         if hostname:
             self.open_connection(hostname, status_port, data_port)
 
-    def open_connection(self, address, status_port, data_port):
+    def open_connection(self, address, status_port=7771, data_port=7772):
         self.statusBar().showMessage("Open session to {}:{}".format(address, status_port), 2000)
-        socket = self.context.socket(zmq.DEALER)
-        socket.identity = "Matplotlib_Qt_Client".encode()
-        socket.connect("tcp://{}:{}".format(address, status_port))
-        socket.send(b"WHATSUP")
-
-        poller = zmq.Poller()
-        poller.register(socket, zmq.POLLOUT)
-        time.sleep(0.1)
-
-        evts = dict(poller.poll(100))
-        if socket in evts:
-            try:
-                reply, desc = [e.decode() for e in socket.recv_multipart()]
-                desc = json.loads(desc)
-                self.statusBar().showMessage("Connection established. Pulling plot information.", 2000)
-            except:
-                self.statusBar().showMessage("Could not connect to server.", 2000)
-                return
-        else:
-            self.statusBar().showMessage("Server did not respond.", 2000)
+        self.address, self.status_port, self.data_port = address, status_port, data_port
+        if self.status_socket:
+            self.status_socket.close(linger=0)
+        self.status_socket = self.context.socket(zmq.DEALER)
+        self.status_socket.identity = "Matplotlib_Qt_Client".encode()
+        self.status_socket.connect("tcp://{}:{}".format(address, status_port))
+        self.request_desc()
+
+        # The server may not be up yet, so wait for its reply without blocking the GUI
+        self.last_request = time.time()
+        self.connect_timer.start(50)
+
+    def request_desc(self):
+        # Let the server know how many pixels we have, so it needn't send more points than that
+        ratio = self.devicePixelRatio()
+        size  = [int(self.main_widget.width()*ratio), int(self.main_widget.height()*ratio)]
+        self.status_socket.send_multipart([b"WHATSUP", json.dumps({'size': size, 'host': platform.node()}).encode()])
+
+    def check_connection(self):
+        if not self.status_socket.poll(0):
+            # Servers that are shutting down ignore us, so keep asking
+            if time.time() - self.last_request > 1.0:
+                self.request_desc()
+                self.last_request = time.time()
+            return
+
+        self.connect_timer.stop()
+        try:
+            reply, desc, transport = [e.decode() for e in self.status_socket.recv_multipart()]
+            desc = json.loads(desc)
+            transport = json.loads(transport)
+            self.statusBar().showMessage("Connection established. Pulling plot information.", 2000)
+        except:
+            self.statusBar().showMessage("Could not connect to server.", 2000)
+            return
+        finally:
+            self.status_socket.close(linger=0)
+            self.status_socket = None
 
-        socket.close()
         self.construct_plots(desc)
 
         # Actual data listener
@@ -345,11 +441,11 @@ class MatplotClientWindow(QtWidgets.QMainWindow):
             self.listener_thread.wait()
 
         self.listener_thread = QtCore.QThread()
-        self.Datalistener = DataListener(address, data_port)
+        self.Datalistener = DataListener(self.address, self.data_port, transport)
         self.Datalistener.moveToThread(self.listener_thread)
         self.listener_thread.started.connect(self.Datalistener.loop)
         self.Datalistener.message.connect(self.data_signal_received)
-        self.Datalistener.finished.connect(self.stop_listening)
+        self.Datalistener.finished.connect(self.listener_finished)
 
         QtCore.QTimer.singleShot(0, self.listener_thread.start)
 
@@ -395,20 +491,23 @@ class MatplotClientWindow(QtWidgets.QMainWindow):
         self.tabs.currentChanged.connect(self.switch_toolbar)
 
     def data_signal_received(self, message):
-        plot_name = message[0]
-        data      = message[1:]
-        try:
-            # If we see a colon, then we must look for a named trace
-            if ":" in plot_name:
-                plot_name, trace_name = plot_name.split(":")
-                self.canvas_by_name[plot_name].update_trace(trace_name, *data)
-            else:
-                if isinstance(self.canvas_by_name[plot_name], CanvasMesh):
-                    self.canvas_by_name[plot_name].update_figure(data[0])
+        self.pending_updates[message[0]] = message[1:]
+
+    def redraw(self):
+        updates, self.pending_updates = self.pending_updates, {}
+        for plot_name, data in updates.items():
+            try:
+                # If we see a colon, then we must look for a named trace
+                if ":" in plot_name:
+                    plot_name, trace_name = plot_name.split(":")
+                    self.canvas_by_name[plot_name].update_trace(trace_name, *data)
                 else:
-                    self.canvas_by_name[plot_name].update_figure(data)
-        except Exception as e:
-            self.statusBar().showMessage("Exception while plotting {}. Length of data: {}".format(e, len(data)), 1000)
+                    if isinstance(self.canvas_by_name[plot_name], CanvasMesh):
+                        self.canvas_by_name[plot_name].update_figure(data[0])
+                    else:
+                        self.canvas_by_name[plot_name].update_figure(data)
+            except Exception as e:
+                self.statusBar().showMessage("Exception while plotting {}. Length of data: {}".format(e, len(data)), 1000)
 
     def switch_toolbar(self):
         for toolbar in self.toolbars:
@@ -418,15 +517,26 @@ class MatplotClientWindow(QtWidgets.QMainWindow):
     def fileQuit(self):
         self.close()
 
-    def stop_listening(self, _):
+    def listener_finished(self, name):
+        # Persistent clients keep listening to the end of the run, when the server itself is done
+        if self.persistent and name in self.canvas_by_name:
+            return
+        self.stop_listening()
+
+    def stop_listening(self, reconnect=True):
         self.statusBar().showMessage("Disconnecting from server.", 10000)
         self.Datalistener.running = False
         self.listener_thread.quit()
         self.listener_thread.wait()
+        self.listener_thread = None
+        if self.persistent and reconnect:
+            # Keep the plots up and wait for the next experiment's server
+            self.open_connection(self.address, self.status_port, self.data_port)
 
     def closeEvent(self, ce):
+        self.connect_timer.stop()
         if self.listener_thread:
-            self.stop_listening(True)
+            self.stop_listening(False)
         self.fileQuit()
 
 if __name__ == '__main__':
@@ -442,12 +552,14 @@ if __name__ == '__main__':
         myappid = u'BBN.auspex.matplotlib-client.0001' # arbitrary string
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
+    persistent = "--persistent" in sys.argv
+    sys.argv = [arg for arg in sys.argv if arg != "--persistent"]
     if len(sys.argv) > 2:
         sys.argv = sys.argv[:2] + [int(arg) for arg in sys.argv[2:]]
     if len(sys.argv) > 1:
-        aw = MatplotClientWindow(*sys.argv[1:])
+        aw = MatplotClientWindow(*sys.argv[1:], persistent=persistent)
     else:
-        aw = MatplotClientWindow()
+        aw = MatplotClientWindow(persistent=persistent)
     aw.setWindowTitle("%s" % progname)
     aw.show()
     aw.setWindowState(aw.windowState() & ~QtCore.Qt.WindowMinimized | QtCore.Qt.WindowActive)
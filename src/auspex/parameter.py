@@ -6,8 +6,14 @@
 #
 #    http://www.apache.org/licenses/LICENSE-2.0
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from auspex.log import logger
 
+# Pushes that don't go to a connected instrument run here, in order
+push_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="push")
+
 class Parameter(object):
     """ Encapsulates the information for an experiment parameter"""
 
@@ -34,6 +40,7 @@ class Parameter(object):
         self.pre_push_hooks = []
         self.post_push_hooks = []
 
+    # Hooks run wherever the push does, which is a worker thread under push_async
     def add_pre_push_hook(self, hook):
         self.pre_push_hooks.append(hook)
 
@@ -118,6 +125,18 @@ class Parameter(object):
             for pph in self.post_push_hooks:
                 pph()
 
+    async def push_async(self):
+        """Push on a worker thread, that of the instrument the method belongs to if any, so that
+        the event loop keeps servicing streams and filters while the instrument is busy. The pre
+        and post push hooks run on that thread as well, along with the method."""
+        if self.method is not None:
+            interface = getattr(getattr(self.method, '__self__', None), 'interface', None)
+            # Looked up on the class, so that stand-ins such as a MagicMock interface don't count
+            if getattr(type(interface), 'run_async', None) is not None:
+                await interface.run_async(self.push)
+            else:
+                await asyncio.get_event_loop().run_in_executor(push_executor, self.push)
+
 class FilenameParameter(Parameter):
     def __init__(self, *args, **kwargs):
         super(FilenameParameter, self).__init__(*args, **kwargs)
@@ -164,6 +183,10 @@ class ParameterGroup(Parameter):
         for param in self.parameters:
             param.push()
 
+    async def push_async(self):
+        for param in self.parameters:
+            await param.push_async()
+
 class FloatParameter(Parameter):
 
     @property
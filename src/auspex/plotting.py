@@ -6,11 +6,12 @@
 #
 #    http://www.apache.org/licenses/LICENSE-2.0
 
-from threading import Thread
+from threading import Thread, Lock, Event
 import subprocess
 import psutil
 import os
 import json
+import platform
 import sys
 import tempfile
 import time
@@ -20,48 +21,191 @@ import zmq.asyncio
 import numpy as np
 from auspex.log import logger
 
+def all_tasks(loop):
+    """The tasks of loop (asyncio.Task.all_tasks was removed in Python 3.9)."""
+    if hasattr(asyncio, "all_tasks"):
+        return asyncio.all_tasks(loop)
+    return asyncio.Task.all_tasks(loop=loop)
+
+def changed_range(old, new):
+    """Return the (start, stop) range of flat indices over which new differs from old."""
+    changed = old.ravel() != new.ravel()
+    if np.issubdtype(new.dtype, np.inexact):
+        changed &= ~(np.isnan(old.ravel()) & np.isnan(new.ravel()))
+    idx = np.flatnonzero(changed)
+    if idx.size == 0:
+        return (0, 0)
+    return (int(idx[0]), int(idx[-1])+1)
+
+class SharedRing(object):
+    """Ring of frame data in a memory-mapped file, which plot clients on the same host read
+    directly instead of receiving the arrays over ZMQ. The header holds the absolute number of
+    bytes reserved so far. The writer bumps it before overwriting anything, so a reader can
+    tell whether the data it copied out might have been clobbered in the meantime."""
+    header_size = 64
+
+    def __init__(self, capacity=64*1024*1024):
+        shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, self.path = tempfile.mkstemp(prefix="auspex-plot-", suffix=".shm", dir=shm_dir)
+        os.close(fd)
+        self.capacity = capacity
+        self.buffer   = np.memmap(self.path, dtype=np.uint8, mode='w+', shape=(self.header_size + capacity,))
+        self.cursor   = self.buffer[:8].view(np.int64)
+        self.cursor[0] = 0
+
+    def write(self, data):
+        """Copy data into the ring and return its absolute position, or None if it can't fit."""
+        data = np.ascontiguousarray(data)
+        if data.nbytes > self.capacity:
+            return None
+        position = int(self.cursor[0])
+        offset   = position % self.capacity
+        if offset + data.nbytes > self.capacity:
+            # Don't split frames across the end of the ring
+            position += self.capacity - offset
+            offset    = 0
+        self.cursor[0] = position + -(-data.nbytes//64)*64
+        self.buffer[self.header_size+offset:self.header_size+offset+data.nbytes] = data.reshape(-1).view(np.uint8)
+        return position
+
+    def close(self):
+        del self.cursor, self.buffer
+        try:
+            os.remove(self.path)
+        except OSError:
+            logger.debug("Could not remove plot ring %s", self.path)
+
 class MatplotServerThread(Thread):
 
-    def __init__(self, plot_desc={}, status_port = 7771, data_port = 7772):
+    def __init__(self, plot_desc={}, status_port = 7771, data_port = 7772, shared_memory = True):
         super(MatplotServerThread, self).__init__()
         self.plot_desc = plot_desc
         self.status_port = status_port
         self.data_port = data_port
         self.daemon = True
         self.stopped = False
+        self.closing = False
+        # Set once a client has subscribed to the plot data
+        self.client_ready = Event()
+        # Largest (width, height) worth sending, updated from the client canvas on connection
+        self.canvas_size = (1024, 1024)
+        # Frames waiting to go out, only the latest of which is kept for each plot
+        self.pending = {}
+        self.pending_lock = Lock()
+        self.flush_scheduled = False
+        # Last frame sent for each plot, against which deltas are computed. A full
+        # frame is sent every keyframe_interval updates so that late clients can sync.
+        self.last_frames = {}
+        self.num_sent = {}
+        self.keyframe_interval = 10
+        # Frame data goes through a shared ring rather than ZMQ while all clients are local
+        self.shared_memory = shared_memory
+        self.ring = None
         self.start()
 
     async def poll_sockets(self):
         while not self.stopped:
             evts = dict(await self.poller.poll(50))
+            if self.data_sock in evts and evts[self.data_sock] == zmq.POLLIN:
+                # Subscriptions start with 1, unsubscriptions with 0
+                subscription = await self.data_sock.recv()
+                if subscription[:1] == b"\x01":
+                    self.client_ready.set()
             if self.status_sock in evts and evts[self.status_sock] == zmq.POLLIN:
-                ident, msg = await self.status_sock.recv_multipart()
-                if msg == b"WHATSUP":
-                    await self.status_sock.send_multipart([ident, b"HI!", json.dumps(self.plot_desc).encode('utf8')])
+                ident, msg, *info = await self.status_sock.recv_multipart()
+                # Don't hand our plots to clients looking for the next server
+                if msg == b"WHATSUP" and not self.closing:
+                    info = json.loads(info[0].decode()) if info else {}
+                    if 'size' in info:
+                        self.canvas_size = tuple(info['size'])
+                    # A new client has no frames to apply deltas to
+                    self.last_frames = {}
+                    transport = {}
+                    if self.shared_memory and info.get('host') == platform.node():
+                        if self.ring is None:
+                            self.ring = SharedRing()
+                        transport = {'shm': self.ring.path, 'capacity': self.ring.capacity}
+                    elif self.ring is not None:
+                        logger.info("Remote plot client connected, sending plot data over ZMQ only.")
+                        self.shared_memory = False
+                    await self.status_sock.send_multipart([ident, b"HI!", json.dumps(self.plot_desc).encode('utf8'),
+                                                           json.dumps(transport).encode('utf8')])
             await asyncio.sleep(0.010)
 
+    def encode(self, name, data):
+        """Return the message type and the (metadata, array) pairs to send for a frame. If only
+        part of the frame has changed since the last one, only the changed slices are sent."""
+        data     = [np.asarray(dat) for dat in data]
+        previous = self.last_frames.get(name)
+        self.num_sent[name] = self.num_sent.get(name, 0) + 1
+        self.last_frames[name] = [np.array(dat) for dat in data]
+
+        if previous is not None and self.num_sent[name] % self.keyframe_interval != 0 and \
+           [(p.shape, p.dtype) for p in previous] == [(d.shape, d.dtype) for d in data]:
+            ranges = [changed_range(p, d) for p, d in zip(previous, data)]
+            if sum(stop - start for start, stop in ranges) <= sum(d.size for d in data)//2:
+                return "delta", [(dict(dtype=str(dat.dtype), shape=dat.shape, start=start, stop=stop), dat.ravel()[start:stop])
+                                 for dat, (start, stop) in zip(data, ranges)]
+        return "data", [(dict(dtype=str(dat.dtype), shape=dat.shape), dat) for dat in data]
+
     async def _send(self, name, data, msg="data"):
+        if msg == "data":
+            msg, arrays = self.encode(name, data)
+        else:
+            arrays = [(dict(dtype=str(dat.dtype), shape=dat.shape), dat) for dat in data]
         msg_contents = [msg.encode(), name.encode()]
         # We might be sending multiple axes, series, etc.
         # Just add them succesively to a multipart message.
-        for dat in data:
-            md = dict(
-                dtype = str(dat.dtype),
-                shape = dat.shape,
-            )
-            msg_contents.extend([json.dumps(md).encode(), np.ascontiguousarray(dat)])
+        for md, dat in arrays:
+            position = self.ring.write(dat) if self.shared_memory and self.ring is not None else None
+            if position is not None:
+                # Only tell the client where to find the data
+                md['position'], md['count'] = position, int(np.size(dat))
+                dat = b""
+            else:
+                dat = np.ascontiguousarray(dat)
+            msg_contents.extend([json.dumps(md).encode(), dat])
         await self.data_sock.send_multipart(msg_contents)
 
+    async def _flush(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+            self.flush_scheduled = False
+        for (name, msg), data in pending.items():
+            await self._send(name, data, msg=msg)
+
     def send(self, name, *data, msg="data"):
         if not self.stopped:
-            self._loop.create_task(self._send(name, data, msg=msg))
+            with self.pending_lock:
+                # Latest wins: a slow client only ever gets the most recent frame of each plot
+                self.pending.pop((name, msg), None)
+                self.pending[(name, msg)] = data
+                if self.flush_scheduled:
+                    return
+                self.flush_scheduled = True
+            self._loop.call_soon_threadsafe(self._loop.create_task, self._flush())
+
+    def wait_for_client(self, timeout=5.0, process=None):
+        """Block until a plot client has subscribed, the client process has exited, or timeout
+        seconds have passed. Returns whether a client is ready."""
+        start = time.time()
+        while not self.client_ready.wait(0.05):
+            if time.time() - start > timeout or (process is not None and process.poll() is not None):
+                logger.info("No plot client connected to port %d.", self.data_port)
+                return False
+        return True
 
     def stop(self):
+        self.closing = True
         self.send("irrelevant", np.array([]), msg="done")
+        for i in range(100):
+            if not self.flush_scheduled:
+                break
+            time.sleep(0.01)
         self.stopped = True
-        pending = asyncio.Task.all_tasks(loop=self._loop)
-        self._loop.stop()
-        time.sleep(1)
+        pending = all_tasks(self._loop)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self.join(1.0)
         for task in pending:
             task.cancel()
             try:
@@ -75,11 +219,14 @@ class MatplotServerThread(Thread):
             asyncio.set_event_loop(self._loop)
             self.context = zmq.asyncio.Context()
             self.status_sock = self.context.socket(zmq.ROUTER)
-            self.data_sock = self.context.socket(zmq.PUB)
+            # XPUB rather than PUB so that we hear about subscriptions
+            self.data_sock = self.context.socket(zmq.XPUB)
+            self.data_sock.setsockopt(zmq.XPUB_VERBOSE, 1)
             self.status_sock.bind("tcp://*:%s" % self.status_port)
             self.data_sock.bind("tcp://*:%s" % self.data_port)
             self.poller = zmq.asyncio.Poller()
             self.poller.register(self.status_sock, zmq.POLLIN)
+            self.poller.register(self.data_sock, zmq.POLLIN)
 
             self._loop.create_task(self.poll_sockets())
             try:
@@ -88,3 +235,5 @@ class MatplotServerThread(Thread):
                 self.status_sock.close()
                 self.data_sock.close()
                 self.context.destroy()
+                if self.ring is not None:
+                    self.ring.close()
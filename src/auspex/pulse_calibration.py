@@ -51,11 +51,8 @@ def calibrate(calibrations, update_settings=True, cal_log=True):
             raise Exception("Calibration failure") from ex
         finally:
             sleep(0.1) #occasionally ZMQ barfs here
-            if hasattr(calibration.exp, 'extra_plot_server'):
-                try:
-                    calibration.exp.extra_plot_server.stop()
-                except:
-                    pass
+            if calibration.exp is not None:
+                calibration.exp.teardown()
 
 class PulseCalibration(object):
     """Base class for calibration of qubit control pulses."""
@@ -88,16 +85,23 @@ class PulseCalibration(object):
         return [[Id(self.qubit), MEAS(self.qubit)]]
 
     def set(self, instrs_to_set = [], exp_step = 0, **params):
-        try:
-            extra_plot_server = self.exp.extra_plot_server
-        except Exception as e:
-            pass #no experiment yet created, or plot server not yet started
         meta_file = compile_to_hardware(self.sequence(**params), fileName=self.filename, axis_descriptor=self.axis_descriptor)
-        if hasattr(self.exp, 'extra_plot_server'):
-            extra_plot_server = self.exp.extra_plot_server
-        self.exp = QubitExpFactory.create(meta_file=meta_file, calibration=True, save_data=False, cw_mode=self.cw_mode)
-        self.exp.leave_plot_server_open = True
-        self.exp.first_exp = not bool(exp_step)
+        # Re-arm the experiment from the previous step if it fits the new sequence, rather than
+        # reconnecting the instruments and rebuilding the filter graph
+        extra_plot_server = None
+        if self.exp is not None:
+            try:
+                self.exp.rearm(meta_file)
+            except ValueError as e:
+                logger.info("Rebuilding the calibration experiment: %s", e)
+                # Keep the calibration plots open across the rebuild
+                extra_plot_server = self.exp.__dict__.pop('extra_plot_server', None)
+                self.exp.teardown()
+                self.exp = None
+        if self.exp is None:
+            self.exp = QubitExpFactory.create(meta_file=meta_file, calibration=True, save_data=False, cw_mode=self.cw_mode, reusable=True)
+            if extra_plot_server is not None:
+                self.exp.extra_plot_server = extra_plot_server
 
         #Update all instruments that need to keep track of experiment numnber. Adapted from https://stackoverflow.com/questions/9807634/find-all-occurrences-of-a-key-in-nested-python-dictionaries-and-lists
         def find_all_items(obj, key):
@@ -113,10 +117,6 @@ class PulseCalibration(object):
         for k in find_all_items(self.exp.settings, 'exp_step'):
             k['exp_step'] = exp_step
 
-        try:
-            self.exp.extra_plot_server = extra_plot_server
-        except:
-            pass
         if self.plot:
             [self.exp.add_manual_plotter(p) for p in self.plot] if isinstance(self.plot, list) else self.exp.add_manual_plotter(self.plot)
         #sweep instruments for calibration
@@ -135,13 +135,15 @@ class PulseCalibration(object):
         var = {}
         for buff in self.exp.buffers:
             if self.exp.writer_to_qubit[buff.name][0] in self.qubit_names:
-                dataset, descriptor = buff.get_data(), buff.get_descriptor()
+                # A view, as only the results below are kept past the next run
+                dataset, descriptor = buff.get_data_view(), buff.get_descriptor()
                 qubit_name = self.exp.writer_to_qubit[buff.name][0]
                 if norm_pts:
                     buff_data = normalize_data(dataset, zero_id = norm_pts[qubit_name][0], one_id = norm_pts[qubit_name][1])
                 else:
                     buff_data = dataset['Data']
-                data[qubit_name] = self.quad_fun(buff_data)
+                # np.real and np.imag return views, which the next run would overwrite
+                data[qubit_name] = np.array(self.quad_fun(buff_data))
                 if 'Variance' in dataset.dtype.names:
                     realvar = np.real(dataset['Variance'])
                     imagvar = np.imag(dataset['Variance'])
@@ -0,0 +1,130 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+__all__ = ['LazyRegistry']
+
+import ast
+import os
+import re
+import json
+import inspect
+import pkgutil
+import importlib
+
+import auspex.config as config
+from auspex.log import logger
+
+ALL_PATTERN   = re.compile(r"^__all__\s*=\s*(\[[^\]]*\])", re.MULTILINE)
+CLASS_PATTERN = re.compile(r"^class\s+(\w+)", re.MULTILINE)
+
+def scan_module(filename):
+    """Read the names listed in a module's __all__ and the classes it defines, without importing it."""
+    with open(filename, 'r') as f:
+        src = f.read()
+    match = ALL_PATTERN.search(src)
+    return (ast.literal_eval(match.group(1)) if match else []), CLASS_PATTERN.findall(src)
+
+class LazyRegistry(object):
+    """Maps the names exported and the classes defined by a package's modules to those modules,
+    importing each module (and whatever drivers or libraries it depends on) only when one of
+    its names is requested. Intended to back a package-level __getattr__ (PEP 562).
+
+    The map is built once per process from the module sources. If *config.RegistryCacheDir* is
+    set it is also cached there, keyed on the modification times of the package's modules."""
+
+    def __init__(self, package, path):
+        super(LazyRegistry, self).__init__()
+        self.package  = package
+        self.path     = path
+        self._exports = None
+        self._classes = None
+
+    @property
+    def exports(self):
+        if self._exports is None:
+            self.build()
+        return self._exports
+
+    @property
+    def classes(self):
+        if self._classes is None:
+            self.build()
+        return self._classes
+
+    @property
+    def modules(self):
+        return [name for loader, name, is_pkg in pkgutil.iter_modules(self.path)]
+
+    def module_files(self):
+        files = {}
+        for loader, name, is_pkg in pkgutil.iter_modules(self.path):
+            filename = os.path.join(loader.path, name + ".py")
+            if not is_pkg and os.path.exists(filename):
+                files[name] = filename
+        return files
+
+    def cache_file(self):
+        if config.RegistryCacheDir:
+            return os.path.join(config.RegistryCacheDir, "registry-{}.json".format(self.package))
+
+    def build(self):
+        files = self.module_files()
+        key   = sorted([name, os.path.getmtime(filename)] for name, filename in files.items())
+
+        cache_file = self.cache_file()
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    cached = json.load(f)
+                if cached['key'] == key:
+                    self._exports, self._classes = cached['exports'], cached['classes']
+                    return
+            except (ValueError, KeyError) as e:
+                logger.debug("Ignoring unreadable registry cache %s: %s", cache_file, e)
+
+        self._exports, self._classes = {}, {}
+        for name, filename in files.items():
+            exports, classes = scan_module(filename)
+            self._exports.update((export, self.package + "." + name) for export in exports)
+            self._classes.update((cls, self.package + "." + name) for cls in classes)
+
+        if cache_file:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                with open(cache_file, 'w') as f:
+                    json.dump({'key': key, 'exports': self._exports, 'classes': self._classes}, f)
+            except OSError as e:
+                logger.warning("Could not write registry cache %s: %s", cache_file, e)
+
+    def names(self):
+        return list(self.exports.keys())
+
+    def load(self, name):
+        """Import the module exporting `name` and return the exported object."""
+        if name in self.exports:
+            return getattr(importlib.import_module(self.exports[name]), name)
+        if name in self.modules:
+            return importlib.import_module(self.package + "." + name)
+        raise AttributeError("module '{}' has no attribute '{}'".format(self.package, name))
+
+    def find_class(self, name, base=object):
+        """Import and return the class `name` defined in this package, provided it derives from
+        `base`. Returns None if there is no such class."""
+        if name not in self.classes:
+            return None
+        cls = getattr(importlib.import_module(self.classes[name]), name, None)
+        if inspect.isclass(cls) and issubclass(cls, base):
+            return cls
+
+    def getattr(self, name):
+        if name == "__all__":
+            return self.names()
+        return self.load(name)
+
+    def dir(self):
+        return sorted(set(self.names() + self.modules))
@@ -67,7 +67,6 @@ class SingleShotFidelityExperiment(QubitExperiment):
         if 'sweeps' in self.settings:
             QubitExpFactory.load_parameter_sweeps(experiment)
         self.ssf = self.find_single_shot_filter()
-        self.leave_plot_server_open = True
 
     def run_sweeps(self):
         #For now, only update histograms if we don't have a parameter sweep.
@@ -100,7 +99,7 @@ class SingleShotFidelityExperiment(QubitExperiment):
                 raise NameError("Please connect a buffer to the single-shot filter output in order to optimize fidelity.")
             #set sweep parameters to the values that maximize fidelity. Then update the saved_settings with the new values
             for buff in fid_buffers:
-                dataset, descriptor = buff.get_data(), buff.get_descriptor()
+                dataset, descriptor = buff.get_data_view(), buff.get_descriptor()
                 opt_ind = np.argmax(dataset['Data'])
                 for k, axis in enumerate(self.sweeper.axes):
                     instr_tree = axis.parameter.instr_tree
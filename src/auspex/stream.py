@@ -186,7 +186,7 @@ class SweepAxis(DataAxis):
                 self.metadata_value = self.metadata[self.step]
             logger.debug("Sweep Axis '{}' at step {} takes value: {}.".format(self.name,
                                                                                self.step,self.value))
-            self.push()
+            await self.push_async()
             self.step += 1
             self.done = False
 
@@ -220,6 +220,16 @@ class SweepAxis(DataAxis):
             self.parameter.value = self.value
             self.parameter.push()
 
+    async def push_async(self):
+        """ Push parameter value(s) without blocking the event loop """
+        if self.unstructured:
+            for p, v in zip(self.parameter, self.value):
+                p.value = v
+                await p.push_async()
+        else:
+            self.parameter.value = self.value
+            await self.parameter.push_async()
+
     def __repr__(self):
         return "<SweepAxis(name={},length={},unit={},value={},unstructured={}>".format(self.name,
                 self.num_points(),self.unit,self.value,self.unstructured)
@@ -234,13 +244,24 @@ class DataStreamDescriptor(object):
         self.unit = None
         self.params = {} # Parameters associated with each dataset
         self.parent = None
-        self._exp_src = None # Actual source code from the underlying experiment
+        self.exp_src = None # Source of the underlying experiment, or a callable returning it
         self.dtype = dtype
         self.metadata = {}
 
         # Keep track of the parameter permutations we have actually used...
         self.visited_tuples = []
 
+    @property
+    def _exp_src(self):
+        # Source lookup is deferred until a writer actually needs it
+        if callable(self.exp_src):
+            self.exp_src = self.exp_src()
+        return self.exp_src
+
+    @_exp_src.setter
+    def _exp_src(self, value):
+        self.exp_src = value
+
     def is_adaptive(self):
         return True in [a.refine_func is not None for a in self.axes]
 
@@ -67,7 +67,6 @@ class TestExperiment(Experiment):
 if __name__ == '__main__':
 
     exp  = TestExperiment()
-    exp.leave_plot_server_open = True
 
     # Create the plotter and the actual traces we'll need
     plt  = ManualPlotter("Manual Plotting Test", x_label='X Thing', y_label='Y Thing')
@@ -47,7 +47,7 @@ from auspex.experiment import Experiment
 from auspex.parameter import FloatParameter
 from auspex.stream import DataStream, DataAxis, DataStreamDescriptor, OutputConnector
 from auspex.filters.debug import Print
-from auspex.filters.io import DataBuffer
+from auspex.filters.io import DataBuffer, RollingBuffer, RingBuffer
 from auspex.log import logger
 
 class SweptTestExperiment(Experiment):
@@ -178,5 +178,99 @@ class BufferTestCase(unittest.TestCase):
         self.assertTrue(len(data) == 4*3*5)
         self.assertTrue(len(data['samples_metadata']) == 4*3*5)
 
+    def test_buffer_spill(self):
+        exp = SweptTestExperiment()
+        db  = DataBuffer(spill_size=0)
+
+        edges = [(exp.voltage, db.sink), (exp.current, db.sink)]
+        exp.set_graph(edges)
+
+        exp.add_sweep(exp.field, np.linspace(0,100.0,4))
+        exp.add_sweep(exp.freq, np.linspace(0,10.0,3))
+        exp.run_sweeps()
+
+        data = db.get_data()
+        self.assertTrue(isinstance(db.data, np.memmap))
+        self.assertTrue(len(data) == 4*3*5)
+        self.assertTrue(np.allclose(data['current'], 2.0*data['voltage']))
+        self.assertTrue(np.shares_memory(db.get_data_view(), db.data))
+        self.assertFalse(np.shares_memory(data, db.data))
+
+    def test_buffer_growth(self):
+        exp = SweptTestExperiment()
+        db  = DataBuffer(store_tuples=False)
+        edges = [(exp.voltage, db.sink)]
+        exp.set_graph(edges)
+        exp.add_sweep(exp.field, np.linspace(0,100.0,4))
+        exp.run_sweeps()
+
+        db.data[:] = 0
+        db.data['voltage'][:db.num_points] = np.arange(db.num_points)
+        for num_points in range(21, 100):
+            db.resize(num_points)
+        self.assertTrue(db.data.size < 2*99)
+        self.assertTrue(np.all(db.get_data()['voltage'][:20] == np.arange(20)))
+
+    def test_rolling_buffer(self):
+        exp = SweptTestExperiment()
+        db  = RollingBuffer(max_points=7, summary_points=5)
+
+        edges = [(exp.voltage, db.sink), (exp.current, db.sink)]
+        exp.set_graph(edges)
+
+        exp.add_sweep(exp.field, np.linspace(0,100.0,4))
+        exp.add_sweep(exp.freq, np.linspace(0,10.0,3))
+        exp.run_sweeps()
+
+        data = db.get_data()
+        self.assertEqual(data.dtype.names, db.buffer_dtype().names)
+        self.assertTrue(len(data['voltage']) == 7)
+        self.assertTrue(np.all(data['freq'] == 10.0))
+        self.assertEqual(list(data['samples']), [3, 4, 0, 1, 2, 3, 4])
+        self.assertTrue(np.allclose(data['current'], 2.0*data['voltage']))
+        self.assertTrue(np.all(np.diff(db.snapshot()['time']) >= 0))
+
+        voltage, current = [db.get_summaries(s) for s in db.sink.input_streams]
+        self.assertTrue(len(voltage) == 4*3)
+        for stat in ('min', 'mean', 'max'):
+            self.assertTrue(np.allclose(current[stat], 2.0*voltage[stat]))
+        self.assertTrue(np.allclose(voltage['mean'][-1], np.mean(data['voltage'][-5:])))
+
+    def test_rolling_buffer_events(self):
+        """Check that events between data messages don't store the last chunk again."""
+        descriptor = DataStreamDescriptor()
+        descriptor.data_name = "voltage"
+        descriptor.add_axis(DataAxis("samples", list(range(4))))
+        stream = DataStream(name="voltage")
+        stream.set_descriptor(descriptor)
+        db = RollingBuffer(max_points=10, summary_points=2)
+        db.sink.add_input_stream(stream)
+        db.sink.descriptor = descriptor
+        db.final_init()
+
+        async def feed():
+            await stream.push(np.array([0.0, 1.0]))
+            await stream.push_event("refined")
+            await stream.push(np.array([2.0, 3.0]))
+            await stream.push_event("done")
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(asyncio.gather(db.run(), feed()))
+
+        self.assertEqual(list(db.get_data()['voltage']), [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual(list(db.get_summaries()['mean']), [0.5, 2.5])
+
+    def test_ring_buffer(self):
+        ring = RingBuffer(8, np.int64)
+        for i in range(0, 50, 3):
+            ring.append(np.arange(i, i+3))
+        self.assertTrue(np.all(ring.snapshot() == np.arange(43, 51)))
+        ring.append(np.arange(100, 120))
+        self.assertTrue(np.all(ring.snapshot() == np.arange(112, 120)))
+
+        ring.discard(ring.count - 4)
+        ring.grow(16)
+        ring.append(np.arange(120, 130))
+        self.assertTrue(np.all(ring.snapshot() == np.arange(116, 130)))
+
 if __name__ == '__main__':
     unittest.main()
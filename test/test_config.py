@@ -0,0 +1,77 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import auspex.config as config
+config.auspex_dummy_mode = True
+
+class MeasFileCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = {k: getattr(config, k) for k in ('meas_file', 'AWGDir', 'KernelDir', 'LogDir')}
+        self.dir = tempfile.mkdtemp()
+        self.meas_file = os.path.join(self.dir, "measure.yml")
+        self.instr_file = os.path.join(self.dir, "instruments.yml")
+        with open(self.meas_file, 'w') as f:
+            f.write("config:\n"
+                    "  AWGDir: {0}/awg\n"
+                    "  KernelDir: {0}/kern\n"
+                    "  LogDir: {0}/log\n"
+                    "instruments: !include instruments.yml\n".format(self.dir))
+        self.version = 0
+        self.write_instruments(-10)
+
+    def tearDown(self):
+        for k, v in self.saved.items():
+            setattr(config, k, v)
+        config.meas_file_cache.clear()
+        shutil.rmtree(self.dir)
+
+    def write_instruments(self, power):
+        with open(self.instr_file, 'w') as f:
+            f.write("Holz1:\n  type: HolzworthHS9000\n  power: {}\n".format(power))
+        # Make sure the change is visible even on coarse-grained file systems
+        self.version += 1
+        mtime = os.stat(self.meas_file).st_mtime_ns + self.version*10**9
+        os.utime(self.instr_file, ns=(mtime, mtime))
+
+    def test_cached_copies(self):
+        first = config.load_meas_file(self.meas_file)
+        cached = config.parse_meas_file(self.meas_file)
+        second = config.load_meas_file(self.meas_file)
+        self.assertTrue(config.parse_meas_file(self.meas_file) is cached)
+        self.assertEqual(first['instruments']['Holz1']['power'], -10)
+
+        # Copies are independent of each other and of the cache
+        first['instruments']['Holz1']['power'] = 0
+        self.assertEqual(second['instruments']['Holz1']['power'], -10)
+        self.assertEqual(config.load_meas_file(self.meas_file)['instruments']['Holz1']['power'], -10)
+
+    def test_include_invalidates(self):
+        config.load_meas_file(self.meas_file)
+        cached = config.parse_meas_file(self.meas_file)
+        self.write_instruments(-20)
+        self.assertFalse(config.parse_meas_file(self.meas_file) is cached)
+        self.assertEqual(config.load_meas_file(self.meas_file)['instruments']['Holz1']['power'], -20)
+
+    def test_dump_invalidates(self):
+        settings = config.load_meas_file(self.meas_file)
+        snapshot = config.meas_file_snapshot(self.meas_file)
+        self.assertTrue(config.meas_file_snapshot(self.meas_file) is snapshot)
+        self.assertTrue("power: -10" in snapshot)
+
+        settings['instruments']['Holz1']['power'] = -30
+        config.dump_meas_file(settings, self.meas_file)
+        self.assertTrue("power: -30" in config.meas_file_snapshot(self.meas_file))
+
+if __name__ == '__main__':
+    unittest.main()
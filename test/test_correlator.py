@@ -86,6 +86,31 @@ class CorrelatorExperiment(Experiment):
             await asyncio.sleep(0.002)
             logger.debug("Idx_1: %d, Idx_2: %d", self.idx_1, self.idx_2)
 
+class TripleExperiment(Experiment):
+
+    # DataStreams
+    chan1 = OutputConnector()
+    chan2 = OutputConnector()
+    chan3 = OutputConnector()
+
+    # Constants
+    samples = 100
+    vals    = 1.0 + np.random.random((3, samples))
+
+    def init_streams(self):
+        for chan in (self.chan1, self.chan2, self.chan3):
+            chan.add_axis(DataAxis("samples", list(range(self.samples))))
+
+    async def run(self):
+        idx = [0, 0, 0]
+        while min(idx) < self.samples:
+            for i, chan in enumerate((self.chan1, self.chan2, self.chan3)):
+                new = min(np.random.randint(1,5), self.samples - idx[i])
+                if new > 0:
+                    await chan.push(self.vals[i, idx[i]:idx[i]+new])
+                    idx[i] += new
+            await asyncio.sleep(0.002)
+
 class CorrelatorTestCase(unittest.TestCase):
 
     def test_correlator(self):
@@ -104,6 +129,70 @@ class CorrelatorTestCase(unittest.TestCase):
         expected_data = exp.vals*exp.vals
         self.assertTrue(np.abs(np.sum(corr_data - expected_data)) <= 1e-4)
 
+    def test_aligned_buffer(self):
+        corr = Correlator()
+        corr.sink.descriptor = DataStreamDescriptor(dtype=np.float64)
+        corr.reset_buffer(3, capacity=8)
+
+        vals    = np.random.random((3, 500))
+        written = np.zeros(3, dtype=np.int64)
+        results = []
+        while np.any(written < vals.shape[1]):
+            row = np.random.randint(3)
+            new = min(np.random.randint(1, 12), vals.shape[1] - written[row])
+            corr.append(row, vals[row, written[row]:written[row]+new])
+            written[row] += new
+            num_aligned = int(np.min(corr.write_idx)) - corr.read_idx
+            results.append(corr.reduce(corr.buffer[:, corr.read_idx:corr.read_idx+num_aligned]))
+            corr.read_idx += num_aligned
+
+        self.assertTrue(np.allclose(np.concatenate(results), np.prod(vals, axis=0)))
+
+    def run_products(self, correlations):
+        exp   = TripleExperiment()
+        corr  = Correlator(correlations=correlations)
+        buff  = DataBuffer()
+
+        edges = [(exp.chan1,   corr.sink),
+                 (exp.chan2,   corr.sink),
+                 (exp.chan3,   corr.sink),
+                 (corr.source, buff.sink)]
+
+        exp.set_graph(edges)
+        exp.run_sweeps()
+
+        axis = buff.sink.descriptor.axes[-1]
+        data = buff.get_data()['Correlator'].reshape(exp.samples, -1)
+        return exp.vals, axis, data
+
+    def test_all_pairs(self):
+        vals, axis, data = self.run_products("pairs")
+        self.assertEqual(axis.name, "correlation")
+        self.assertEqual([axis.metadata_enum[i] for i in axis.metadata], ["chan1*chan2", "chan1*chan3", "chan2*chan3"])
+        expected = np.stack([vals[0]*vals[1], vals[0]*vals[2], vals[1]*vals[2]], axis=-1)
+        self.assertTrue(np.allclose(data, expected))
+
+    def test_explicit_products(self):
+        vals, axis, data = self.run_products([("chan3", "chan1"), (0, 1, 2), (1, 2)])
+        self.assertEqual([axis.metadata_enum[i] for i in axis.metadata], ["chan1*chan3", "chan1*chan2*chan3", "chan2*chan3"])
+        expected = np.stack([vals[0]*vals[2], np.prod(vals, axis=0), vals[1]*vals[2]], axis=-1)
+        self.assertTrue(np.allclose(data, expected))
+
+    def test_units(self):
+        corr = Correlator(correlations="pairs")
+        corr.products = [(0, 1), (0, 2), (1, 2)]
+        self.assertEqual(corr.unit("V"), "V^2")
+        corr.products = [(0, 2), (0, 1, 2)]
+        self.assertEqual(corr.unit("V"), "V^2,V^3")
+
+    def test_no_products(self):
+        corr = Correlator(correlations="pairs")
+        corr.sink.input_streams = [DataStream(name="only")]
+        with self.assertRaises(ValueError):
+            corr.plan_products()
+        corr.correlations.value = []
+        with self.assertRaises(ValueError):
+            corr.plan_products()
 
 if __name__ == '__main__':
     unittest.main()
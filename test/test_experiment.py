@@ -9,6 +9,8 @@
 import unittest
 import asyncio
 import time
+import sys
+import subprocess
 import numpy as np
 
 from copy import copy, deepcopy
@@ -44,8 +46,8 @@ else:
     #
     # ----- fix/unitTests_1 (ST-15) delta Stop.
 
-from auspex.instruments.instrument import SCPIInstrument, StringCommand, FloatCommand, IntCommand
-from auspex.experiment import Experiment
+from auspex.instruments.instrument import Instrument, SCPIInstrument, StringCommand, FloatCommand, IntCommand
+from auspex.experiment import Experiment, setup_instruments
 from auspex.parameter import FloatParameter
 from auspex.stream import DataStream, DataAxis, DataStreamDescriptor, OutputConnector
 from auspex.filters import Print, Passthrough
@@ -66,6 +68,21 @@ class TestInstrument3(SCPIInstrument):
     serial_number = IntCommand(get_string="serial?")
     mode = StringCommand(scpi_string=":mode", allowed_values=["A", "B", "C"])
 
+class SlowInstrument(Instrument):
+    """Records when its connection starts and stops."""
+    def __init__(self, name, log, group=None):
+        self.name  = name
+        self.log   = log
+        self.group = group
+    def connect(self, resource_name=None):
+        self.log.append(("start", self.name))
+        time.sleep(0.1)
+        if self.name == "broken":
+            raise IOError("Could not connect")
+        self.log.append(("stop", self.name))
+    def setup_group(self):
+        return self.group or self
+
 class TestExperiment(Experiment):
 
     # Create instances of instruments
@@ -173,6 +190,21 @@ class ExperimentTestCase(unittest.TestCase):
         self.assertFalse(prnt.sink.descriptor is None)
         self.assertTrue(exp.chan1.descriptor == pt.sink.descriptor)
 
+    def test_deferred_source(self):
+        self.assertTrue(TestExperiment._exp_src is None)
+        exp = TestExperiment()
+        exp.set_graph([(exp.chan1, Print(name="One").sink)])
+        exp.update_descriptors()
+        self.assertTrue(callable(exp.chan1.descriptor.exp_src))
+        self.assertTrue("class TestExperiment" in copy(exp.chan1.descriptor)._exp_src)
+        self.assertTrue(TestExperiment._exp_src is not None)
+
+    def test_lazy_imports(self):
+        code = ("import sys, auspex.experiment; "
+                "print(' '.join(m for m in ['pandas', 'sklearn', 'networkx', 'h5py', 'visa', 'auspex.filters.singleshot'] if m in sys.modules))")
+        loaded = subprocess.check_output([sys.executable, "-c", code]).decode().split()
+        self.assertEqual(loaded, [])
+
     def test_copy_descriptor(self):
         dsd = DataStreamDescriptor()
         dsd.add_axis(DataAxis("One", [1,2,3,4]))
@@ -226,5 +258,34 @@ class ExperimentTestCase(unittest.TestCase):
         exp.set_graph(edges)
         exp.run_sweeps()
 
+class SetupInstrumentsTestCase(unittest.TestCase):
+
+    def instruments(self, *names, group=None):
+        self.log = []
+        return {n: SlowInstrument(n, self.log, group=group) for n in names}
+
+    def test_concurrent(self):
+        start = time.perf_counter()
+        timings = setup_instruments(self.instruments("a", "b", "c", "d"), lambda i: i.connect())
+        self.assertTrue(time.perf_counter() - start < 0.3)
+        self.assertEqual(set(timings.keys()), {"a", "b", "c", "d"})
+        self.assertTrue(all(t >= 0.1 for t in timings.values()))
+
+    def test_dependencies(self):
+        setup_instruments(self.instruments("master", "a", "b"), lambda i: i.connect(), {"master": ["a", "b", "absent"]})
+        self.assertTrue(self.log.index(("start", "master")) > self.log.index(("stop", "a")))
+        self.assertTrue(self.log.index(("start", "master")) > self.log.index(("stop", "b")))
+        with self.assertRaises(ValueError):
+            setup_instruments(self.instruments("a", "b"), lambda i: i.connect(), {"a": ["b"], "b": ["a"]})
+
+    def test_groups_take_turns(self):
+        setup_instruments(self.instruments("a", "b", "c", group="bus"), lambda i: i.connect())
+        self.assertEqual([e[0] for e in self.log], ["start", "stop"]*3)
+
+    def test_errors(self):
+        with self.assertRaises(IOError):
+            setup_instruments(self.instruments("a", "broken"), lambda i: i.connect())
+        self.assertTrue(("stop", "a") in self.log)
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,6 +7,8 @@
 #    http://www.apache.org/licenses/LICENSE-2.0
 
 import unittest
+import asyncio
+import threading
 
 _bNO_METACLASS_INTROSPECTION_CONSTRAINTS = True  # Use original dummy flag logic
 #_bNO_METACLASS_INTROSPECTION_CONSTRAINTS = False # Enable instrument and filter introspection constraints
@@ -41,11 +43,13 @@ else:
 
 
 from auspex.instruments.instrument import SCPIInstrument, StringCommand, FloatCommand, IntCommand
+from auspex.parameter import FloatParameter
 
 class TestInstrument(SCPIInstrument):
 	frequency     = FloatCommand(get_string="frequency?", set_string="frequency {:g}", value_range=(0.1, 10))
 	serial_number = IntCommand(get_string="serial?")
 	mode          = StringCommand(name="enumerated mode", scpi_string=":mode", allowed_values=["A", "B", "C"])
+	slow          = FloatCommand(scpi_string="slow", set_delay=0.2)
 
 class InstrumentTestCase(unittest.TestCase):
 	"""
@@ -89,5 +93,115 @@ class InstrumentTestCase(unittest.TestCase):
 		with self.assertRaises(TypeError):
 			self.instrument.nonexistent_property = 16
 
+	def record_writes(self):
+		writes = []
+		write = self.instrument.interface.write
+		def recorded(command):
+			writes.append(command)
+			write(command)
+		self.instrument.interface.write = recorded
+		return writes
+
+	def test_settings_cache(self):
+		"""Check that settings the instrument already holds are not written again."""
+		self.instrument = TestInstrument("DUMMY::RESOURCE")
+		self.instrument.connect()
+		writes = self.record_writes()
+		self.instrument.frequency = 5
+		self.instrument.frequency = 5
+		self.instrument.mode = "A"
+		self.instrument.mode = "A"
+		self.instrument.mode = "B"
+		self.assertEqual(writes, ["frequency 5", ":mode A", ":mode B"])
+
+		# Raw writes that change a setting are noticed, those that repeat it change nothing
+		self.instrument.interface.write("FREQ 6")
+		self.instrument.frequency = 5
+		self.instrument.interface.write(":MODE C;:mode B")
+		self.instrument.mode = "B"
+		self.assertEqual(writes[-3:], ["FREQ 6", "frequency 5", ":MODE C;:mode B"])
+		self.instrument.interface.write(":SOUR:FREQ 6")
+		self.instrument.frequency = 5
+		self.assertEqual(writes[-2:], [":SOUR:FREQ 6", "frequency 5"])
+
+		# Resets, explicit invalidation and reconnecting all start afresh
+		self.instrument.interface.write("*RST")
+		self.instrument.frequency = 5
+		self.instrument.invalidate_settings()
+		self.instrument.frequency = 5
+		self.assertEqual(writes[-3:], ["*RST", "frequency 5", "frequency 5"])
+		self.instrument.connect()
+		writes = self.record_writes()
+		self.instrument.frequency = 5
+		self.assertEqual(writes, ["frequency 5"])
+
+	def test_batch(self):
+		"""Check that batched settings and queries are sent as compound messages."""
+		self.instrument = TestInstrument("DUMMY::RESOURCE")
+		self.instrument.connect()
+		writes = self.record_writes()
+		queries = []
+		def query(message):
+			queries.append(message)
+			return "5;A"
+		self.instrument.interface.query = query
+
+		with self.instrument.batch(max_length=30):
+			self.instrument.frequency = 5
+			self.instrument.mode = "A"
+			self.instrument.set_all({"frequency": 6, "mode": "B"})
+			self.assertEqual(writes, ["frequency 5;:mode A"])
+		self.assertEqual(writes, ["frequency 5;:mode A", "frequency 6;:mode B"])
+
+		with self.instrument.batch(max_length=30):
+			frequency = self.instrument.queue("frequency")
+			mode = self.instrument.queue("mode")
+			with self.assertRaises(RuntimeError):
+				frequency.value
+		self.assertEqual(queries, ["frequency?;:mode?"])
+		self.assertEqual((frequency.value, mode.value), (5.0, "A"))
+
+		# Without room for compound messages everything goes out as before
+		with self.instrument.batch():
+			self.instrument.frequency = 7
+			self.assertEqual(writes[-1], "frequency 7")
+
+		# Settings that never made it to the instrument are not taken as held
+		def broken(message):
+			raise IOError("Connection lost")
+		self.instrument.interface.write = broken
+		with self.assertRaises(IOError):
+			with self.instrument.batch(max_length=30):
+				self.instrument.frequency = 8
+				self.instrument.mode = "C"
+		self.assertEqual(self.instrument.interface.settings_cache, {})
+
+	def test_async(self):
+		"""Check that awaited settings and pushes leave the event loop free."""
+		self.instrument = TestInstrument("DUMMY::RESOURCE")
+		self.instrument.connect()
+		param = FloatParameter(name="Slow")
+		param.assign_method(self.instrument.set_slow)
+		threads = []
+		param.add_post_push_hook(lambda: threads.append(threading.current_thread()))
+
+		ticks = []
+		async def tick():
+			while True:
+				ticks.append(None)
+				await asyncio.sleep(0.01)
+		async def push():
+			ticker = asyncio.ensure_future(tick())
+			await self.instrument.set_async("slow", 1)
+			param.value = 2
+			await param.push_async()
+			ticker.cancel()
+		asyncio.get_event_loop().run_until_complete(push())
+
+		self.assertTrue(len(ticks) > 20)
+		self.assertFalse(threads[0] is threading.main_thread())
+		self.assertEqual(self.instrument.interface.settings_cache[("slow",)], "slow 2.000000E+00")
+		self.instrument.disconnect()
+
 if __name__ == '__main__':
 	unittest.main()
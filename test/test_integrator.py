@@ -0,0 +1,115 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+import unittest
+import asyncio
+import numpy as np
+
+import auspex.config as config
+config.auspex_dummy_mode = True
+
+from auspex.experiment import Experiment
+from auspex.stream import DataAxis, OutputConnector
+from auspex.filters.integrator import KernelIntegrator
+from auspex.filters.io import DataBuffer
+from auspex.log import logger
+
+class RecordExperiment(Experiment):
+
+    # DataStreams
+    chan1 = OutputConnector()
+
+    # Constants
+    record_length = 16
+    num_records   = 10
+    chunked       = False
+
+    # Records to integrate
+    vals = np.random.random(record_length*num_records) + 1j*np.random.random(record_length*num_records)
+
+    def init_streams(self):
+        self.chan1.add_axis(DataAxis("time", 1e-9*np.arange(self.record_length)))
+        self.chan1.add_axis(DataAxis("records", list(range(self.num_records))), position=0)
+        self.chan1.descriptor.dtype = np.complex128
+
+    async def run(self):
+        logger.debug("Data taker running (inner loop)")
+        await asyncio.sleep(0.002)
+        if not self.chunked:
+            await self.chan1.push(self.vals)
+            return
+        idx = 0
+        while idx < self.vals.size:
+            # Push chunks that do not line up with record boundaries
+            new = np.random.randint(1, 2*self.record_length)
+            await self.chan1.push(self.vals[idx:idx+new])
+            idx += new
+            await asyncio.sleep(0.002)
+
+class IntegratorTestCase(unittest.TestCase):
+
+    def test_single_kernel(self):
+        exp    = RecordExperiment()
+        kernel = np.random.random(exp.record_length)
+        integ  = KernelIntegrator(kernel=kernel, simple_kernel=False)
+        buff   = DataBuffer()
+
+        edges = [(exp.chan1, integ.sink), (integ.source, buff.sink)]
+        exp.set_graph(edges)
+        exp.run_sweeps()
+
+        expected = np.inner(exp.vals.reshape(exp.num_records, exp.record_length), kernel)
+        self.assertTrue(np.allclose(buff.get_data()['Data'], expected))
+
+    def test_multiple_kernels(self):
+        exp     = RecordExperiment()
+        kernels = [np.ones(exp.record_length), np.arange(exp.record_length), np.ones(4)]
+        integ   = KernelIntegrator(kernel=kernels, simple_kernel=False)
+        buff    = DataBuffer()
+
+        edges = [(exp.chan1, integ.sink), (integ.source, buff.sink)]
+        exp.set_graph(edges)
+        exp.run_sweeps()
+
+        self.assertEqual(buff.sink.descriptor.axes[-1].name, "kernel")
+        records  = exp.vals.reshape(exp.num_records, exp.record_length)
+        expected = np.stack([records.sum(axis=1), records.dot(np.arange(exp.record_length)), records[:,:4].sum(axis=1)], axis=1)
+        data     = buff.get_data()
+        self.assertTrue(np.allclose(data['Data'].reshape(exp.num_records, 3), expected))
+        self.assertTrue(np.all(data['kernel'].reshape(exp.num_records, 3) == [0, 1, 2]))
+
+    def test_box_car_windows(self):
+        exp   = RecordExperiment()
+        integ = KernelIntegrator(box_car_start=[0, 4.5e-9], box_car_stop=[3.5e-9, 7.5e-9])
+        buff  = DataBuffer()
+
+        edges = [(exp.chan1, integ.sink), (integ.source, buff.sink)]
+        exp.set_graph(edges)
+        exp.run_sweeps()
+
+        records  = exp.vals.reshape(exp.num_records, exp.record_length)
+        expected = np.stack([records[:,0:4].sum(axis=1), records[:,4:8].sum(axis=1)], axis=1)
+        self.assertTrue(np.allclose(buff.get_data()['Data'].reshape(exp.num_records, 2), expected))
+
+    def test_partial_records(self):
+        exp     = RecordExperiment()
+        exp.chunked = True
+        kernels = [np.ones(exp.record_length), np.arange(exp.record_length)]
+        integ   = KernelIntegrator(kernel=kernels, simple_kernel=False)
+        buff    = DataBuffer()
+
+        edges = [(exp.chan1, integ.sink), (integ.source, buff.sink)]
+        exp.set_graph(edges)
+        exp.run_sweeps()
+
+        records  = exp.vals.reshape(exp.num_records, exp.record_length)
+        expected = np.stack([records.sum(axis=1), records.dot(np.arange(exp.record_length))], axis=1)
+        self.assertTrue(np.allclose(buff.get_data()['Data'].reshape(exp.num_records, 2), expected))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+import unittest
+import json
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import zmq
+
+import auspex.config as config
+config.auspex_dummy_mode = True
+
+from auspex.filters.plot import decimate_trace, decimate_image
+from auspex.plotting import MatplotServerThread
+
+class DecimationTestCase(unittest.TestCase):
+
+    def test_trace_envelope(self):
+        x = np.arange(100000)
+        y = np.sin(2*np.pi*x/5000.0) + 0.1*np.random.randn(x.size)
+        y[90000:] = np.nan # Not yet acquired
+        xd, yd = decimate_trace(x, y, 1000)
+
+        self.assertTrue(xd.size <= 2000)
+        self.assertTrue(np.all(np.diff(xd) >= 0))
+        self.assertTrue(np.allclose(yd, y[xd], equal_nan=True))
+        self.assertEqual(np.nanmax(yd), np.nanmax(y))
+        self.assertEqual(np.nanmin(yd), np.nanmin(y))
+
+        # Complex traces keep the extrema of both quadratures
+        z = y*np.exp(1j*x/1000.0)
+        xd, zd = decimate_trace(x, z, 1000)
+        self.assertTrue(xd.size <= 4000)
+        self.assertEqual(np.nanmax(zd.imag), np.nanmax(z.imag))
+
+        # Short traces are passed through
+        xd, yd = decimate_trace(x[:100], y[:100], 1000)
+        self.assertTrue(np.all(yd == y[:100]))
+
+    def test_image_blocks(self):
+        x  = np.linspace(0, 1, 3000)
+        y  = np.linspace(0, 1, 50)
+        im = np.outer(np.ones(y.size), np.arange(x.size)).astype(np.complex128).flatten()
+        im[-x.size//2:] = np.nan
+        xd, yd, imd = decimate_image(x, y, im, (1000, 1000))
+
+        self.assertEqual((xd.size, yd.size, imd.size), (1000, 50, 50000))
+        imd = imd.reshape(yd.size, xd.size)
+        self.assertTrue(np.allclose(imd[0], np.arange(1, 3000, 3)))
+        self.assertTrue(np.all(np.isnan(imd[-1, 500:])))
+
+class PlotServerTestCase(unittest.TestCase):
+
+    def receive(self, socket):
+        messages = []
+        while socket.poll(500):
+            msg = socket.recv_multipart()
+            arrays = [(json.loads(md.decode()), np.frombuffer(data, dtype=json.loads(md.decode())['dtype'])) for md, data in zip(msg[2::2], msg[3::2])]
+            messages.append((msg[0].decode(), msg[1].decode(), arrays))
+        return messages
+
+    def test_coalesce_and_delta(self):
+        server  = MatplotServerThread({}, status_port=17771, data_port=17772)
+        context = zmq.Context()
+        socket  = context.socket(zmq.SUB)
+        socket.connect("tcp://localhost:17772")
+        socket.setsockopt_string(zmq.SUBSCRIBE, "")
+        time.sleep(0.5)
+
+        try:
+            x = np.arange(1000.0)
+            y = np.full(1000, np.nan)
+            y[:100] = 1.0
+            server.send("trace", x, y.copy())
+            messages = self.receive(socket)
+            self.assertEqual([m[0] for m in messages], ["data"])
+
+            # Only the changed slice goes out once the client has the frame
+            y[100:120] = 2.0
+            server.send("trace", x, y.copy())
+            messages = self.receive(socket)
+            self.assertEqual([m[0] for m in messages], ["delta"])
+            (md_x, dat_x), (md_y, dat_y) = messages[0][2]
+            self.assertEqual(dat_x.size, 0)
+            self.assertEqual((md_y['start'], md_y['stop']), (100, 120))
+            self.assertTrue(np.all(dat_y == 2.0))
+
+            # A burst of frames is coalesced, and the deltas still add up to the latest frame
+            frame = y.copy()
+            for i in range(200):
+                y[120+i] = 3.0
+                server.send("trace", x, y.copy())
+            messages = self.receive(socket)
+            self.assertTrue(0 < len(messages) < 200)
+            for msg_type, name, arrays in messages:
+                md, dat = arrays[1]
+                if msg_type == "data":
+                    frame = dat.copy()
+                else:
+                    frame[md['start']:md['stop']] = dat
+            self.assertTrue(np.allclose(frame, y, equal_nan=True))
+        finally:
+            server.stop()
+            socket.close()
+            context.term()
+
+    def test_shared_ring(self):
+        server  = MatplotServerThread({"trace": {}}, status_port=17773, data_port=17774)
+        context = zmq.Context()
+        status  = context.socket(zmq.DEALER)
+        status.connect("tcp://localhost:17773")
+        socket  = context.socket(zmq.SUB)
+        socket.connect("tcp://localhost:17774")
+        socket.setsockopt_string(zmq.SUBSCRIBE, "")
+
+        try:
+            status.send_multipart([b"WHATSUP", json.dumps({'size': [640, 480], 'host': platform.node()}).encode()])
+            self.assertTrue(status.poll(2000))
+            reply, desc, transport = [json.loads(m.decode()) if i else m for i, m in enumerate(status.recv_multipart())]
+            self.assertEqual(server.canvas_size, (640, 480))
+            self.assertTrue('shm' in transport)
+            time.sleep(0.5)
+
+            ring = np.memmap(transport['shm'], dtype=np.uint8, mode='r')
+            for i in range(3):
+                x = np.arange(1000.0)
+                y = np.random.random(1000) + 1j*np.random.random(1000)
+                server.keyframe_interval = 1
+                server.send("trace", x, y)
+                messages = self.receive(socket)
+                self.assertEqual(len(messages), 1)
+                for (md, dat), expected in zip(messages[0][2], (x, y)):
+                    self.assertEqual(dat.size, 0)
+                    offset = 64 + md['position'] % transport['capacity']
+                    self.assertTrue(np.all(np.frombuffer(ring, dtype=md['dtype'], count=md['count'], offset=offset) == expected))
+        finally:
+            server.stop()
+            status.close()
+            socket.close()
+            context.term()
+
+    def test_client_handshake(self):
+        server  = MatplotServerThread({}, status_port=17775, data_port=17776)
+        context = zmq.Context()
+        try:
+            # A client that died never shows up
+            process = subprocess.Popen([sys.executable, "-c", "pass"])
+            process.wait()
+            start = time.time()
+            self.assertFalse(server.wait_for_client(timeout=5.0, process=process))
+            self.assertTrue(time.time() - start < 1.0)
+
+            socket = context.socket(zmq.SUB)
+            socket.connect("tcp://localhost:17776")
+            socket.setsockopt_string(zmq.SUBSCRIBE, "data")
+            self.assertTrue(server.wait_for_client(timeout=5.0))
+            socket.close()
+        finally:
+            server.stop()
+            context.term()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# Copyright 2017 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+import unittest
+import socket
+import threading
+import numpy as np
+
+import auspex.config as config
+config.auspex_dummy_mode = True
+
+from auspex.instruments.prologix import PrologixSocketResource, PrologixController
+
+class FakePrologix(object):
+    """Answers like a Prologix with a few GPIB instruments behind it, replying to queries
+    in small pieces to exercise the buffered reads."""
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(4)
+        self.port = self.server.getsockname()[1]
+        self.connections = 0
+        self.commands = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        addr, data = None, b""
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return
+            data += chunk
+            while b"\n" in data:
+                line, data = data.split(b"\n", 1)
+                line = line.strip().decode()
+                self.commands.append(line)
+                if line == "++ver":
+                    conn.sendall(b"Prologix GPIB-ETHERNET Controller version 01.06.06.00\r\n")
+                elif line.startswith("++addr"):
+                    addr = int(line.split()[1])
+                elif line == "CURV?":
+                    conn.sendall(b"#216" + np.arange(4, dtype=np.float32).tobytes() + b"\n")
+                elif line.endswith("?") and addr != 9: # Nothing at address 9
+                    reply = "{}:{}\r\n".format(addr, line).encode()
+                    for i in range(0, len(reply), 3):
+                        conn.sendall(reply[i:i+3])
+
+    def close(self):
+        self.server.close()
+
+class PrologixTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.prologix = FakePrologix()
+
+    def tearDown(self):
+        self.prologix.close()
+
+    def resource(self, gpib):
+        resource = PrologixSocketResource(ipaddr="127.0.0.1", gpib=gpib)
+        resource.connect(port=self.prologix.port)
+        return resource
+
+    def test_shared_connection(self):
+        """Check that instruments on one controller share a socket and only switch address when needed."""
+        first, second = self.resource(1), self.resource(2)
+        self.assertTrue(first.controller is second.controller)
+        self.assertEqual(self.prologix.connections, 1)
+
+        self.assertEqual(first.query("FREQ?"), "1:FREQ?")
+        self.assertEqual(first.query("POW?"), "1:POW?")
+        self.assertEqual(second.query("FREQ?"), "2:FREQ?")
+        first.write("FREQ 1")
+        first.write("POW 2")
+        self.assertEqual(first.query("POW?"), "1:POW?")
+        addrs = [c for c in self.prologix.commands if c.startswith("++addr")]
+        self.assertEqual(addrs, ["++addr 1", "++addr 2", "++addr 1", "++addr 2", "++addr 1"])
+
+        np.testing.assert_array_equal(second.query_binary_values("CURV?"), np.arange(4))
+        self.assertEqual(second.query("FREQ?"), "2:FREQ?")
+
+        first.close()
+        self.assertEqual(second.query("POW?"), "2:POW?")
+        second.close()
+        self.assertFalse(("127.0.0.1", self.prologix.port) in PrologixController._controllers)
+
+    def test_failed_connect(self):
+        """Check that a failed connection gives back its share of the controller, and that
+        timeouts only apply to their own instrument."""
+        first  = self.resource(1)
+        absent = PrologixSocketResource(ipaddr="127.0.0.1", gpib=9)
+        absent.timeout = 0.2
+        with self.assertRaises(socket.timeout):
+            absent.connect(port=self.prologix.port)
+        self.assertTrue(absent.controller is None)
+        self.assertEqual(first.controller.users, 1)
+
+        self.assertEqual(first.query("FREQ?"), "1:FREQ?")
+        self.assertEqual(first.controller.sock.gettimeout(), first.timeout)
+        first.close()
+        self.assertFalse(("127.0.0.1", self.prologix.port) in PrologixController._controllers)
+
+if __name__ == '__main__':
+    unittest.main()
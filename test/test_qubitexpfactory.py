@@ -1,5 +1,6 @@
 import unittest
 import os
+import json
 import asyncio
 import time
 import numpy as np
@@ -102,6 +103,37 @@ class QubitExpFactoryTestCase(unittest.TestCase):
         self.assertTrue((ax.points == np.linspace(-1,1,21)).all())
         self.assertTrue(ax.name == 'amplitude')
 
+    def write_meta_file(self, name, num_segments, instruments=('BBNAPS1', 'BBNAPS2')):
+        meta_info = {"instruments": {instr: os.path.join(awg_dir, "{}-{}.aps2".format(name, instr)) for instr in instruments},
+                     "receivers": {"RecvChan-q1-IntegratedSS": num_segments},
+                     "axis_descriptor": [{"name": "amplitude", "unit": None, "points": list(range(num_segments)), "partition": 1}]}
+        meta_file = os.path.join(awg_dir, name + "-meta.json")
+        with open(meta_file, 'w') as f:
+            json.dump(meta_info, f)
+        return meta_file
+
+    def test_rearm(self):
+        exp = QubitExpFactory.create(meta_file=self.write_meta_file("first", 4), calibration=True, save_data=False, reusable=True)
+        exp.run_sweeps()
+        self.assertTrue(len(exp.buffers[0].get_data()) == 4)
+        self.assertTrue(exp.instrs_connected)
+
+        filters = exp.filters
+        exp.rearm(self.write_meta_file("second", 6))
+        self.assertTrue(exp.filters is filters)
+        self.assertTrue(exp.settings['instruments']['X6-1']['nbr_segments'] == 6)
+        self.assertTrue(exp.settings['instruments']['BBNAPS1']['seq_file'].endswith("second-BBNAPS1.aps2"))
+        exp.run_sweeps()
+        self.assertTrue(len(exp.buffers[0].get_data()) == 6)
+
+        # A different set of instruments needs a new experiment
+        with self.assertRaises(ValueError):
+            exp.rearm(self.write_meta_file("third", 6, instruments=['BBNAPS1']))
+        self.assertTrue(exp.settings['instruments']['X6-1']['nbr_segments'] == 6)
+
+        exp.teardown()
+        self.assertFalse(exp.instrs_connected)
+
     # Figure out how to buffer a partial average for testing...
     @unittest.skip("Partial average for buffers to be fixed")
     def test_final_vs_partial_avg(self):
@@ -0,0 +1,74 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+import auspex.config as config
+config.auspex_dummy_mode = True
+
+import auspex.filters
+import auspex.instruments
+from auspex.registry import LazyRegistry
+from auspex.filters.filter import Filter
+from auspex.instruments.instrument import Instrument
+
+class RegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        config.RegistryCacheDir = None
+        shutil.rmtree(self.cache_dir)
+
+    def test_lazy_exports(self):
+        registry = auspex.filters.registry
+        self.assertEqual(registry.exports['Averager'], 'auspex.filters.average')
+        self.assertTrue('Averager' in auspex.filters.__all__)
+        self.assertTrue('Averager' in dir(auspex.filters))
+        self.assertTrue(auspex.filters.Averager is auspex.filters.average.Averager)
+        with self.assertRaises(AttributeError):
+            auspex.filters.NotAFilter
+
+    def test_find_class(self):
+        registry = auspex.filters.registry
+        self.assertTrue(registry.find_class('Averager', Filter) is auspex.filters.Averager)
+        self.assertTrue(registry.find_class('Averager', Instrument) is None)
+        self.assertTrue(registry.find_class('NotAFilter', Filter) is None)
+        # Classes left out of __all__ are still found
+        self.assertEqual(auspex.instruments.registry.classes['HallProbe'], 'auspex.instruments.hall_probe')
+
+    def test_disk_cache(self):
+        config.RegistryCacheDir = self.cache_dir
+        registry = LazyRegistry(auspex.filters.__name__, auspex.filters.__path__)
+        self.assertEqual(registry.exports, auspex.filters.registry.exports)
+        cache_file = registry.cache_file()
+        self.assertTrue(os.path.exists(cache_file))
+
+        # A matching cache is used as is
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+        cached['exports']['Cached'] = 'auspex.filters.average'
+        with open(cache_file, 'w') as f:
+            json.dump(cached, f)
+        registry = LazyRegistry(auspex.filters.__name__, auspex.filters.__path__)
+        self.assertTrue('Cached' in registry.exports)
+
+        # A stale one is rebuilt
+        cached['key'][0][1] -= 1.0
+        with open(cache_file, 'w') as f:
+            json.dump(cached, f)
+        registry = LazyRegistry(auspex.filters.__name__, auspex.filters.__path__)
+        self.assertFalse('Cached' in registry.exports)
+
+if __name__ == '__main__':
+    unittest.main()
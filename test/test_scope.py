@@ -0,0 +1,106 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+import unittest
+import struct
+import numpy as np
+
+import auspex.config as config
+config.auspex_dummy_mode = True
+
+from auspex.instruments.interface import Interface
+from auspex.instruments.lecroy import HDO6104
+from auspex.instruments.scope import Waveform, WaveformBuffers, read_response_units
+from auspex.instruments.simulated_scope import SimulatedScope
+
+class LeCroyInterface(Interface):
+    """Returns a WF? ALL block for a ramp of 16 bit samples."""
+    def query_binary_values(self, query_string, datatype='B', container=np.array, **kwargs):
+        samples = np.arange(-5, 5, dtype='>i2')
+        desc = bytearray(346)
+        desc[0:8] = b"WAVEDESC"
+        struct.pack_into(">7l", desc, 36, 346, 0, 0, 0, 0, 0, samples.nbytes)
+        struct.pack_into(">l", desc, 116, len(samples))
+        struct.pack_into(">2f", desc, 156, 0.5, 1.0)
+        struct.pack_into(">fd", desc, 176, 1e-9, -2e-9)
+        return np.frombuffer(bytes(desc) + samples.tobytes(), dtype=np.uint8)
+
+class ScopeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.scope = SimulatedScope(record_length=1000)
+        self.scope.connect()
+        self.writes = []
+        write = self.scope.interface.write
+        def recorded(message):
+            self.writes.append(message)
+            write(message)
+        self.scope.interface.write = recorded
+
+    def test_response_units(self):
+        data = b"1.0E-2;abc;#14\x01\x02\n\x04;#10;7\n"
+        reader = iter(data[i:i+1] for i in range(len(data)))
+        units = read_response_units(lambda n: b"".join(next(reader) for i in range(n)), 5)
+        self.assertEqual(units, ["1.0E-2", "abc", b"\x01\x02\n\x04", b"", "7"])
+
+    def test_fetch(self):
+        """Check that several channels come back from one message, into buffers of the caller's if asked."""
+        first, second = self.scope.fetch_waveforms([1, 2])
+        self.assertEqual(self.scope.sample_bytes, 1)
+        self.assertEqual(len(self.writes), 2) # Negotiating the format, then the fetch
+        self.assertEqual(first.raw.dtype, np.int8)
+        self.assertEqual(len(first.raw), 1000)
+        self.assertTrue(0.9 < first.volts.max() < 1.3)
+        self.assertAlmostEqual(second.time[1] - second.time[0], 1e-10)
+
+        # The settings are already held, and each fetch has its own samples
+        raw = first.raw
+        first, second = self.scope.fetch_waveforms([1, 2])
+        self.assertFalse("ENC" in self.writes[-1])
+        self.assertFalse(np.shares_memory(raw, first.raw))
+
+        buffers = WaveformBuffers()
+        raw = self.scope.fetch_waveforms([1, 2], out=buffers)[0].raw
+        self.assertTrue(np.shares_memory(raw, self.scope.fetch_waveforms([1, 2], out=buffers)[0].raw))
+        out = [np.empty(1000, dtype=np.int16), np.empty(1000, dtype=np.int16)]
+        first, second = self.scope.fetch_waveforms([1, 2], out=out)
+        self.assertTrue(first.raw.base is out[0])
+
+        # Averaging needs more than a byte per sample, which the next fetch notices
+        self.scope.acquire_mode = "AVE"
+        time, volts = self.scope.get_trace
+        self.assertEqual(self.scope.sample_bytes, 2)
+        self.assertEqual(self.scope.get_trace.raw.dtype, np.int16)
+        self.assertTrue(0.9 < volts.max() < 1.3)
+
+    def test_fastaq_curve(self):
+        scope = SimulatedScope(record_length=252000)
+        scope.connect()
+        curve = scope.get_fastaq_curve(2)
+        self.assertEqual(curve.shape, (1000, 252))
+        self.assertEqual(curve.dtype, np.uint64)
+        out = np.empty((1000, 252), dtype=np.uint64)
+        self.assertTrue(np.shares_memory(scope.get_fastaq_curve(2, out=out), out))
+
+    def test_waveform(self):
+        waveform = Waveform(np.array([0, 10, 20], dtype=np.int8), y_scale=0.5, y_offset=10, y_zero=1.0)
+        self.assertTrue(waveform._volts is None)
+        np.testing.assert_allclose(waveform.volts, [-4.0, 1.0, 6.0])
+        out = np.empty(3, dtype=np.float32)
+        self.assertTrue(waveform.scaled(out) is out)
+
+    def test_lecroy(self):
+        scope = HDO6104()
+        scope.interface = LeCroyInterface()
+        time, volts = scope.fetch_waveform(1)
+        np.testing.assert_allclose(volts, np.arange(-5, 5)*0.5 - 1.0)
+        self.assertAlmostEqual(time[1] - time[0], 1e-9)
+        self.assertAlmostEqual(time[0], -2e-9)
+
+if __name__ == '__main__':
+    unittest.main()
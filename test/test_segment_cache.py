@@ -0,0 +1,109 @@
+# Copyright 2016 Raytheon BBN Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+import unittest
+import numpy as np
+
+import auspex.config as config
+config.auspex_dummy_mode = True
+
+from auspex.instruments.interface import Interface
+from auspex.instruments.keysight import KeysightM8190A
+from auspex.instruments.tektronix import TekAWG5014
+from auspex.instruments.segment_cache import SegmentCache
+
+class SegmentInterface(Interface):
+    """Hands out new segment IDs and records everything sent."""
+    def __init__(self):
+        super(SegmentInterface, self).__init__()
+        self.messages = []
+        self.segment  = 0
+    def write(self, value):
+        self.check_reset(value)
+        self.messages.append(value)
+    def query(self, value):
+        self.messages.append(value)
+        self.segment += 1
+        return str(self.segment)
+    def write_binary_values(self, query_string, values, **kwargs):
+        self.messages.append(query_string)
+
+class SegmentCacheTestCase(unittest.TestCase):
+
+    def test_lru(self):
+        cache = SegmentCache(capacity=300, max_segments=3)
+        waveforms = [np.full(100, i, dtype=np.int16) for i in range(4)]
+        for i, wf in enumerate(waveforms[:3]):
+            self.assertEqual(cache.make_room(len(wf)), [])
+            cache.add(cache.key(wf), i, len(wf))
+
+        # Same contents, same key, and the lookup marks it as recently used
+        self.assertEqual(cache.lookup(cache.key(waveforms[0].copy())), 0)
+        self.assertTrue(cache.lookup(cache.key(waveforms[0].astype(np.int32))) is None)
+        self.assertEqual(cache.make_room(100), [1])
+        cache.add(cache.key(waveforms[3]), 3, 100)
+        self.assertEqual(cache.used, 300)
+        self.assertEqual(cache.make_room(250), [2, 0, 3])
+
+        with self.assertRaises(ValueError):
+            cache.make_room(301)
+
+    def test_keysight(self):
+        """Check that known waveforms are used by segment instead of being uploaded again."""
+        awg = KeysightM8190A("DUMMY")
+        awg.interface = SegmentInterface()
+        first  = KeysightM8190A.create_binary_wf_data(np.linspace(0, 0.5, 320))
+        second = KeysightM8190A.create_binary_wf_data(np.linspace(0, -0.5, 320))
+
+        self.assertEqual(awg.cached_waveform(first), 1)
+        self.assertEqual(awg.cached_waveform(second), 2)
+        uploads = len(awg.interface.messages)
+        self.assertEqual(awg.cached_waveform(first.copy()), 1)
+        self.assertEqual(len(awg.interface.messages), uploads)
+
+        awg.use_waveform(second)
+        self.assertEqual(awg.interface.messages[-2:], [":TRAC1:SEL 2", ":INIT:IMM1"])
+
+        # Segments that change behind the cache's back are forgotten
+        awg.upload_waveform(second, 1)
+        self.assertEqual(awg.cached_waveform(first), 3)
+        awg.delete_all_waveforms()
+        self.assertEqual(len(awg.segment_cache(1)), 0)
+
+        # Running out of memory deletes the least recently used segments
+        awg.segment_cache(1).capacity = 640
+        awg.cached_waveform(first)
+        awg.cached_waveform(second)
+        awg.cached_waveform(first)
+        awg.cached_waveform(np.zeros(320, dtype=np.int16))
+        self.assertTrue(":TRAC1:DEL 5" in awg.interface.messages)
+
+        # As are all of them after a reset
+        awg.interface.write("*RST")
+        self.assertEqual(len(awg.segment_cache(1)), 0)
+        uploads = len(awg.interface.messages)
+        awg.cached_waveform(first)
+        self.assertTrue(len(awg.interface.messages) > uploads)
+
+    def test_tektronix(self):
+        """Check that waveforms new to the cache are loaded without deleting them first."""
+        awg = TekAWG5014("DUMMY")
+        awg.interface = SegmentInterface()
+        points = np.arange(100, dtype=np.uint16)
+        name = awg.cached_waveform(points)
+        self.assertEqual(awg.cached_waveform(points.copy()), name)
+        self.assertEqual([m.split(" ")[0] for m in awg.interface.messages], ["WLIST:WAVEFORM:NEW", "WLIST:WAVEFORM:DATA"])
+
+        # The waveform list is cleared by a reset, so the waveform is loaded again
+        awg.interface.forget_state()
+        self.assertEqual(len(awg.segment_cache), 0)
+        self.assertEqual(awg.cached_waveform(points), name)
+        self.assertEqual(len(awg.interface.messages), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+import unittest
+import asyncio
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -34,6 +36,9 @@ else:
     # ----- fix/unitTests_1 (ST-15) delta Stop.
 
 from auspex.filters import SingleShotMeasurement as SSM
+from auspex.filters.singleshot import RunningMoments, row_histograms, kernel_density, IncrementalStateClassifier
+from scipy.stats import gaussian_kde
+from auspex.stream import DataStreamDescriptor, DataAxis
 
 def generate_fake_data(alpha, phi, sigma, N = 5000, plot=False):
 
@@ -69,6 +74,117 @@ def generate_fake_data(alpha, phi, sigma, N = 5000, plot=False):
         plt.show()
     return gnd, ex
 
+def streaming_filter(gnd, ex, max_shots=0, **kwargs):
+    """Feed interleaved ground and excited shots through a streaming filter in uneven chunks."""
+    N_samples, N = gnd.shape
+    descriptor = DataStreamDescriptor(dtype=np.complex128)
+    descriptor.add_axis(DataAxis("segment", list(range(2*N))))
+    descriptor.add_axis(DataAxis("time", np.arange(N_samples)), position=1)
+
+    ss = SSM(streaming=True, max_shots=max_shots, **kwargs)
+    ss.sink.descriptor = descriptor
+    ss.sink.input_streams = [None]
+    ss.update_descriptors()
+    ss.final_init()
+
+    shots = np.empty((2*N, N_samples), dtype=np.complex128)
+    shots[::2] = gnd.T
+    shots[1::2] = ex.T
+    shots = shots.ravel()
+    loop = asyncio.get_event_loop()
+    idx = 0
+    while idx < shots.size:
+        new = np.random.randint(1, 8)*N_samples
+        loop.run_until_complete(ss.process_data(shots[idx:idx+new]))
+        idx += new
+    return ss
+
+class SingleShotStreamingTestCase(unittest.TestCase):
+
+    def test_running_moments(self):
+        gnd, ex = generate_fake_data(3, np.pi/5, 1.6, N=500)
+        moments = RunningMoments(gnd.shape[0])
+        for chunk in np.array_split(gnd.T, 7):
+            moments.update(chunk)
+        self.assertTrue(np.allclose(moments.mean, np.mean(gnd, axis=1)))
+        self.assertTrue(np.allclose(moments.variance(), np.var(gnd, ddof=1, axis=1)))
+        self.assertTrue(np.allclose(moments.covariance(), [np.cov(g.real, g.imag)[0,1] for g in gnd]))
+
+    def test_streaming_matches_batch(self):
+        gnd, ex = generate_fake_data(3, np.pi/5, 1.6, N=1000)
+        ss = streaming_filter(gnd, ex)
+        batch = SSM()
+        batch.ground_data = gnd
+        batch.excited_data = ex
+        batch.compute_filter()
+        self.assertTrue(np.allclose(ss.kernel, batch.kernel))
+        self.assertAlmostEqual(ss.fidelity_result, batch.fidelity_result)
+
+    def test_streaming_reservoir(self):
+        gnd, ex = generate_fake_data(3, np.pi/5, 1.6, N=1000)
+        ss = streaming_filter(gnd, ex, max_shots=200)
+        self.assertEqual(ss.ground_data.shape, (gnd.shape[0], 200))
+        self.assertTrue(np.abs(ss.fidelity_result.real - 0.96) < 0.05)
+
+class SingleShotFidelityCurveTestCase(unittest.TestCase):
+
+    def test_row_histograms(self):
+        data = np.cumsum(np.random.randn(50, 2000), axis=0)
+        data[:3] = 0.0
+        mins, maxes = np.amin(data, axis=1), np.amax(data, axis=1)
+        edges = np.array([np.linspace(lo, hi, 100) for lo, hi in zip(mins, maxes)])
+        counts = row_histograms(data, edges)
+        for row, row_edges, row_counts in zip(data, edges, counts):
+            self.assertTrue(np.all(np.histogram(row, row_edges)[0] == row_counts))
+
+    def test_binned_kernel_density(self):
+        samples = 3*np.random.randn(100000) + 1
+        points = np.linspace(-15, 15, 100)
+        expected = gaussian_kde(samples)(points)
+        self.assertTrue(np.max(np.abs(kernel_density(samples, points) - expected)) < 1e-3*np.max(expected))
+
+    def test_optimal_integration_time(self):
+        gnd, ex = generate_fake_data(3, np.pi/5, 1.6, N=2000)
+        ss = SSM(optimal_integration_time=True)
+        ss.ground_data = gnd
+        ss.excited_data = ex
+        ss.compute_filter()
+        # The shots hold their value from sample 3 to 102, so any point in there may come out best
+        self.assertTrue(3 <= ss.best_integration_time < 103)
+        self.assertTrue(np.abs(ss.fidelity_result.real - 0.96) < 0.05)
+
+class StateClassifierTestCase(unittest.TestCase):
+
+    def test_incremental_classifier(self):
+        gnd, ex = generate_fake_data(3, np.pi/5, 1.6, N=2000)
+        ss = SSM()
+        ss.ground_data = gnd
+        ss.excited_data = ex
+        ss.compute_filter()
+
+        records = np.vstack([gnd.T, ex.T])
+        states = np.hstack([np.zeros(gnd.shape[1]), np.ones(ex.shape[1])])
+        classifier = IncrementalStateClassifier(num_components=2)
+        classifier.set_basis(ss.kernel, records)
+        self.assertEqual(classifier.features(records).shape, (records.shape[0], 4))
+        classifier.fit(records, states)
+        self.assertTrue(np.mean(classifier.predict(records) == states) > 0.9)
+
+        # Refitting with much the same kernel keeps the basis and warm starts from the previous coefficients
+        model, basis = classifier.model, classifier.basis
+        kernel = ss.kernel + 1e-3*np.random.randn(len(ss.kernel))
+        self.assertFalse(classifier.needs_basis(kernel))
+        order = np.random.permutation(records.shape[0])
+        classifier.partial_fit(records[order], states[order])
+        self.assertTrue(classifier.model is model)
+        self.assertTrue(classifier.basis is basis)
+        self.assertTrue(np.mean(classifier.predict(records) == states) > 0.9)
+
+        # A different kernel means a different feature space, so the model starts over
+        kernel = np.roll(ss.kernel, 50)
+        self.assertTrue(classifier.needs_basis(kernel))
+        classifier.set_basis(kernel, records)
+        self.assertTrue(classifier.model is None)
 
 if __name__ == "__main__":
     gnd, ex = generate_fake_data(3, np.pi/5, 1.6, plot=True)